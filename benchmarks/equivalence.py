@@ -0,0 +1,442 @@
+import argparse
+import importlib
+import json
+import os
+import pickle
+import sys
+import time
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.lengths import leaf_height, leaf_width, paper_roi, px_counting, px_size
+from functions.reference import lengths as reference
+from functions.utils.occupancy import get_leaf_occupancy
+from functions.utils.rectangle import Rectangle
+from functions.utils.segment import Segment, SegmentArray
+
+# The measures checked, each with its current implementation (the default
+# candidate)
+CANDIDATES: dict[str, Callable[..., Any]] = {
+    "find_paper_margin": getattr(paper_roi, "__find_paper_margin"),
+    "count_paper_pixels": px_counting.count_paper_pixels,
+    "find_leaf_height": leaf_height.find_leaf_height,
+    "get_leaf_widths": leaf_width.get_leaf_widths,
+    "get_leaf_roi": leaf_width.get_leaf_roi,
+}
+
+# The rows and columns where get_px_size counts the paper pixels, as
+# fractions of the side of the image
+PX_COUNT_LEVELS = [0.4, 0.45, 0.5, 0.55, 0.6]
+
+
+def __brightness(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    gain, bias = rng.uniform(0.85, 1.15), rng.uniform(-15, 15)
+    return cv2.convertScaleAbs(img, alpha=gain, beta=bias)
+
+
+def __noise(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    noise = rng.normal(0, 4, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def __blur(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+
+def __rotation(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-1.5, 1.5), 1)
+    return cv2.warpAffine(img, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+
+def __jpeg(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    quality = int(rng.integers(60, 90))
+    _, data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def __scale(img: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    scale = rng.uniform(0.6, 0.9)
+    size = (round(img.shape[1] * scale), round(img.shape[0] * scale))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+# Changes that a photo of the same leaf could have: each perturbed image
+# applies one of them, in turn
+PERTURBATIONS: dict[str, Callable[[np.ndarray, np.random.Generator], np.ndarray]] = {
+    "brightness": __brightness,
+    "noise": __noise,
+    "blur": __blur,
+    "rotation": __rotation,
+    "jpeg": __jpeg,
+    "scale": __scale,
+}
+
+
+def load_candidate(spec: str) -> tuple[str, Callable[..., Any]]:
+    """
+    Loads an implementation to be checked in place of the current one
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - spec: as "measure=module:function", for example
+        "find_leaf_height=experiments.height:find_leaf_height". The
+        function takes the same arguments as the current implementation
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The name of the measure and the function
+    """
+
+    measure, _, target = spec.partition("=")
+    module, _, function = target.partition(":")
+    if measure not in CANDIDATES or module == "" or function == "":
+        raise ValueError(
+            f'Invalid candidate "{spec}": expected measure=module:function, '
+            f"with measure among {', '.join(CANDIDATES)}"
+        )
+    return measure, getattr(importlib.import_module(module), function)
+
+
+def compare_image(
+    img: np.ndarray,
+    candidates: dict[str, Callable[..., Any]],
+    tolerance: float,
+    results: dict[str, dict[str, Any]],
+) -> None:
+    """
+    Runs the reference and the candidate implementations of each measure
+    on an image, and adds the outcome to the results. Each side computes
+    the inputs of its measures with its own pipeline (the reference with
+    the frozen baseline steps, the candidate with the current ones), and
+    the results of its previous measures: the paper ROI, the leaf height
+    and the widths are also the inputs of the next measures
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - candidates: the implementation to be checked of each measure
+    - tolerance: the largest difference, in pixels, for two results to be
+        considered equivalent
+    - results: for each measure, the counts of exact, equivalent and
+        different results, the largest difference and the time taken by
+        the two implementations (updated)
+    """
+
+    # The inputs of the reference measures, as the baseline computed them
+    reference_th_img = reference.detect_lines(img)[1]
+    reference_roi = reference.roi_boundaries_as_rect(reference.find_roi_boundaries(img))
+    reference_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    reference_paper = reference.max_sat_min_val(reference_hsv, reference_roi)
+
+    # The inputs of the candidate measures, as the current extractor
+    # computes them
+    th_img = getattr(paper_roi, "__detect_lines")(img)[1]
+    roi = paper_roi.roi_boundaries_as_rect(paper_roi.find_roi_boundaries(img))
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    paper = getattr(px_size, "__max_sat_min_val")(hsv, roi)
+    occupancy = get_leaf_occupancy(img, roi)
+
+    __compare(
+        "find_paper_margin",
+        lambda: reference.find_paper_margin(reference_th_img),
+        lambda: candidates["find_paper_margin"](th_img),
+        tolerance,
+        results,
+    )
+
+    for vert in [False, True]:
+        orthogonal_size = img.shape[1] if vert else img.shape[0]
+        for fraction in PX_COUNT_LEVELS:
+            level = int(orthogonal_size * fraction)
+            __compare(
+                "count_paper_pixels",
+                lambda: reference.count_paper_pixels(
+                    reference_hsv, level, vert, *reference_paper
+                ),
+                lambda: candidates["count_paper_pixels"](hsv, level, vert, *paper),
+                tolerance,
+                results,
+            )
+
+    reference_height, height = __compare(
+        "find_leaf_height",
+        lambda: reference.find_leaf_height(img, reference_roi),
+        lambda: candidates["find_leaf_height"](occupancy, roi),
+        tolerance,
+        results,
+    )
+    if reference_height is None or height is None:
+        return
+
+    reference_widths, widths = __compare(
+        "get_leaf_widths",
+        lambda: reference.get_leaf_widths(img, reference_roi, reference_height),
+        lambda: candidates["get_leaf_widths"](occupancy, roi, height),
+        tolerance,
+        results,
+    )
+    if reference_widths is None or widths is None:
+        return
+
+    __compare(
+        "get_leaf_roi",
+        lambda: reference.get_leaf_roi(
+            img, reference_roi, reference_widths, reference_height
+        ),
+        lambda: candidates["get_leaf_roi"](occupancy, roi, widths, height),
+        tolerance,
+        results,
+    )
+
+
+def print_results(results: dict[str, dict[str, Any]], tolerance: float) -> None:
+    """
+    Prints the agreement and the speedup of each measure
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - results: the results, as filled by compare_image
+    - tolerance: the tolerance used
+    """
+
+    print(
+        f"{'measure':<20}{'calls':>7}{'exact':>7}{f'<= {tolerance:g} px':>10}"
+        f"{'different':>11}{'max diff':>10}{'reference':>12}{'candidate':>12}"
+        f"{'speedup':>9}"
+    )
+    for measure, res in results.items():
+        if res["calls"] == 0:
+            continue
+        print(
+            f"{measure:<20}{res['calls']:>7}{res['exact']:>7}"
+            f"{res['within_tolerance']:>10}{res['different']:>11}"
+            f"{res['max_difference']:>10.3g}"
+            f"{res['reference_seconds'] / res['calls'] * 1000:>9.2f} ms"
+            f"{res['candidate_seconds'] / res['calls'] * 1000:>9.2f} ms"
+            f"{res['speedup']:>8.2f}x"
+        )
+
+
+def __compare(
+    measure: str,
+    run_reference: Callable[[], Any],
+    run_candidate: Callable[[], Any],
+    tolerance: float,
+    results: dict[str, dict[str, Any]],
+) -> tuple[Any, Any]:
+    """
+    Runs the two implementations of a measure, and records whether they
+    agree (the result of the candidate after a pickle round trip, as when
+    it is sent to another process) and how long they took
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - measure: the name of the measure
+    - run_reference: runs the reference implementation
+    - run_candidate: runs the candidate implementation
+    - tolerance: the largest difference allowed, in pixels
+    - results: the results of all the measures (updated)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The results of the reference and of the candidate implementations
+    (each None if it raised an error)
+    """
+
+    reference_res, reference_seconds = __timed(run_reference)
+    candidate_res, candidate_seconds = __timed(run_candidate)
+    if not isinstance(candidate_res, Exception):
+        # The results are sent to other processes by the process pools:
+        # they must survive it unchanged
+        candidate_res = __timed(lambda: pickle.loads(pickle.dumps(candidate_res)))[0]
+
+    res = results[measure]
+    res["calls"] += 1
+    res["reference_seconds"] += reference_seconds
+    res["candidate_seconds"] += candidate_seconds
+    res["speedup"] = res["reference_seconds"] / max(res["candidate_seconds"], 1e-9)
+
+    if isinstance(reference_res, Exception) or isinstance(candidate_res, Exception):
+        # Both must fail, in the same way
+        if type(reference_res) is type(candidate_res):
+            res["exact"] += 1
+        else:
+            res["different"] += 1
+            print(f"{measure}: {reference_res!r} (reference), {candidate_res!r}")
+        return (
+            None if isinstance(reference_res, Exception) else reference_res,
+            None if isinstance(candidate_res, Exception) else candidate_res,
+        )
+
+    reference_values = __values(reference_res)
+    candidate_values = __values(candidate_res)
+    if reference_values.shape != candidate_values.shape:
+        difference = float("inf")
+    else:
+        difference = float(
+            np.max(np.abs(reference_values - candidate_values), initial=0)
+        )
+
+    res["max_difference"] = max(res["max_difference"], difference)
+    if difference == 0:
+        res["exact"] += 1
+    elif difference <= tolerance:
+        res["within_tolerance"] += 1
+    else:
+        res["different"] += 1
+        print(f"{measure}: {reference_res} (reference), {candidate_res}")
+
+    return reference_res, candidate_res
+
+
+def __timed(run: Callable[[], Any]) -> tuple[Any, float]:
+    """
+    Runs a function, catching its errors
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - run: the function
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Its result (or the error it raised), and the seconds it took
+    """
+
+    start = time.perf_counter()
+    try:
+        res = run()
+    except Exception as e:
+        res = e
+    return res, time.perf_counter() - start
+
+
+def __values(res: Any) -> np.ndarray:
+    """
+    Converts the result of a measure to an array of numbers, to be compared
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - res: a Segment, a SegmentArray, a tuple of Segments (the widths
+        measured by the reference), a Rectangle or a tuple of numbers
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The numbers that describe the result
+    """
+
+    if isinstance(res, Segment):
+        return np.array([res.corner, res.length], dtype=np.float64)
+    if isinstance(res, SegmentArray):
+        return np.concatenate([res.corners, res.lengths]).astype(np.float64)
+    if isinstance(res, tuple) and all(isinstance(s, Segment) for s in res):
+        # In the same order as a SegmentArray
+        return __values(SegmentArray.from_segments(list(res)))
+    if isinstance(res, Rectangle):
+        return np.concatenate([__values(res.get_horiz()), __values(res.get_vert())])
+    return np.asarray(res, dtype=np.float64).ravel()
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="equivalence")
+    args.add_argument(
+        "--images",
+        type=str,
+        default="./dataset/images",
+        help="the folder with one subfolder of images per plant",
+    )
+    args.add_argument(
+        "--perturbations",
+        type=int,
+        default=2,
+        help="the number of perturbed versions of each image also checked (default: 2)",
+    )
+    args.add_argument(
+        "--candidate",
+        type=str,
+        action="append",
+        default=[],
+        help="check this implementation of a measure instead of the current one, as measure=module:function (can be repeated)",
+    )
+    args.add_argument(
+        "--tolerance",
+        type=float,
+        default=0,
+        help="the largest difference, in pixels, for two results to be considered equivalent (default: 0, only exact results)",
+    )
+    args.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="the seed of the perturbations",
+    )
+    args.add_argument(
+        "--output",
+        type=str,
+        help="also write the results to this json file",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    candidates = dict(CANDIDATES)
+    for spec in parsed.candidate:
+        measure, function = load_candidate(spec)
+        candidates[measure] = function
+
+    results: dict[str, dict[str, Any]] = {
+        measure: {
+            "calls": 0,
+            "exact": 0,
+            "within_tolerance": 0,
+            "different": 0,
+            "max_difference": 0.0,
+            "reference_seconds": 0.0,
+            "candidate_seconds": 0.0,
+            "speedup": 1.0,
+        }
+        for measure in CANDIDATES
+    }
+
+    rng = np.random.default_rng(parsed.seed)
+    perturbations = list(PERTURBATIONS.items())
+    count = 0
+
+    for plant in sorted(os.listdir(parsed.images)):
+        for img_file_name in sorted(os.listdir(f"{parsed.images}/{plant}")):
+            img = cv2.imread(f"{parsed.images}/{plant}/{img_file_name}")
+            if img is None:
+                continue
+
+            variants = [("original", img)]
+            for _ in range(parsed.perturbations):
+                name, perturb = perturbations[count % len(perturbations)]
+                variants.append((name, perturb(img, rng)))
+                count += 1
+
+            for name, variant in variants:
+                print(f"{plant}/{img_file_name} ({name})")
+                compare_image(variant, candidates, parsed.tolerance, results)
+
+    print()
+    print_results(results, parsed.tolerance)
+
+    if parsed.output is not None:
+        with open(parsed.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    # Usable as a check before merging
+    if any(res["different"] > 0 for res in results.values()):
+        sys.exit(1)
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.features import ImageFeatures
+from functions.classifiers.bayes.classifier import (
+    BAYES_load_model,
+    BAYES_model_features,
+    FEATURE_COSTS_PATH,
+)
+
+
+def measure_feature_costs(images: list[str], tip_estimator: str) -> dict[str, float]:
+    """
+    Measures how long it takes to extract each feature of the model from
+    scratch (including the internal values it depends on)
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - images: the paths of the images to be measured
+    - tip_estimator: the algorithm that measures the tip angle
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A dict that associates each feature to its median extraction time
+    over the images, in ms
+    """
+
+    features = BAYES_model_features(BAYES_load_model())
+    times: dict[str, list[float]] = {feature: [] for feature in features}
+
+    for img_path in images:
+        for feature in features:
+            img = ImageFeatures(img_path, tip_estimator)
+            start = time.perf_counter()
+            img.get_feature_vector([feature])
+            times[feature].append((time.perf_counter() - start) * 1000)
+
+        print(
+            f"{img_path}: "
+            + ", ".join(f"{feature} {times[feature][-1]:.0f}" for feature in features)
+        )
+
+    return {feature: statistics.median(times[feature]) for feature in features}
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="feature_cost")
+    args.add_argument(
+        "images",
+        type=str,
+        nargs="+",
+        help="the images on which the features are measured",
+    )
+    args.add_argument(
+        "--tip",
+        type=str,
+        choices=["hough", "contour"],
+        default="hough",
+        help="the algorithm that measures the tip angle",
+    )
+    args.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=FEATURE_COSTS_PATH,
+        help=f"the json file where to write the costs (default: {FEATURE_COSTS_PATH})",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    costs = measure_feature_costs(parsed.images, parsed.tip)
+
+    print()
+    for feature, cost in sorted(costs.items(), key=lambda x: x[1]):
+        print(f"{feature:<16} {cost:9.1f} ms")
+
+    with open(parsed.output, "w") as f:
+        json.dump(costs, f, indent=4)
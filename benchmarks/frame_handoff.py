@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.utils.shared_frames import SharedFramePool
+
+
+def __corner_px(img: np.ndarray) -> int:
+    """
+    A worker that does (almost) nothing, so that only the cost of handing
+    the image to the worker is measured
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The blue value of the top-left pixel
+    """
+    return int(img[0, 0, 0])
+
+
+def compare_handoffs(images: list[str], workers: int) -> None:
+    """
+    Sends some images to a pool of processes, first by pickling them and
+    then through SharedFramePool, and prints the time per image of both
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - images: the paths of the images
+    - workers: the number of worker processes
+    """
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(__corner_px, cv2.imread(path)) for path in images]
+        pickled = [future.result() for future in futures]
+    pickle_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with SharedFramePool(__corner_px, workers) as pool:
+        shared = [result for _, result in pool.map((path, ()) for path in images)]
+    shared_time = time.perf_counter() - start
+
+    if pickled != shared:
+        raise Exception("The two handoffs gave different results")
+
+    print(f"pickle:        {pickle_time / len(images) * 1000:8.1f} ms per image")
+    print(f"shared memory: {shared_time / len(images) * 1000:8.1f} ms per image")
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="frame_handoff")
+    args.add_argument(
+        "images",
+        type=str,
+        nargs="+",
+        help="the images to be sent to the workers",
+    )
+    args.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=2,
+        help="the number of worker processes",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    compare_handoffs(parsed.images, parsed.jobs)
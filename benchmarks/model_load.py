@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.classifiers.bayes.classifier import (
+    BAYES_MODEL_PATH,
+    BAYES_load_model,
+    BAYES_model_features,
+    BAYES_classify_vector,
+    BAYES_store_binary_model,
+)
+
+
+def __synthetic_model(model: dict, plants: int) -> dict:
+    """
+    Builds a model with the same features and bins of a real one, but with
+    many more (random) plants
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - model: the real model
+    - plants: the number of plants of the new model
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The new model, in the json format
+    """
+
+    rng = np.random.default_rng(0)
+    names = [f"plant {i}" for i in range(plants)]
+
+    res = {
+        "discretization": model["discretization"],
+        "P(X|C)": {},
+        "P(C)": dict.fromkeys(names, 1 / plants),
+    }
+    for feature, discretization in model["discretization"].items():
+        res["P(X|C)"][feature] = {}
+        for name in names:
+            P = rng.random(discretization["num_bins"]) + 0.01
+            res["P(X|C)"][feature][name] = (P / P.sum()).tolist()
+    return res
+
+
+def compare_loads(path: str, repeat: int) -> None:
+    """
+    Loads a model, and classifies a leaf with it, first from the json file
+    and then from the binary one, and prints the time taken by both
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the json model
+    - repeat: how many times the model is loaded
+    """
+
+    BAYES_store_binary_model(path)
+    values = [
+        edges["bin_edges"][len(edges["bin_edges"]) // 2]
+        for edges in BAYES_load_model(path)["discretization"].values()
+    ]
+
+    for binary in [False, True]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model = BAYES_load_model(path, binary)
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            BAYES_classify_vector(values, model)
+        classify_time = time.perf_counter() - start
+
+        print(
+            f"  {'binary' if binary else 'json':6}: "
+            f"load {load_time / repeat * 1000:8.2f} ms, "
+            f"classify {classify_time / repeat * 1000:8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="model_load")
+    args.add_argument(
+        "--plants",
+        type=int,
+        nargs="*",
+        default=[1000, 10000],
+        help="the numbers of plants of the synthetic models also measured",
+    )
+    args.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=10,
+        help="how many times each model is loaded",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    model = BAYES_load_model(BAYES_MODEL_PATH)
+    with tempfile.TemporaryDirectory() as folder:
+        json_path = os.path.join(folder, "bayes.json")
+        with open(json_path, "w") as f:
+            json.dump(model, f)
+        print(
+            f"{len(model['P(C)'])} plants, {len(BAYES_model_features(model))} features"
+        )
+        compare_loads(json_path, parsed.repeat)
+
+        for plants in parsed.plants:
+            with open(json_path, "w") as f:
+                json.dump(__synthetic_model(model, plants), f)
+            print(f"{plants} plants (synthetic)")
+            compare_loads(json_path, parsed.repeat)
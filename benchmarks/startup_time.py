@@ -0,0 +1,152 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# The arguments of main.py that run each subcommand on an input that does
+# nothing: they are run in a folder with an empty dataset, a copy of the
+# model, an empty file ("empty.jpg", not an image), a black image
+# ("black.png", with no paper sheet) and an empty folder of images.
+# update and correlation stop with an error on the empty dataset, once
+# they have loaded everything they need
+SUBCOMMANDS: dict[str, list[str]] = {
+    "--help": ["--help"],
+    "update": ["update"],
+    "calibrate": ["calibrate", "--img", "empty.jpg", "--name", "startup"],
+    "rmfeature": ["rmfeature", "--feature", "startup"],
+    "classify": ["classify", "--dir", "images"],
+    "classify -m": ["classify", "--multi", "--img", "empty.jpg"],
+    "stream": ["stream", "--video", "black.png"],
+    "correlation": ["correlation"],
+}
+
+
+def __prepare_folder(folder: str) -> None:
+    """
+    Creates the files the subcommands are run on
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - folder: the folder the subcommands are run in
+    """
+
+    import cv2
+    import numpy as np
+
+    for subfolder in ["images", "descriptions", "plant_recaps"]:
+        os.makedirs(f"{folder}/dataset/{subfolder}")
+    os.makedirs(f"{folder}/images")
+    shutil.copytree(
+        f"{ROOT}/classification_models_data",
+        f"{folder}/classification_models_data",
+    )
+    open(f"{folder}/empty.jpg", "w").close()
+    cv2.imwrite(f"{folder}/black.png", np.zeros((64, 64, 3), np.uint8))
+
+
+def __measure_imports(folder: str, args: list[str]) -> tuple[float, dict[str, int]]:
+    """
+    Runs a subcommand of main.py in a fresh interpreter, and measures how
+    long its imports take
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - folder: the folder the subcommand is run in
+    - args: the arguments of main.py
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - the total import time, in ms
+    - a dict that associates each top-level module imported to its
+        cumulative import time, in us
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", f"{ROOT}/main.py", *args],
+        cwd=folder,
+        capture_output=True,
+        text=True,
+    )
+
+    # Each line of -X importtime is "import time: self | cumulative | name",
+    # where nested imports are indented in name
+    cumulative: dict[str, int] = {}
+    errors: list[str] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            errors.append(line)
+            continue
+        if "cumulative" in line:
+            continue
+        _, cumul, name = line[len("import time:") :].split("|")
+        if not name.startswith("  "):
+            cumulative[name.strip()] = int(cumul)
+
+    if result.returncode != 0 and any(
+        line.startswith(("ImportError", "ModuleNotFoundError")) for line in errors
+    ):
+        raise Exception(
+            f'"main.py {" ".join(args)}" failed to import its modules:\n'
+            + "\n".join(errors)
+        )
+
+    return sum(cumulative.values()) / 1000, cumulative
+
+
+def benchmark_startup(repeat: int, top: int) -> None:
+    """
+    Prints, for each subcommand of main.py, the time spent importing the
+    modules it needs, as the median of several fresh interpreters
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - repeat: how many times to measure each subcommand
+    - top: how many of the most expensive modules to list per subcommand
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        __prepare_folder(folder)
+
+        for command, args in SUBCOMMANDS.items():
+            runs = [__measure_imports(folder, args) for _ in range(repeat)]
+            total = statistics.median([run[0] for run in runs])
+
+            print(f"{command:<12} {total:9.1f} ms")
+
+            # The module times of the median run
+            median_run = sorted(runs, key=lambda run: run[0])[len(runs) // 2][1]
+            heaviest = sorted(median_run.items(), key=lambda x: x[1], reverse=True)
+            for name, cumul in heaviest[:top]:
+                print(f"    {cumul / 1000:9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="startup_time")
+    args.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=5,
+        help="how many times to measure each subcommand",
+    )
+    args.add_argument(
+        "--top",
+        "-t",
+        type=int,
+        default=3,
+        help="how many of the most expensive modules to list per subcommand",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    benchmark_startup(parsed.repeat, parsed.top)
@@ -0,0 +1,945 @@
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.lengths.px_size import A4_HEIGHT_MM, A4_WIDTH_MM
+from functions.utils.leaf import MAX_LEAF_HUE, MAX_LEAF_VAL, MIN_LEAF_HUE, MIN_LEAF_SAT
+from functions.utils.rectangle import Rectangle
+
+# The outlines of the leaves, as the half width along the midrib, from the
+# base (t = 0) to the tip (t = 1): t^base * (1 - t)^tip, scaled to
+# aspect * length / 2 at its widest, then narrowed by the lobes (depth
+# times sin^2 of lobes half waves) and by the teeth (a saw of teeth teeth,
+# depth deep). Each tuple is (base, tip, aspect, lobes, lobe depth, teeth,
+# tooth depth)
+SHAPES: dict[str, tuple[float, float, float, int, float, int, float]] = {
+    "elliptic": (0.7, 0.7, 0.5, 0, 0.0, 0, 0.0),
+    "ovate": (0.5, 1.0, 0.6, 0, 0.0, 0, 0.0),
+    "obovate": (1.0, 0.5, 0.55, 0, 0.0, 0, 0.0),
+    "lanceolate": (0.6, 1.3, 0.22, 0, 0.0, 0, 0.0),
+    "lobed": (0.8, 0.8, 0.75, 5, 0.35, 0, 0.0),
+    "serrate": (0.7, 0.8, 0.45, 0, 0.0, 28, 0.06),
+}
+
+# Points of each side of the outline of a leaf
+OUTLINE_POINTS = 600
+
+# Paper left free along the sides of the sheet, in mm, so that the leaves
+# are inside the paper ROI
+SHEET_MARGIN_MM = 25
+
+# Bits of precision of the coordinates given to fillPoly
+FILL_POLY_SHIFT = 4
+
+# The widths of the leaf that are features (width_0perc, width_20perc, ...),
+# as fractions of the height from the top (the tip)
+WIDTH_FRACTIONS = [index / 10 for index in range(0, 11, 2)]
+
+
+class SyntheticPlant:
+    """
+    A synthetic species: the shape, the size and the color around which its
+    leaves vary
+    """
+
+    def __init__(
+        self, name: str, shape: str, length: float, hsv: tuple[int, int, int]
+    ) -> None:
+        """
+        Creates a new species
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - name: the name, used as folder of its images
+        - shape: the outline of its leaves, among the keys of SHAPES
+        - length: the mean length of its leaves, in mm
+        - hsv: the mean color of its leaves, in HSV
+        """
+        self.name = name
+        self.shape = shape
+        self.length = length
+        self.hsv = hsv
+
+    def to_JSON(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "shape": self.shape,
+            "length": self.length,
+            "hsv": list(self.hsv),
+        }
+
+
+class SceneGenerator:
+    """
+    Renders photos of A4 sheets on a dark background, with leaf-like
+    polygons in the color range accepted by get_leaf_mask, together with
+    the true values of the measures of the pipeline.
+    The scene of an image depends only on the seed, the plant and the
+    index of the image, so that images can be rendered in any order and by
+    any number of processes
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        resolution: tuple[int, int] = (3000, 4000),
+        fill: tuple[float, float] = (0.75, 0.9),
+        rotation: float = 0.5,
+        perspective: float = 0.002,
+        background: tuple[int, int] = (10, 60),
+        noise: float = 3.0,
+        blur: float = 0.7,
+        shapes: Optional[list[str]] = None,
+        length: tuple[float, float] = (50.0, 180.0),
+        hue: tuple[int, int] = (20, 60),
+        sat: tuple[int, int] = (120, 230),
+        val: tuple[int, int] = (40, 130),
+        leaves: int = 1,
+    ) -> None:
+        """
+        Creates a new generator
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - seed: the seed of all the random choices
+        - resolution: the width and the height of the images, in pixels
+        - fill: the range of the fraction of the image covered by the side
+            of the sheet that fits it most tightly
+        - rotation: the maximum rotation of the sheet, in degrees
+        - perspective: the maximum displacement of each corner of the
+            sheet, as a fraction of its size
+        - background: the range of the gray level of the background
+        - noise: the standard deviation of the noise of the sensor
+        - blur: the standard deviation of the blur of the lens, in pixels
+            (0 for none)
+        - shapes: the outlines the plants are chosen from (None for all the
+            keys of SHAPES)
+        - length: the range of the length of the leaves, in mm
+        - hue, sat, val: the ranges of the color of the leaves, in HSV.
+            They must be within the range accepted by get_leaf_mask
+        - leaves: the number of leaves on each sheet
+        """
+
+        if shapes is None:
+            shapes = list(SHAPES)
+        for shape in shapes:
+            if shape not in SHAPES:
+                raise ValueError(f'Unknown shape "{shape}"')
+        for name, (low, high), (min_value, max_value) in [
+            ("hue", hue, (MIN_LEAF_HUE + 1, MAX_LEAF_HUE)),
+            ("saturation", sat, (MIN_LEAF_SAT + 1, 255)),
+            ("value", val, (0, MAX_LEAF_VAL)),
+        ]:
+            if low > high or low < min_value or high > max_value:
+                raise ValueError(
+                    f"The {name} of the leaves must be within [{min_value}, {max_value}]"
+                )
+
+        self.seed = seed
+        self.resolution = resolution
+        self.fill = fill
+        self.rotation = rotation
+        self.perspective = perspective
+        self.background = background
+        self.noise = noise
+        self.blur = blur
+        self.shapes = shapes
+        self.length = length
+        self.hue = hue
+        self.sat = sat
+        self.val = val
+        self.leaves = leaves
+
+    def to_JSON(self) -> dict[str, Any]:
+        return {
+            "seed": self.seed,
+            "resolution": list(self.resolution),
+            "fill": list(self.fill),
+            "rotation": self.rotation,
+            "perspective": self.perspective,
+            "background": list(self.background),
+            "noise": self.noise,
+            "blur": self.blur,
+            "shapes": self.shapes,
+            "length": list(self.length),
+            "hue": list(self.hue),
+            "sat": list(self.sat),
+            "val": list(self.val),
+            "leaves": self.leaves,
+        }
+
+    def plant(self, index: int) -> SyntheticPlant:
+        """
+        Chooses a species
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - index: the index of the species
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The species, always the same for the same seed and index
+        """
+
+        rng = np.random.default_rng([self.seed, index])
+        return SyntheticPlant(
+            f"synthetic_{index:03d}",
+            self.shapes[index % len(self.shapes)],
+            float(rng.uniform(*self.length)),
+            (
+                int(rng.integers(self.hue[0], self.hue[1] + 1)),
+                int(rng.integers(self.sat[0], self.sat[1] + 1)),
+                int(rng.integers(self.val[0], self.val[1] + 1)),
+            ),
+        )
+
+    def render(
+        self, plant: SyntheticPlant, plant_index: int, index: int
+    ) -> tuple[np.ndarray, dict[str, Any]]:
+        """
+        Renders an image of a species
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plant: the species
+        - plant_index: the index of the species
+        - index: the index of the image among those of the species
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The image, in BGR, and its ground truth: the pose of the sheet, the
+        true size of the pixels at the center of the image and, for each
+        leaf, its bounding box in the image and the true values of the
+        features (lengths in mm, perimeter and convexity in pixels, as
+        measured by the pipeline)
+        """
+
+        rng = np.random.default_rng([self.seed, plant_index, index])
+        width, height = self.resolution
+
+        # Pose of the sheet: scale (px per mm), rotation, position and the
+        # displacement of its corners
+        scale = rng.uniform(*self.fill) * min(
+            width / A4_WIDTH_MM, height / A4_HEIGHT_MM
+        )
+        angle = math.radians(rng.uniform(-self.rotation, self.rotation))
+        sheet_mm = np.array(
+            [[0, 0], [A4_WIDTH_MM, 0], [A4_WIDTH_MM, A4_HEIGHT_MM], [0, A4_HEIGHT_MM]],
+            np.float32,
+        )
+        rotation = np.array(
+            [[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]]
+        )
+        corners = (sheet_mm - sheet_mm.mean(axis=0)) * scale @ rotation.T
+        free = np.array([width, height]) - (corners.max(axis=0) - corners.min(axis=0))
+        center = np.array([width, height]) / 2 + rng.uniform(-0.4, 0.4, 2) * free
+        corners += center + rng.uniform(-1, 1, (4, 2)) * self.perspective * (
+            np.array([A4_WIDTH_MM, A4_HEIGHT_MM]) * scale
+        )
+        homography = cv2.getPerspectiveTransform(sheet_mm, corners.astype(np.float32))
+
+        # The sheet with the leaves, at scale px per mm, then warped on
+        # the background
+        sheet = self.__render_paper(rng, scale)
+        leaves = []
+        for cell in self.__leaf_cells():
+            outline, hsv, shape = self.__leaf_outline(rng, plant, cell)
+            self.__paint_leaf(rng, sheet, outline * scale, hsv)
+            leaves.append(self.__leaf_truth(outline, homography, hsv, shape))
+
+        img = np.empty((height, width, 3), np.uint8)
+        level = rng.integers(*self.background, endpoint=True)
+        img[:] = (level, level + rng.integers(0, 6), level + rng.integers(0, 6))
+        cv2.warpPerspective(
+            sheet,
+            homography @ np.diag([1 / scale, 1 / scale, 1]),
+            (width, height),
+            dst=img,
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_TRANSPARENT,
+        )
+        del sheet
+
+        if self.blur > 0:
+            cv2.GaussianBlur(img, (0, 0), self.blur, dst=img)
+        if self.noise > 0:
+            noise = np.empty(img.shape, np.int16)
+            cv2.setRNGSeed(int(rng.integers(2**31)))
+            cv2.randn(noise, 0, self.noise)
+            cv2.add(img, noise, dst=img, dtype=cv2.CV_8U)
+
+        px_width_in_mm, px_height_in_mm = self.__px_size(homography)
+        return img, {
+            "plant": plant.name,
+            "sheet": {
+                "corners": corners.tolist(),
+                "rotation": math.degrees(angle),
+                "scale": scale,
+            },
+            "px_width_in_mm": px_width_in_mm,
+            "px_height_in_mm": px_height_in_mm,
+            "leaves": leaves,
+        }
+
+    def __render_paper(self, rng: np.random.Generator, scale: float) -> np.ndarray:
+        """
+        Renders the empty sheet, white with a soft shading
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - rng: the random generator of the image
+        - scale: the pixels per mm
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The sheet, in BGR
+        """
+
+        width, height = round(A4_WIDTH_MM * scale), round(A4_HEIGHT_MM * scale)
+        # Slightly warm or cold, never colored enough to pass for a leaf
+        paper = rng.integers(220, 246) + rng.integers(-4, 5, 3)
+        # Up to 8 levels darker or lighter at the opposite corners
+        slope = rng.uniform(-8, 8, 2)
+        shading = (
+            np.linspace(-1, 1, width, dtype=np.float32)[None, :] * slope[0]
+            + np.linspace(-1, 1, height, dtype=np.float32)[:, None] * slope[1]
+        )
+        sheet = np.empty((height, width, 3), np.uint8)
+        for channel in range(3):
+            sheet[:, :, channel] = np.clip(paper[channel] + shading, 0, 255)
+        return sheet
+
+    def __leaf_cells(self) -> list[tuple[float, float, float, float]]:
+        """
+        Divides the sheet (without its margins) in a grid of cells, one for
+        each leaf
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The cells, as (left, top, width, height) in mm
+        """
+
+        cols = math.ceil(math.sqrt(self.leaves))
+        rows = math.ceil(self.leaves / cols)
+        cell_width = (A4_WIDTH_MM - 2 * SHEET_MARGIN_MM) / cols
+        cell_height = (A4_HEIGHT_MM - 2 * SHEET_MARGIN_MM) / rows
+        return [
+            (
+                SHEET_MARGIN_MM + (index % cols) * cell_width,
+                SHEET_MARGIN_MM + (index // cols) * cell_height,
+                cell_width,
+                cell_height,
+            )
+            for index in range(self.leaves)
+        ]
+
+    def __leaf_outline(
+        self,
+        rng: np.random.Generator,
+        plant: SyntheticPlant,
+        cell: tuple[float, float, float, float],
+    ) -> tuple[np.ndarray, tuple[int, int, int], str]:
+        """
+        Draws a leaf of a species, with the tip at the top, in a cell of
+        the sheet
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - rng: the random generator of the image
+        - plant: the species
+        - cell: the cell, as (left, top, width, height) in mm
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The outline of the leaf, as points in mm on the sheet, its color in
+        HSV and its shape
+        """
+
+        base, tip, aspect, lobes, lobe_depth, teeth, tooth_depth = SHAPES[plant.shape]
+        aspect *= rng.uniform(0.95, 1.05)
+        skew = rng.uniform(-0.08, 0.08)
+
+        t = np.linspace(0, 1, OUTLINE_POINTS)
+        half_width = t**base * (1 - t) ** tip
+        half_width /= half_width.max()
+        half_width *= 1 - lobe_depth * np.sin(np.pi * lobes * t) ** 2
+        half_width *= 1 - tooth_depth * ((teeth * t) % 1)
+
+        # Fits the cell (with some paper around), keeping the proportions
+        left, top, cell_width, cell_height = cell
+        length = min(
+            plant.length * rng.uniform(0.9, 1.1),
+            0.85 * cell_height,
+            0.85 * cell_width / (aspect * (1 + abs(skew))),
+        )
+        half_width *= aspect * length / 2
+        free_x = cell_width - aspect * length * (1 + abs(skew))
+        free_y = cell_height - length
+        x = left + cell_width / 2 + rng.uniform(-0.3, 0.3) * free_x
+        y = top + free_y / 2 + rng.uniform(-0.3, 0.3) * free_y
+
+        rows = y + length * (1 - t)
+        right = np.stack([x + half_width * (1 - skew), rows], axis=1)
+        left_side = np.stack([x - half_width * (1 + skew), rows], axis=1)[::-1]
+
+        hsv = (
+            int(np.clip(plant.hsv[0] + rng.integers(-2, 3), *self.hue)),
+            int(np.clip(plant.hsv[1] + rng.integers(-8, 9), *self.sat)),
+            int(np.clip(plant.hsv[2] + rng.integers(-6, 7), *self.val)),
+        )
+        return np.concatenate([right, left_side]), hsv, plant.shape
+
+    def __paint_leaf(
+        self,
+        rng: np.random.Generator,
+        sheet: np.ndarray,
+        outline: np.ndarray,
+        hsv: tuple[int, int, int],
+    ) -> None:
+        """
+        Paints a leaf on the sheet, with a texture that stays in the color
+        range accepted by get_leaf_mask
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - rng: the random generator of the image
+        - sheet: the sheet, in BGR (modified)
+        - outline: the outline of the leaf, in pixels of the sheet
+        - hsv: the mean color of the leaf, in HSV
+        """
+
+        x, y, w, h = cv2.boundingRect(outline.astype(np.float32))
+        mask = np.zeros((h + 1, w + 1), np.uint8)
+        points = np.round((outline - (x, y)) * (1 << FILL_POLY_SHIFT)).astype(np.int32)
+        cv2.fillPoly(mask, [points], 255, cv2.LINE_8, FILL_POLY_SHIFT)
+
+        texture = np.empty((h + 1, w + 1, 3), np.int16)
+        texture[:] = hsv
+        texture += rng.normal(0, (1, 6, 5), texture.shape).astype(np.int16)
+        texture[:, :, 0].clip(MIN_LEAF_HUE + 1, MAX_LEAF_HUE, out=texture[:, :, 0])
+        texture[:, :, 1].clip(MIN_LEAF_SAT + 1, 255, out=texture[:, :, 1])
+        texture[:, :, 2].clip(0, MAX_LEAF_VAL, out=texture[:, :, 2])
+        bgr = cv2.cvtColor(texture.astype(np.uint8), cv2.COLOR_HSV2BGR)
+
+        region = sheet[y : y + h + 1, x : x + w + 1]
+        np.copyto(
+            region,
+            bgr[: region.shape[0], : region.shape[1]],
+            where=(mask > 0)[: region.shape[0], : region.shape[1], None],
+        )
+
+    def __leaf_truth(
+        self,
+        outline: np.ndarray,
+        homography: np.ndarray,
+        hsv: tuple[int, int, int],
+        shape: str,
+    ) -> dict[str, Any]:
+        """
+        Computes the true values of the features of a leaf
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - outline: the outline of the leaf, in mm on the sheet
+        - homography: maps the sheet (in mm) to the image
+        - hsv: the mean color of the leaf, in HSV
+        - shape: the shape of the leaf
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The shape, the bounding box in the image and the features of the
+        leaf, with the same names of the descriptions of the dataset
+        """
+
+        right, left = outline[:OUTLINE_POINTS], outline[OUTLINE_POINTS:][::-1]
+        extents = right[:, 0] - left[:, 0]
+        leaf_height = float(right[0, 1] - right[-1, 1])
+        max_width = float(right[:, 0].max() - left[:, 0].min())
+
+        # The rows go from the base (bottom) to the tip (top)
+        from_top = (right[:, 1] - right[-1, 1])[::-1] / leaf_height
+        widths = np.interp(WIDTH_FRACTIONS, from_top, extents[::-1]) / max_width
+
+        img_outline = cv2.perspectiveTransform(
+            outline[None].astype(np.float64), homography
+        )[0].astype(np.float32)
+        x, y, w, h = cv2.boundingRect(img_outline)
+        area = cv2.contourArea(img_outline)
+
+        features: dict[str, Any] = {
+            "height": leaf_height,
+            "max_width": max_width,
+            "leaf_convexity": cv2.contourArea(cv2.convexHull(img_outline)) - area,
+            "perimeter": cv2.arcLength(img_outline, True),
+        }
+        for fraction, width in zip(WIDTH_FRACTIONS, widths):
+            features[f"width_{round(fraction * 100)}perc"] = float(width)
+        (
+            features["avg_color_hue"],
+            features["avg_color_sat"],
+            features["avg_color_val"],
+        ) = hsv
+
+        return {
+            "shape": shape,
+            "bounding_box": Rectangle.from_values(y, x, w, h).to_JSON(),
+            "features": features,
+        }
+
+    def __px_size(self, homography: np.ndarray) -> tuple[float, float]:
+        """
+        Computes the true size of the pixels at the center of the image
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - homography: maps the sheet (in mm) to the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The width and the height of a pixel, in mm on the sheet
+        """
+
+        x, y = self.resolution[0] / 2, self.resolution[1] / 2
+        points = np.array([[[x - 0.5, y], [x + 0.5, y], [x, y - 0.5], [x, y + 0.5]]])
+        mm = cv2.perspectiveTransform(points, np.linalg.inv(homography))[0]
+        return (
+            float(np.linalg.norm(mm[1] - mm[0])),
+            float(np.linalg.norm(mm[3] - mm[2])),
+        )
+
+
+def generate_dataset(
+    generator: SceneGenerator,
+    output: str,
+    plants: int,
+    images: int,
+    quality: int = 90,
+    workers: Optional[int] = None,
+) -> None:
+    """
+    Renders a synthetic dataset, with the layout of ./dataset: the images
+    in output/dataset/images/<plant>, the ground truth of each image in
+    output/dataset/ground_truth/<plant>. Running the commands of main.py
+    from output uses it in place of the real one.
+    Images whose ground truth already exists are not rendered again, so
+    that an interrupted run can be continued
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - generator: renders the images
+    - output: the folder of the dataset
+    - plants: the number of species
+    - images: the number of images of each species
+    - quality: the JPEG quality of the images
+    - workers: the number of processes that render the images (None for
+        one per CPU)
+    """
+
+    species = [generator.plant(index) for index in range(plants)]
+    for plant in species:
+        os.makedirs(f"{output}/dataset/images/{plant.name}", exist_ok=True)
+        os.makedirs(f"{output}/dataset/ground_truth/{plant.name}", exist_ok=True)
+    os.makedirs(f"{output}/dataset/descriptions", exist_ok=True)
+    os.makedirs(f"{output}/dataset/plant_recaps", exist_ok=True)
+    # Where update writes the model trained on the dataset
+    os.makedirs(f"{output}/classification_models_data", exist_ok=True)
+
+    with open(f"{output}/dataset/synthetic.json", "w") as f:
+        json.dump(
+            {
+                "generator": generator.to_JSON(),
+                "plants": [plant.to_JSON() for plant in species],
+            },
+            f,
+            indent=4,
+        )
+
+    tasks = [
+        (generator, species[plant_index], plant_index, index, output, quality)
+        for plant_index in range(plants)
+        for index in range(images)
+    ]
+    with ProcessPoolExecutor(workers) as executor:
+        for done, _ in enumerate(
+            executor.map(__render_to_files, tasks, chunksize=16), start=1
+        ):
+            if done % 100 == 0 or done == len(tasks):
+                print(f"\rRendered {done}/{len(tasks)} images", end="", flush=True)
+    print()
+
+
+def check_accuracy(
+    output: str, limit: Optional[int] = None, workers: Optional[int] = None
+) -> dict[str, Any]:
+    """
+    Measures the images of a synthetic dataset with ImageFeatures, and
+    compares the values to the ground truth. Only images with a single
+    leaf are considered
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - output: the folder of the dataset
+    - limit: the maximum number of images of each species (None for all)
+    - workers: the number of processes that measure the images (None for
+        one per CPU)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    For each measure, the number of images, the mean and the largest
+    absolute error, and the mean and the largest relative error (in %,
+    over the images where the true value is not 0; None if it is 0 in all
+    of them); then the number of images that could not be measured
+    """
+
+    truths: list[dict[str, Any]] = []
+    img_paths: list[str] = []
+
+    truth_folder = f"{output}/dataset/ground_truth"
+    for plant in sorted(os.listdir(truth_folder)):
+        files = sorted(os.listdir(f"{truth_folder}/{plant}"))[:limit]
+        for file_name in files:
+            with open(f"{truth_folder}/{plant}/{file_name}", "r") as f:
+                truth = json.load(f)
+            if len(truth["leaves"]) != 1:
+                continue
+
+            truths.append(truth)
+            img_paths.append(
+                f"{output}/dataset/images/{plant}/{os.path.splitext(file_name)[0]}.jpg"
+            )
+
+    errors: dict[str, list[tuple[float, Optional[float]]]] = {}
+    failures = 0
+
+    with ProcessPoolExecutor(workers) as executor:
+        for img_path, truth, values in zip(
+            img_paths, truths, executor.map(__measure, img_paths)
+        ):
+            if isinstance(values, str):
+                print(f"{img_path}: {values}")
+                failures += 1
+                continue
+
+            expected = {
+                "px_width_in_mm": truth["px_width_in_mm"],
+                "px_height_in_mm": truth["px_height_in_mm"],
+                **truth["leaves"][0]["features"],
+            }
+            for measure, value in expected.items():
+                error = abs(values[measure] - value)
+                errors.setdefault(measure, []).append(
+                    (error, error / abs(value) * 100 if value != 0 else None)
+                )
+
+    measures: dict[str, dict[str, Any]] = {}
+    for measure, values in errors.items():
+        # The relative error is not defined where the true value is 0
+        relative = [r for _, r in values if r is not None]
+        measures[measure] = {
+            "images": len(values),
+            "mean_error": statistics.fmean(e for e, _ in values),
+            "max_error": max(e for e, _ in values),
+            "mean_relative_error": (
+                statistics.fmean(relative) if len(relative) > 0 else None
+            ),
+            "max_relative_error": max(relative) if len(relative) > 0 else None,
+        }
+
+    return {"measures": measures, "failures": failures}
+
+
+def print_accuracy(accuracy: dict[str, Any]) -> None:
+    """
+    Prints the errors of the measures
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - accuracy: the errors, as returned by check_accuracy
+    """
+
+    print(
+        f"{'measure':<18}{'images':>8}{'mean error':>14}{'max error':>14}"
+        f"{'mean rel':>10}{'max rel':>10}"
+    )
+    for measure, res in accuracy["measures"].items():
+        relative = "".join(
+            f"{'N/A':>10}" if res[key] is None else f"{res[key]:>9.2f}%"
+            for key in ["mean_relative_error", "max_relative_error"]
+        )
+        print(
+            f"{measure:<18}{res['images']:>8}{res['mean_error']:>14.4g}"
+            f"{res['max_error']:>14.4g}{relative}"
+        )
+    print(f"Images that could not be measured: {accuracy['failures']}")
+
+
+def __measure(img_path: str) -> dict[str, Any] | str:
+    """
+    Measures an image with ImageFeatures
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img_path: the path of the image
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The internal values and the features, or the error that prevented
+    measuring them
+    """
+
+    from functions.features import ImageFeatures
+
+    try:
+        measured = ImageFeatures(img_path).to_JSON()
+    except Exception as e:
+        return repr(e)
+    return {**measured["internal"], **measured["features"]}
+
+
+def __render_to_files(
+    task: tuple[SceneGenerator, SyntheticPlant, int, int, str, int],
+) -> None:
+    """
+    Renders an image and writes it, with its ground truth (written last,
+    to mark the image as complete)
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - task: the generator, the species, its index, the index of the
+        image, the folder of the dataset and the JPEG quality
+    """
+
+    generator, plant, plant_index, index, output, quality = task
+    truth_path = f"{output}/dataset/ground_truth/{plant.name}/{index:06d}.json"
+    if os.path.exists(truth_path):
+        return
+
+    img, truth = generator.render(plant, plant_index, index)
+    cv2.imwrite(
+        f"{output}/dataset/images/{plant.name}/{index:06d}.jpg",
+        img,
+        [cv2.IMWRITE_JPEG_QUALITY, quality],
+    )
+    with open(truth_path, "w") as f:
+        json.dump(truth, f)
+
+
+def __pair(value: str, cast: type = float) -> tuple[Any, Any]:
+    """
+    Parses an option given as "a,b" (or as "a", for a,a)
+    """
+
+    parts = [cast(part) for part in value.split(",")]
+    if len(parts) == 1:
+        return parts[0], parts[0]
+    if len(parts) != 2:
+        raise argparse.ArgumentTypeError(f'Expected "a,b", got "{value}"')
+    return parts[0], parts[1]
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="synthetic_leaves")
+    subparsers = args.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser(
+        "generate",
+        help="render a synthetic dataset of leaves on A4 sheets, with their ground truth",
+    )
+    generate.add_argument(
+        "output",
+        type=str,
+        help="the folder of the dataset (run main.py from it to use the dataset)",
+    )
+    generate.add_argument(
+        "--plants", type=int, default=10, help="the number of species (default: 10)"
+    )
+    generate.add_argument(
+        "--images",
+        type=int,
+        default=100,
+        help="the number of images of each species (default: 100)",
+    )
+    generate.add_argument(
+        "--resolution",
+        type=lambda value: __pair(value.replace("x", ","), int),
+        default=(3000, 4000),
+        help="the size of the images, as WIDTHxHEIGHT (default: 3000x4000)",
+    )
+    generate.add_argument(
+        "--fill",
+        type=__pair,
+        default=(0.75, 0.9),
+        help="the range of the fraction of the image covered by the sheet (default: 0.75,0.9)",
+    )
+    generate.add_argument(
+        "--rotation",
+        type=float,
+        default=0.5,
+        help="the maximum rotation of the sheet, in degrees (default: 0.5)",
+    )
+    generate.add_argument(
+        "--perspective",
+        type=float,
+        default=0.002,
+        help="the maximum displacement of the corners of the sheet, as a fraction of its size (default: 0.002)",
+    )
+    generate.add_argument(
+        "--background",
+        type=lambda value: __pair(value, int),
+        default=(10, 60),
+        help="the range of the gray level of the background (default: 10,60)",
+    )
+    generate.add_argument(
+        "--noise",
+        type=float,
+        default=3.0,
+        help="the standard deviation of the noise of the sensor (default: 3)",
+    )
+    generate.add_argument(
+        "--blur",
+        type=float,
+        default=0.7,
+        help="the standard deviation of the blur of the lens, in pixels (default: 0.7)",
+    )
+    generate.add_argument(
+        "--shapes",
+        type=lambda value: value.split(","),
+        help=f"the shapes of the leaves, among {','.join(SHAPES)} (default: all)",
+    )
+    generate.add_argument(
+        "--length",
+        type=__pair,
+        default=(50.0, 180.0),
+        help="the range of the length of the leaves, in mm (default: 50,180)",
+    )
+    generate.add_argument(
+        "--hue",
+        type=lambda value: __pair(value, int),
+        default=(20, 60),
+        help=f"the range of the hue of the leaves, within [{MIN_LEAF_HUE + 1}, {MAX_LEAF_HUE}] (default: 20,60)",
+    )
+    generate.add_argument(
+        "--sat",
+        type=lambda value: __pair(value, int),
+        default=(120, 230),
+        help=f"the range of the saturation of the leaves, within [{MIN_LEAF_SAT + 1}, 255] (default: 120,230)",
+    )
+    generate.add_argument(
+        "--val",
+        type=lambda value: __pair(value, int),
+        default=(40, 130),
+        help=f"the range of the value of the leaves, within [0, {MAX_LEAF_VAL}] (default: 40,130)",
+    )
+    generate.add_argument(
+        "--leaves",
+        type=int,
+        default=1,
+        help="the number of leaves on each sheet, for classify --multi (default: 1)",
+    )
+    generate.add_argument(
+        "--quality", type=int, default=90, help="the JPEG quality (default: 90)"
+    )
+    generate.add_argument(
+        "--seed", type=int, default=0, help="the seed of the dataset (default: 0)"
+    )
+    generate.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=0,
+        help="the number of processes that render the images (default: 0, one per CPU)",
+    )
+
+    accuracy = subparsers.add_parser(
+        "accuracy",
+        help="measure the images of a synthetic dataset, and compare the values to the ground truth",
+    )
+    accuracy.add_argument("output", type=str, help="the folder of the dataset")
+    accuracy.add_argument(
+        "--limit",
+        type=int,
+        help="the maximum number of images of each species (default: all)",
+    )
+    accuracy.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=0,
+        help="the number of processes that measure the images (default: 0, one per CPU)",
+    )
+    accuracy.add_argument(
+        "--report",
+        type=str,
+        help="also write the errors to this json file",
+    )
+
+    parsed = args.parse_args(sys.argv[1:])
+
+    if parsed.command == "generate":
+        try:
+            generator = SceneGenerator(
+                parsed.seed,
+                parsed.resolution,
+                parsed.fill,
+                parsed.rotation,
+                parsed.perspective,
+                parsed.background,
+                parsed.noise,
+                parsed.blur,
+                parsed.shapes,
+                parsed.length,
+                parsed.hue,
+                parsed.sat,
+                parsed.val,
+                parsed.leaves,
+            )
+        except ValueError as e:
+            args.error(str(e))
+        generate_dataset(
+            generator,
+            parsed.output,
+            parsed.plants,
+            parsed.images,
+            parsed.quality,
+            parsed.jobs or None,
+        )
+
+    elif parsed.command == "accuracy":
+        res = check_accuracy(parsed.output, parsed.limit, parsed.jobs or None)
+        print_accuracy(res)
+        if parsed.report is not None:
+            with open(parsed.report, "w") as f:
+                json.dump(res, f, indent=4)
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.lengths.leaf_tip import TIP_ANGLE_ESTIMATORS
+from functions.lengths.paper_roi import find_roi_boundaries
+from functions.utils.leaf import get_leaf_mask_from_bgr
+
+
+def __leaf_mask_of_roi(img_path: str, json_path: str) -> np.ndarray:
+    """
+    Computes the leaf mask of the paper ROI of an image, in the same way
+    as ImageFeatures, reusing the ROI cached in the description file if
+    it exists
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img_path: the path of the image
+    - json_path: the path of the description of the image
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The leaf mask of the paper ROI
+    """
+
+    img = cv2.imread(img_path)
+
+    roi = None
+    if os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            roi = json.load(f)["internal"].get("roi_boundaries", None)
+    if roi is None:
+        roi = find_roi_boundaries(img)
+
+    l, r, t, b = roi
+    return get_leaf_mask_from_bgr(img[t:b, l:r])
+
+
+def compare_tip_estimators(images_folder: str, descriptions_folder: str) -> None:
+    """
+    Runs all the tip angle estimators on all the images of the dataset,
+    and prints their results, their differences from the hough estimator
+    and their execution times
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - images_folder: the folder with one subfolder of images per plant
+    - descriptions_folder: the folder with the descriptions of the images
+    """
+
+    names = list(TIP_ANGLE_ESTIMATORS.keys())
+    angles: dict[str, list[float]] = {name: [] for name in names}
+    times: dict[str, float] = dict.fromkeys(names, 0.0)
+
+    print(f"{'image':<30}" + "".join(f"{name:>10}" for name in names))
+
+    for plant in sorted(os.listdir(images_folder)):
+        for img_file_name in sorted(os.listdir(f"{images_folder}/{plant}")):
+            json_name = f"{os.path.splitext(img_file_name)[0]}.json"
+            mask = __leaf_mask_of_roi(
+                f"{images_folder}/{plant}/{img_file_name}",
+                f"{descriptions_folder}/{plant}/{json_name}",
+            )
+
+            for name, estimator in TIP_ANGLE_ESTIMATORS.items():
+                start = time.perf_counter()
+                try:
+                    angle = estimator(mask)
+                except ValueError:
+                    angle = float("nan")
+                times[name] += time.perf_counter() - start
+                angles[name].append(angle)
+
+            print(
+                f"{plant + '/' + img_file_name:<30}"
+                + "".join(f"{angles[name][-1]:10.1f}" for name in names)
+            )
+
+    print()
+    reference = np.array(angles["hough"])
+    for name in names:
+        diff = np.abs(np.array(angles[name]) - reference)
+        print(
+            f"{name:<10} mean time {times[name] / len(reference) * 1000:8.1f} ms, "
+            f"mean |diff| from hough {np.nanmean(diff):6.1f} deg, "
+            f"median |diff| {np.nanmedian(diff):6.1f} deg"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="tip_angle")
+    args.add_argument(
+        "--images",
+        type=str,
+        default="./dataset/images",
+        help="the folder with one subfolder of images per plant",
+    )
+    args.add_argument(
+        "--descriptions",
+        type=str,
+        default="./dataset/descriptions",
+        help="the folder with the descriptions of the images",
+    )
+    parsed = args.parse_args(sys.argv[1:])
+
+    compare_tip_estimators(parsed.images, parsed.descriptions)
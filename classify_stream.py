@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+from functions.features import ImageFeatures
+from functions.lengths.calibration import PaperCalibration
+from functions.utils.leaf import get_leaf_px_mask_from_bgr
+from functions.utils.tracing import trace_span
+from functions.classifiers.bayes.binary_model import BinaryBayesModel
+from functions.classifiers.bayes.classifier import (
+    BAYES_analysis_density,
+    BAYES_load_model,
+    BAYES_model_features,
+    BAYES_classify_vector,
+    BAYES_classify_cascade,
+)
+from functions.classifiers.result import print_classification_result
+
+# Width of the thumbnail of the paper ROI used to follow the leaf
+THUMBNAIL_WIDTH = 160
+
+# Minimum fraction of the paper ROI covered by the leaf for it to be
+# considered present
+LEAF_MIN_FRACTION = 0.005
+
+# Number of consecutive frames in which the leaf must not move (or the
+# calibration must not match) before acting
+STABLE_FRAMES = 5
+
+# Minimum overlap (intersection over union) between the leaf masks of two
+# frames for the leaf to be considered still
+STABLE_MIN_IOU = 0.9
+
+
+class LeafTracker:
+    """
+    Follows the leaf on the sheet across the frames of a video, on a small
+    thumbnail of the paper ROI, and tells when a new leaf has been placed
+    and is still, so that it can be classified once
+    """
+
+    def __init__(self, stable_frames: int = STABLE_FRAMES) -> None:
+        """
+        Creates a new tracker, that has not seen any leaf yet
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - stable_frames: the number of frames in which the leaf must not
+            move before it is classified
+        """
+        self.__stable_frames = stable_frames
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets the leaves seen so far (for example, when the sheet moved)
+        """
+        self.__previous: Optional[np.ndarray] = None
+        self.__classified: Optional[np.ndarray] = None
+        self.__still_for = 0
+
+    def update(self, leaf_mask: np.ndarray) -> bool:
+        """
+        Updates the tracker with the leaf mask of a new frame
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - leaf_mask: a boolean thumbnail of the paper ROI, True where the
+            pixels belong to the leaf
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the frame shows a leaf that has just become still and was
+        not classified yet
+        """
+
+        if np.count_nonzero(leaf_mask) < LEAF_MIN_FRACTION * leaf_mask.size:
+            # The sheet is empty
+            self.reset()
+            return False
+
+        if (
+            self.__previous is not None
+            and self.__iou(self.__previous, leaf_mask) >= STABLE_MIN_IOU
+        ):
+            self.__still_for += 1
+        else:
+            self.__still_for = 1
+        self.__previous = leaf_mask
+
+        # Act only once, when the leaf becomes still, and only if it is not
+        # the one classified the last time (that may have been just touched)
+        if self.__still_for != self.__stable_frames:
+            return False
+        if (
+            self.__classified is not None
+            and self.__iou(self.__classified, leaf_mask) >= STABLE_MIN_IOU
+        ):
+            return False
+
+        self.__classified = leaf_mask
+        return True
+
+    @staticmethod
+    def __iou(mask1: np.ndarray, mask2: np.ndarray) -> float:
+        """
+        Computes the intersection over union of two masks
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - mask1, mask2: the boolean masks, of the same shape
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The intersection over union, between 0 and 1
+        """
+
+        union = np.count_nonzero(mask1 | mask2)
+        if union == 0:
+            return 1.0
+        return np.count_nonzero(mask1 & mask2) / union
+
+
+def classify_stream(
+    source: str,
+    tip_estimator: str = "hough",
+    margin: Optional[float] = None,
+    calibration: Optional[PaperCalibration] = None,
+    verbose: bool = False,
+    density: Optional[float] = None,
+) -> None:
+    """
+    Classifies the leaves placed, one after the other, on a sheet filmed
+    by a fixed camera.
+
+    The paper ROI and the pixel size are detected on the first frame, and
+    then only cheaply checked on the next ones: they are detected again
+    only if the check fails for STABLE_FRAMES consecutive frames (so that
+    a hand passing over the sheet does not trigger it).
+    Each frame is then reduced to a thumbnail of the leaf mask, and the
+    full analysis is run only when a new leaf has been still for
+    STABLE_FRAMES frames.
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - source: the path of a video, or the index of a camera
+    - tip_estimator: the algorithm that computes the tip angle
+    - margin: if given, the leaves are classified in cascade mode (see
+        BAYES_classify_cascade) with this margin
+    - calibration: the calibration of the rig, if already known
+    - verbose: whether the results should include the probabilities of
+        all the classes
+    - density: the pixel density the leaves are analysed at, which must
+        be the one the model was trained at (None for that density)
+    """
+
+    model = BAYES_load_model(binary=margin is None)
+    density = BAYES_analysis_density(model, density)
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f'Cannot open "{source}"')
+
+    tracker = LeafTracker()
+
+    frame_index = -1
+    mismatches = 0
+
+    while True:
+        with trace_span("read", frame=frame_index + 1):
+            ok, frame = capture.read()
+        if not ok:
+            break
+        frame_index += 1
+
+        # Check that the sheet did not move
+        with trace_span("check_calibration", frame=frame_index):
+            matches = calibration is not None and calibration.matches(frame)
+        if matches:
+            mismatches = 0
+        else:
+            # Detect the sheet in the first frame, then only if the check
+            # keeps failing
+            mismatches += 1
+            if frame_index > 0 and mismatches < STABLE_FRAMES:
+                continue
+
+            mismatches = 0
+            tracker.reset()
+            with trace_span("detect_calibration", frame=frame_index):
+                calibration = __detect_calibration(frame)
+            if calibration is None:
+                continue
+            print(f"Frame {frame_index}: paper sheet detected")
+        # A frame gets here only if it matches the calibration, or if the
+        # sheet was just detected in it
+        assert calibration is not None
+
+        # Follow the leaf on a thumbnail of the paper ROI
+        with trace_span("track", frame=frame_index):
+            l, r, t, b = calibration.roi_boundaries
+            height = max(1, round(THUMBNAIL_WIDTH * (b - t) / (r - l)))
+            thumbnail = cv2.resize(
+                frame[t:b, l:r],
+                (THUMBNAIL_WIDTH, height),
+                interpolation=cv2.INTER_AREA,
+            )
+            new_leaf = tracker.update(get_leaf_px_mask_from_bgr(thumbnail) > 0)
+        if not new_leaf:
+            continue
+
+        print(f"Frame {frame_index}: new leaf")
+        name = f"{source}#{frame_index}"
+        with trace_span("classify", image=name, frame=frame_index):
+            posterior, used = __classify_frame(
+                frame, name, tip_estimator, model, margin, calibration, density
+            )
+        print_classification_result(
+            posterior, verbose, None if margin is None else used
+        )
+        print("============================================================")
+
+    capture.release()
+
+
+def __detect_calibration(frame: np.ndarray) -> Optional[PaperCalibration]:
+    """
+    Detects the paper sheet and the pixel size in a frame
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - frame: the frame, in BGR
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The calibration, or None if the sheet is not visible in the frame
+    """
+
+    try:
+        calibration = PaperCalibration.detect(frame)
+    except Exception:
+        # The detection algorithms fail in many ways (no border lines,
+        # empty ROI...) when there is no sheet
+        return None
+
+    l, r, t, b = calibration.roi_boundaries
+    if l >= r or t >= b:
+        return None
+    return calibration
+
+
+def __classify_frame(
+    frame: np.ndarray,
+    name: str,
+    tip_estimator: str,
+    model: dict[str, Any] | BinaryBayesModel,
+    margin: Optional[float],
+    calibration: PaperCalibration,
+    density: Optional[float] = None,
+) -> tuple[dict[str, float], list[str]]:
+    """
+    Classifies the leaf in a frame, reusing the calibration
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - frame: the frame, in BGR
+    - name: the name of the frame
+    - tip_estimator: the algorithm that computes the tip angle
+    - model: the Bayesian classifier model
+    - margin: if given, the leaf is classified in cascade mode with this
+        margin
+    - calibration: the calibration of the rig
+    - density: the pixel density the leaf is analysed at, if any
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - a dictionary that associates each plant to the probability estimated
+        for the leaf to be that specific plant
+    - the features that were used
+    """
+
+    img = ImageFeatures(name, tip_estimator, frame, calibration, density=density)
+
+    if margin is None:
+        features = BAYES_model_features(model)
+        return BAYES_classify_vector(img.get_feature_vector(features), model), features
+
+    return BAYES_classify_cascade(
+        lambda feature: img.get_feature_vector([feature])[0], model, margin
+    )
@@ -1,11 +1,11 @@
-from typing import TypeVar, List
+from typing import TypeVar, Sequence, cast
 
 
 T = TypeVar("T")
 type tuple_of_11[T] = tuple[T, T, T, T, T, T, T, T, T, T, T]
 
 
-def to_tuple_of_11(array: List[T]) -> tuple_of_11[T]:
+def to_tuple_of_11(array: Sequence[T]) -> tuple_of_11[T]:
     """
     Equivalent of python's tuple() function, to convert an array of 11
     items into a tuple_of_11
@@ -13,7 +13,7 @@ def to_tuple_of_11(array: List[T]) -> tuple_of_11[T]:
     ---------------------------------------------------------------------
     PARAMETERS
     ----------
-    - array: the array to be converted
+    - array: the array (or any other sequence) to be converted
 
     ---------------------------------------------------------------------
     OUTPUT
@@ -23,19 +23,7 @@ def to_tuple_of_11(array: List[T]) -> tuple_of_11[T]:
     """
     if len(array) != 11:
         raise ValueError("Array must have exactly 11 elements")
-    return (
-        array[0],
-        array[1],
-        array[2],
-        array[3],
-        array[4],
-        array[5],
-        array[6],
-        array[7],
-        array[8],
-        array[9],
-        array[10],
-    )
+    return cast(tuple_of_11[T], tuple(array))
 
 def tuple_of_11_to_python_tuple(orig: tuple_of_11[T]) -> tuple[T, ...]:
     """
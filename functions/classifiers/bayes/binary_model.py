@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from functions.utils.atomic import atomic_write
+
+# First bytes of a binary model file, followed by the format version
+BINARY_MODEL_MAGIC = b"LEAFBAYS"
+BINARY_MODEL_FORMAT = 1
+
+# The arrays are aligned to this number of bytes in the file
+BINARY_MODEL_ALIGNMENT = 64
+
+
+class BinaryBayesModel:
+    """
+    The Bayesian classifier model in a compact binary form, that can be
+    memory-mapped instead of parsed: concurrent processes share the same
+    pages, and loading takes the same time for any number of plants.
+
+    The file contains:
+    - the magic bytes, the format version and the length of the header
+    - the header, in json: the names of the features and of the plants,
+        the number of bins of each feature, the pixel density the leaves
+        were analysed at, the checksum of the json model it was built
+        from, and the position and shape of each array
+    - the arrays, each aligned to BINARY_MODEL_ALIGNMENT bytes:
+        - bin_edges: (features, max edges) float64, the bin edges of each
+            feature, padded with zeros
+        - log_P_X_given_C: (features, max bins, plants) float64, the
+            logarithm of P(X|C), padded with zeros
+        - log_P_C: (plants,) float64, the logarithm of P(C)
+    """
+
+    def __init__(
+        self,
+        features: list[str],
+        plants: list[str],
+        num_edges: np.ndarray,
+        bin_edges: np.ndarray,
+        log_P_X_given_C: np.ndarray,
+        log_P_C: np.ndarray,
+        json_version: str,
+        density: Optional[float] = None,
+    ) -> None:
+        """
+        Creates a new binary model
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - features: the names of the features, in the order expected by
+            classify_batch
+        - plants: the names of the plants
+        - num_edges: the number of bin edges of each feature
+        - bin_edges: the bin edges of each feature (see the class)
+        - log_P_X_given_C: the logarithm of P(X|C) (see the class)
+        - log_P_C: the logarithm of P(C)
+        - json_version: the sha256 of the json model (see
+            BAYES_model_version)
+        - density: the pixel density the leaves of the training images were
+            analysed at (None for the native resolution)
+        """
+        self.features = features
+        self.plants = plants
+        self.num_edges = num_edges
+        self.bin_edges = bin_edges
+        self.log_P_X_given_C = log_P_X_given_C
+        self.log_P_C = log_P_C
+        self.json_version = json_version
+        self.density = density
+
+    @classmethod
+    def from_JSON(cls, model: dict[str, Any], json_version: str) -> BinaryBayesModel:
+        """
+        Converts a model in the json format to the binary one
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - model: the model, as stored in bayes.json
+        - json_version: the sha256 of the json file
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The same model, as a BinaryBayesModel
+        """
+
+        features = list(model["discretization"].keys())
+        plants = list(model["P(C)"].keys())
+
+        num_edges = np.array(
+            [len(model["discretization"][f]["bin_edges"]) for f in features],
+            dtype=np.int64,
+        )
+        num_bins = [model["discretization"][f]["num_bins"] for f in features]
+
+        bin_edges = np.zeros((len(features), max(num_edges, default=0)))
+        log_P_X_given_C = np.zeros(
+            (len(features), max(num_bins, default=0), len(plants))
+        )
+        for i, feature in enumerate(features):
+            bin_edges[i, : num_edges[i]] = model["discretization"][feature]["bin_edges"]
+            for j, plant in enumerate(plants):
+                log_P_X_given_C[i, : num_bins[i], j] = np.log(
+                    model["P(X|C)"][feature][plant]
+                )
+
+        log_P_C = np.log(np.array([model["P(C)"][plant] for plant in plants]))
+
+        return cls(
+            features,
+            plants,
+            num_edges,
+            bin_edges,
+            log_P_X_given_C,
+            log_P_C,
+            json_version,
+            model.get("density", None),
+        )
+
+    @classmethod
+    def load(
+        cls, path: str, json_version: Optional[str] = None
+    ) -> Optional[BinaryBayesModel]:
+        """
+        Memory-maps a binary model file. The arrays of the model are
+        read-only views of the file
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the binary model file
+        - json_version: if given, the sha256 of the json model that the
+            binary model must have been built from
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The model, or None if the file does not exist, is not valid, or was
+        built from another json model
+        """
+
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, version, header_length = struct.unpack_from("<8sII", buffer)
+            if magic != BINARY_MODEL_MAGIC or version != BINARY_MODEL_FORMAT:
+                return None
+            header = json.loads(bytes(buffer[16 : 16 + header_length]))
+            start = BinaryBayesModel.__align(16 + header_length)
+
+            if json_version is not None and header["json_version"] != json_version:
+                return None
+
+            arrays = {
+                name: np.frombuffer(
+                    buffer,
+                    dtype=np.float64 if name != "num_edges" else np.int64,
+                    count=int(np.prod(shape)),
+                    offset=start + offset,
+                ).reshape(shape)
+                for name, (offset, shape) in header["arrays"].items()
+            }
+        except (struct.error, ValueError, KeyError):
+            return None
+
+        return cls(
+            header["features"],
+            header["plants"],
+            arrays["num_edges"],
+            arrays["bin_edges"],
+            arrays["log_P_X_given_C"],
+            arrays["log_P_C"],
+            header["json_version"],
+            header.get("density", None),
+        )
+
+    def store(self, path: str) -> None:
+        """
+        Writes the model to a binary model file, atomically
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file
+        """
+
+        arrays = {
+            "num_edges": np.ascontiguousarray(self.num_edges, dtype=np.int64),
+            "bin_edges": np.ascontiguousarray(self.bin_edges, dtype=np.float64),
+            "log_P_X_given_C": np.ascontiguousarray(
+                self.log_P_X_given_C, dtype=np.float64
+            ),
+            "log_P_C": np.ascontiguousarray(self.log_P_C, dtype=np.float64),
+        }
+
+        # The offsets are relative to the end of the header, aligned
+        header: dict[str, Any] = {
+            "features": self.features,
+            "plants": self.plants,
+            "json_version": self.json_version,
+            "density": self.density,
+            "arrays": {},
+        }
+        offset = 0
+        for name, array in arrays.items():
+            header["arrays"][name] = (offset, list(array.shape))
+            offset = BinaryBayesModel.__align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        start = BinaryBayesModel.__align(16 + len(header_bytes))
+
+        with atomic_write(path, "wb", 0o644) as f:
+            f.write(
+                struct.pack(
+                    "<8sII",
+                    BINARY_MODEL_MAGIC,
+                    BINARY_MODEL_FORMAT,
+                    len(header_bytes),
+                )
+            )
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.write(b"\0" * (start + header["arrays"][name][0] - f.tell()))
+                f.write(array.tobytes())
+
+    def classify_batch(self, values: np.ndarray) -> list[dict[str, float]]:
+        """
+        Classifies many new data at once, as BAYES_classify_batch, summing
+        logarithms instead of multiplying probabilities
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - values: a matrix with a row for each new data, and a column for
+            each feature, in the order of self.features
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        For each row, a dictionary that associates each plant to the
+        probability estimated for the data to be that specific plant
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape[1] != len(self.features):
+            raise ValueError(
+                f"The model needs {len(self.features)} features, {values.shape[-1]} were given"
+            )
+
+        # P(C) is multiplied once per feature, as BAYES_update_posterior does
+        res = np.tile(len(self.features) * self.log_P_C, (values.shape[0], 1))
+
+        for i in range(len(self.features)):
+            # Same as __discretize_feature_val
+            inner_edges = self.bin_edges[i, 1 : self.num_edges[i] - 1]
+            vals = np.searchsorted(inner_edges, values[:, i], side="right")
+            res += self.log_P_X_given_C[i, vals]
+
+        res = np.exp(res - res.max(axis=1, keepdims=True))
+        res /= res.sum(axis=1, keepdims=True)
+
+        return [dict(zip(self.plants, row.tolist())) for row in res]
+
+    @staticmethod
+    def __align(offset: int) -> int:
+        """
+        Rounds an offset up to the alignment of the arrays
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - offset: the offset, in bytes
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The aligned offset
+        """
+        return -(-offset // BINARY_MODEL_ALIGNMENT) * BINARY_MODEL_ALIGNMENT
@@ -1,29 +1,421 @@
-import pandas as pd  # type: ignore
-import seaborn as sns  # type: ignore
-import matplotlib.pyplot as plt
+from __future__ import annotations
 
-sns.set_style("darkgrid")
+from typing import Any, Optional
 
+import json
+import os
 
-def BAYES_check_correlation() -> None:
+import numpy as np
+
+CORRELATION_STATS_PATH = "./dataset/correlation_stats.json"
+
+
+class CorrelationStats:
+    """
+    The running statistics (count, mean and co-moment matrix) of the
+    feature vectors of the dataset, from which the Pearson correlation
+    matrix can be obtained in O(F^2), without reading the data again.
+
+    The statistics are updated one image at a time with add, and the
+    statistics of different subsets of images can be combined with merge,
+    so that each thread of the dataset update can keep its own.
+    """
+
+    def __init__(self, features: Optional[list[str]] = None) -> None:
+        """
+        Creates new empty statistics
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - features: the names of the features, in order. If not given, they
+            are taken from the first image added
+        """
+        self.features: list[str] = [] if features is None else features
+        self.count = 0
+        self.mean = np.zeros(len(self.features))
+        self.comoment = np.zeros((len(self.features), len(self.features)))
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> CorrelationStats:
+        """
+        Creates new statistics from a dictionary representation of them
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics, as a CorrelationStats
+        """
+
+        if any(key not in details for key in ["features", "count", "mean", "comoment"]):
+            raise Exception("Invalid JSON format")
+
+        res = cls(details["features"])
+        res.count = details["count"]
+        res.mean = np.array(details["mean"], dtype=np.float64)
+        res.comoment = np.array(details["comoment"], dtype=np.float64)
+        return res
+
+    @classmethod
+    def from_plant_recaps(cls) -> CorrelationStats:
+        """
+        Computes the statistics from scratch, from the plant recaps of the
+        dataset
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics of the whole dataset
+        """
+
+        features, data = load_plant_recaps()
+
+        res = cls(features)
+        if len(data) > 0:
+            res.count = data.shape[0]
+            res.mean = data.mean(axis=0)
+            centered = data - res.mean
+            res.comoment = centered.T @ centered
+        return res
+
+    def add(self, values: dict[str, float]) -> None:
+        """
+        Updates the statistics with the features of a new image
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - values: the features of the image, as a dict {feature: value}
+        """
+
+        if len(self.features) == 0:
+            self.features = list(values.keys())
+            self.mean = np.zeros(len(self.features))
+            self.comoment = np.zeros((len(self.features), len(self.features)))
+
+        x = np.array([values[feature] for feature in self.features], dtype=np.float64)
+
+        # Welford's update, to avoid the cancellation of sums of squares
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.comoment += np.outer(delta, x - self.mean)
+
+    def merge(self, other: CorrelationStats) -> None:
+        """
+        Updates the statistics with the ones of another set of images
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - other: the statistics to be merged into these
+        """
+
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.features = other.features
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self.comoment = other.comoment.copy()
+            return
+        if other.features != self.features:
+            raise ValueError("Cannot merge statistics of different features")
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+
+        self.comoment += other.comoment
+        self.comoment += np.outer(delta, delta) * (self.count * other.count / count)
+        self.mean += delta * (other.count / count)
+        self.count = count
+
+    def pearson(self) -> np.ndarray:
+        """
+        Computes the Pearson correlation matrix of the features
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The F x F correlation matrix, with NaN for constant features
+        """
+
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = self.comoment / np.outer(std, std)
+        return np.clip(corr, -1.0, 1.0)
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the statistics to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics as JSON object (a dict)
+        """
+        return {
+            "features": self.features,
+            "count": self.count,
+            "mean": self.mean.tolist(),
+            "comoment": self.comoment.tolist(),
+        }
+
+    def store_to_file(self, path: str = CORRELATION_STATS_PATH) -> None:
+        """
+        Stores the statistics to a file, in json format
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file where to write
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_JSON(), f)
+
+
+def load_plant_recaps() -> tuple[list[str], np.ndarray]:
+    """
+    Loads the features of all the images from the plant recaps
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - the names of the features
+    - a N x F matrix, with one row per image and one column per feature
+    """
+
+    features: list[str] = []
+    rows: list[np.ndarray] = []
+
+    for recap in sorted(os.listdir("./dataset/plant_recaps")):
+        with open(f"./dataset/plant_recaps/{recap}", "r") as f:
+            plant_data = json.load(f)
+
+        if len(features) == 0:
+            features = list(plant_data.keys())
+
+        rows.append(np.array([plant_data[key] for key in features], dtype=np.float64).T)
+
+    if len(rows) == 0:
+        return features, np.zeros((0, 0))
+
+    return features, np.concatenate(rows)
+
+
+def __rank(data: np.ndarray) -> np.ndarray:
     """
-    Loads the csv version of the training data, and shows its correlation
-    matrix
+    Replaces each value of a column with its rank, assigning to tied
+    values the average of their ranks
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - data: the values to be ranked
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The ranks (starting from 1) of the values
+    """
+
+    _, inverse, counts = np.unique(data, return_inverse=True, return_counts=True)
+    avg_ranks = np.cumsum(counts) - (counts - 1) / 2
+    return avg_ranks[inverse]
+
+
+def spearman() -> tuple[list[str], np.ndarray]:
+    """
+    Computes the Spearman correlation matrix of the features, from the
+    plant recaps (ranks cannot be updated incrementally, so this requires
+    all the data)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - the names of the features
+    - the F x F correlation matrix
+    """
+
+    features, data = load_plant_recaps()
+
+    stats = CorrelationStats(features)
+    ranks = np.column_stack([__rank(data[:, i]) for i in range(data.shape[1])])
+    stats.count = ranks.shape[0]
+    stats.mean = ranks.mean(axis=0)
+    centered = ranks - stats.mean
+    stats.comoment = centered.T @ centered
+
+    return features, stats.pearson()
+
+
+def pearson() -> tuple[list[str], np.ndarray]:
+    """
+    Computes the Pearson correlation matrix of the features, from the
+    statistics stored by the last dataset update (or from the plant
+    recaps, if they are not available)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - the names of the features
+    - the F x F correlation matrix
+    """
+
+    if os.path.exists(CORRELATION_STATS_PATH):
+        with open(CORRELATION_STATS_PATH, "r") as f:
+            stats = CorrelationStats.from_JSON(json.load(f))
+    else:
+        stats = CorrelationStats.from_plant_recaps()
+
+    return stats.features, stats.pearson()
+
+
+def __store_matrix(features: list[str], corr: np.ndarray, path: str) -> None:
     """
-    data = pd.read_csv("./dataset/alldata.csv")
-    corr = data.iloc[:, :].corr(method="pearson")
-    cmap = sns.diverging_palette(250, 354, 80, 60, center="dark", as_cmap=True)
-    sns.heatmap(corr, vmax=1, vmin=-1, cmap=cmap, square=True, linewidths=0.2)
-    plt.show()
+    Writes a correlation matrix to a file, as csv or json depending on the
+    extension of path
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - features: the names of the features
+    - corr: the correlation matrix
+    - path: the path of the file where to write
+    """
+
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    row_feature: {
+                        col_feature: None if np.isnan(val) else float(val)
+                        for col_feature, val in zip(features, row)
+                    }
+                    for row_feature, row in zip(features, corr)
+                },
+                f,
+            )
+    else:
+        with open(path, "w") as f:
+            f.write(",".join(["", *features]))
+            f.write("\n")
+            for feature, row in zip(features, corr):
+                f.write(",".join([feature, *[str(float(val)) for val in row]]))
+                f.write("\n")
 
 
-def BAYES_check_ABS_correlation() -> None:
+def __render_matrix(
+    features: list[str], corr: np.ndarray, path: str, absolute: bool
+) -> None:
     """
-    Loads the csv version of the training data, and shows its correlation
-    matrix
+    Draws the correlation matrix as a heatmap, and saves it as an image.
+    Matplotlib is only imported here, with a non-interactive backend
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - features: the names of the features
+    - corr: the correlation matrix
+    - path: the path of the image to be written
+    - absolute: whether corr contains absolute values of correlations
+    """
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 9))
+    image = ax.imshow(
+        corr,
+        vmin=0 if absolute else -1,
+        vmax=1,
+        cmap="Greys" if absolute else "RdBu_r",
+    )
+    ax.set_xticks(range(len(features)), features, rotation=90)
+    ax.set_yticks(range(len(features)), features)
+    fig.colorbar(image, ax=ax)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def __print_matrix(features: list[str], corr: np.ndarray) -> None:
+    """
+    Prints the correlation matrix as a table
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - features: the names of the features
+    - corr: the correlation matrix
+    """
+
+    width = max(len(feature) for feature in features)
+    print(" " * width + "".join(f"{i:>6}" for i in range(len(features))))
+    for i, (feature, row) in enumerate(zip(features, corr)):
+        print(
+            f"{feature:>{width}}" + "".join(f"{val:6.2f}" for val in row) + f"  ({i})"
+        )
+
+
+def BAYES_check_correlation(
+    absolute: bool = False,
+    method: str = "pearson",
+    output: Optional[str] = None,
+    image: Optional[str] = None,
+) -> None:
+    """
+    Computes the correlation matrix between the features of the training
+    data, and reports it as a table, a csv/json file and/or an image
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - absolute: whether to report the absolute value of the correlation
+    - method: either "pearson" or "spearman"
+    - output: if given, the path of a .csv or .json file where to write the
+        matrix
+    - image: if given, the path of a png file where to draw the matrix
+    """
+
+    if method == "spearman":
+        features, corr = spearman()
+    else:
+        features, corr = pearson()
+
+    if absolute:
+        corr = np.abs(corr)
+
+    if output is not None:
+        __store_matrix(features, corr, output)
+    if image is not None:
+        __render_matrix(features, corr, image, absolute)
+    if output is None and image is None:
+        __print_matrix(features, corr)
+
+
+def BAYES_check_ABS_correlation(
+    method: str = "pearson",
+    output: Optional[str] = None,
+    image: Optional[str] = None,
+) -> None:
+    """
+    Same as BAYES_check_correlation, but reports the absolute value of the
+    correlation
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - method: either "pearson" or "spearman"
+    - output: if given, the path of a .csv or .json file where to write the
+        matrix
+    - image: if given, the path of a png file where to draw the matrix
     """
-    data = pd.read_csv("./dataset/alldata.csv")
-    corr = data.iloc[:, :].corr(method="pearson")
-    cmap = sns.light_palette(color="black", as_cmap=True)
-    sns.heatmap(abs(corr), vmax=1, vmin=0, cmap=cmap, square=True, linewidths=0.2)
-    plt.show()
+    BAYES_check_correlation(True, method, output, image)
@@ -1,8 +1,193 @@
-from typing import Any
+from typing import Any, Callable, Optional, Sequence
 
+import hashlib
 import json
+import os
 
-from sklearn.preprocessing import KBinsDiscretizer  # type: ignore
+from bisect import bisect_right
+
+import numpy as np
+
+from functions.classifiers.bayes.binary_model import BinaryBayesModel
+
+BAYES_MODEL_PATH = "./classification_models_data/bayes.json"
+FEATURE_COSTS_PATH = "./classification_models_data/feature_costs.json"
+
+DEFAULT_CASCADE_MARGIN = 0.95
+
+
+def BAYES_load_model(
+    path: str = BAYES_MODEL_PATH, binary: bool = False
+) -> dict[str, Any] | BinaryBayesModel:
+    """
+    Loads the Bayesian classifier model from file, so that it can be used
+    for many classifications
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the model file
+    - binary: whether the binary model built from the file (see
+        BAYES_binary_model_path) should be memory-mapped instead, if it is
+        up to date. It can be used by BAYES_model_features,
+        BAYES_classify_vector and BAYES_classify_batch, but not by
+        BAYES_classify_cascade
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The model, as stored in the file, or as a BinaryBayesModel
+    """
+
+    if binary:
+        binary_path = BAYES_binary_model_path(path)
+        model = BinaryBayesModel.load(binary_path, BAYES_model_version(path))
+        if model is not None:
+            return model
+        if os.path.exists(binary_path):
+            # A stale or corrupt binary model would otherwise go unnoticed
+            print(
+                f'The binary model "{binary_path}" is not valid or was not '
+                f'built from "{path}": the JSON model is used instead'
+            )
+
+    with open(path, "r") as f:
+        res: dict[str, Any] = json.load(f)
+    return res
+
+
+def BAYES_binary_model_path(path: str = BAYES_MODEL_PATH) -> str:
+    """
+    Returns the path of the binary model built from a model file
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the model file
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The path of the binary model: the same, with the .bin extension
+    """
+    return os.path.splitext(path)[0] + ".bin"
+
+
+def BAYES_store_binary_model(path: str = BAYES_MODEL_PATH) -> None:
+    """
+    Builds the binary model from a model file, and stores it next to it
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the model file
+    """
+
+    with open(path, "r") as f:
+        model = json.load(f)
+
+    BinaryBayesModel.from_JSON(model, BAYES_model_version(path)).store(
+        BAYES_binary_model_path(path)
+    )
+
+
+def BAYES_model_version(path: str = BAYES_MODEL_PATH) -> str:
+    """
+    Identifies the Bayesian classifier model stored in a file, so that
+    results of an older model can be recognized
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the model file
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The sha256 of the model file, as hex string
+    """
+
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def BAYES_model_features(model: dict[str, Any] | BinaryBayesModel) -> list[str]:
+    """
+    Returns the features used by a model, in the order expected by
+    BAYES_classify_vector
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - model: the model, as returned by BAYES_load_model
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The names of the features
+    """
+
+    if isinstance(model, BinaryBayesModel):
+        return model.features
+    return list(model["discretization"].keys())
+
+
+def BAYES_model_density(model: dict[str, Any] | BinaryBayesModel) -> Optional[float]:
+    """
+    Returns the pixel density the leaves were analysed at when the model
+    was trained: the images to be classified must be analysed at the same
+    density
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - model: the model, as returned by BAYES_load_model
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The density, in pixels per mm, or None for the native resolution
+    (also for the models trained before the density was recorded)
+    """
+
+    if isinstance(model, BinaryBayesModel):
+        return model.density
+    return model.get("density", None)
+
+
+def BAYES_analysis_density(
+    model: dict[str, Any] | BinaryBayesModel, density: Optional[float] = None
+) -> Optional[float]:
+    """
+    Returns the pixel density the images must be analysed at to be
+    classified by a model, checking the one requested, if any
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - model: the model, as returned by BAYES_load_model
+    - density: the density requested, in pixels per mm (None for the one
+        of the model)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The density the model was trained at (see BAYES_model_density)
+    """
+
+    model_density = BAYES_model_density(model)
+    if density is not None and density != model_density:
+        trained = (
+            "the native resolution"
+            if model_density is None
+            else f"{model_density:g} px/mm"
+        )
+        raise ValueError(
+            f"The model was trained at {trained}: the leaves cannot be "
+            f"analysed at {density:g} px/mm (omit --density, or update the "
+            "dataset with this density)"
+        )
+    return model_density
 
 
 def BAYES_classify(new_data: dict[str, Any]) -> dict[str, float]:
@@ -22,32 +207,217 @@ def BAYES_classify(new_data: dict[str, Any]) -> dict[str, float]:
     for the image to be that specific plant
     """
 
-    with open("./classification_models_data/bayes.json", "r") as f:
-        model = json.load(f)
+    model = BAYES_load_model()
+    features = BAYES_model_features(model)
+
+    return BAYES_classify_vector([new_data[feature] for feature in features], model)
+
+
+def BAYES_classify_vector(
+    values: Sequence[float] | np.ndarray[Any, Any],
+    model: dict[str, Any] | BinaryBayesModel,
+) -> dict[str, float]:
+    """
+    Uses an already loaded Bayesian classifier model to perform a
+    classification task on a new data (described as a feature vector)
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - values: the features of the new image to be classified, in the order
+        returned by BAYES_model_features (for example, the output of
+        ImageFeatures.get_feature_vector)
+    - model: the model, as returned by BAYES_load_model
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A dictionary that associates each plant to the probability estimated
+    for the image to be that specific plant
+    """
+
+    if isinstance(model, BinaryBayesModel):
+        return model.classify_batch(np.asarray([values]))[0]
 
-    features = [f for f in model["discretization"].keys()]
+    features = BAYES_model_features(model)
     leaves = [l for l in model["P(C)"].keys()]
 
+    if len(values) != len(features):
+        raise ValueError(
+            f"The model needs {len(features)} features, {len(values)} were given"
+        )
+
     res: dict[str, float] = dict.fromkeys(leaves, 1.0)
 
-    for feature in features:
-        val = __discretize_feature_val(
-            model["discretization"][feature], new_data[feature]
+    for feature, value in zip(features, values):
+        BAYES_update_posterior(res, model, feature, float(value))
+
+    return res
+
+
+def BAYES_classify_batch(
+    values: np.ndarray, model: dict[str, Any] | BinaryBayesModel
+) -> list[dict[str, float]]:
+    """
+    Same as BAYES_classify_vector, but classifies many new data at once
+    (for example, all the leaves on a sheet), discretizing each feature of
+    all of them with a single search
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - values: a matrix with a row for each new data, and a column for each
+        feature, in the order returned by BAYES_model_features
+    - model: the model, as returned by BAYES_load_model
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    For each row, a dictionary that associates each plant to the
+    probability estimated for the data to be that specific plant
+    """
+
+    if isinstance(model, BinaryBayesModel):
+        return model.classify_batch(values)
+
+    features = BAYES_model_features(model)
+    leaves = [l for l in model["P(C)"].keys()]
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2 or values.shape[1] != len(features):
+        raise ValueError(
+            f"The model needs {len(features)} features, {values.shape[-1]} were given"
         )
 
-        for leaf in leaves:
-            P_C = model["P(C)"][leaf]
-            P_X_given_C = model["P(X|C)"][feature][leaf][val]
-            res[leaf] *= P_C * P_X_given_C
+    P_C = np.array([model["P(C)"][leaf] for leaf in leaves])
+    res = np.ones((values.shape[0], len(leaves)))
 
-        sum = 0.0
-        for leaf in leaves:
-            sum += res[leaf]
+    for i, feature in enumerate(features):
+        # Same as __discretize_feature_val
+        bin_edges = np.asarray(model["discretization"][feature]["bin_edges"])
+        vals = np.searchsorted(bin_edges[1:-1], values[:, i], side="right")
 
-        for leaf in leaves:
-            res[leaf] /= sum
+        # Bins on the rows, plants on the columns
+        P_X_given_C = np.array([model["P(X|C)"][feature][leaf] for leaf in leaves]).T
+        res *= P_C * P_X_given_C[vals]
+        res /= res.sum(axis=1, keepdims=True)
 
-    return res
+    return [dict(zip(leaves, row.tolist())) for row in res]
+
+
+def BAYES_classify_cascade(
+    get_value: Callable[[str], float],
+    model: dict[str, Any] | BinaryBayesModel,
+    margin: float = DEFAULT_CASCADE_MARGIN,
+    costs: Optional[dict[str, float]] = None,
+) -> tuple[dict[str, float], list[str]]:
+    """
+    Performs a classification task extracting the features one at a time,
+    from the cheapest to the most expensive, and stops as soon as the most
+    probable plant leads the second one by at least margin.
+    If the margin is never reached, the result is the same as
+    BAYES_classify_vector
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - get_value: a function that extracts a feature of the new image,
+        given its name
+    - model: the model, as returned by BAYES_load_model (not binary: the
+        binary model cannot update the probabilities one feature at a time)
+    - margin: the difference of probability between the first and the
+        second plant that stops the extraction
+    - costs: the extraction cost of each feature, as returned by
+        BAYES_load_feature_costs. If not given, it is loaded from file
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - a dictionary that associates each plant to the probability estimated
+        for the image to be that specific plant, given the features used
+    - the features that were used, in the order they were extracted
+    """
+
+    if isinstance(model, BinaryBayesModel):
+        raise ValueError(
+            "The cascade mode needs the JSON model: load it with "
+            "BAYES_load_model(binary=False)"
+        )
+
+    costs = BAYES_load_feature_costs() if costs is None else costs
+
+    features = BAYES_model_features(model)
+    # sorted is stable: features without a cost keep the model order
+    order = sorted(features, key=lambda f: costs.get(f, float("inf")))
+
+    res: dict[str, float] = dict.fromkeys(model["P(C)"].keys(), 1.0)
+    used: list[str] = []
+
+    for feature in order:
+        BAYES_update_posterior(res, model, feature, float(get_value(feature)))
+        used.append(feature)
+
+        first, second = sorted(res.values(), reverse=True)[:2]
+        if first - second >= margin:
+            break
+
+    return res, used
+
+
+def BAYES_update_posterior(
+    posterior: dict[str, float], model: dict[str, Any], feature: str, value: float
+) -> None:
+    """
+    Updates, in place, the probabilities of the plants with the evidence
+    of one more feature
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - posterior: the probability of each plant given the features used
+        so far (all 1.0 if none was used yet), normalized in place
+    - model: the model, as returned by BAYES_load_model
+    - feature: the name of the new feature
+    - value: the value of the new feature
+    """
+
+    val = __discretize_feature_val(model["discretization"][feature], value)
+
+    for leaf in posterior.keys():
+        P_C = model["P(C)"][leaf]
+        P_X_given_C = model["P(X|C)"][feature][leaf][val]
+        posterior[leaf] *= P_C * P_X_given_C
+
+    sum = 0.0
+    for leaf in posterior.keys():
+        sum += posterior[leaf]
+
+    for leaf in posterior.keys():
+        posterior[leaf] /= sum
+
+
+def BAYES_load_feature_costs(path: str = FEATURE_COSTS_PATH) -> dict[str, float]:
+    """
+    Loads the extraction cost of each feature, as measured by
+    benchmarks/feature_cost.py
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the costs file
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A dict that associates each feature to its cost (in ms), or an empty
+    dict if the costs were never measured
+    """
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
 
 
 def __discretize_feature_val(model: dict[str, Any], value: Any) -> int:
@@ -67,9 +437,7 @@ def __discretize_feature_val(model: dict[str, Any], value: Any) -> int:
     ------
     Value discretized according to model, as an integer class ID
     """
-    discretizer = KBinsDiscretizer(
-        n_bins=model["num_bins"], strategy="quantile", encode="ordinal"
-    )
-    discretizer.bin_edges_ = [model["bin_edges"]]
 
-    return int(discretizer.transform([[value]])[0])
+    # Same as KBinsDiscretizer.transform: the number of inner edges that
+    # are lower than or equal to the value
+    return bisect_right(model["bin_edges"], value, 1, len(model["bin_edges"]) - 1) - 1
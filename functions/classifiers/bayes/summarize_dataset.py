@@ -1,276 +1,792 @@
+from __future__ import annotations
+
 import json
 
 from math import floor, log2, log10, sqrt
 
 import os
 
-from sklearn.preprocessing import KBinsDiscretizer  # type: ignore
+import numpy as np
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+from typing import Any, Callable, Optional
 
+from functions.classifiers.bayes.classifier import (
+    BAYES_MODEL_PATH,
+    BAYES_store_binary_model,
+)
 
-from typing import Any
+DISCRETIZATION_STRATEGIES = ["quantile", "uniform", "kmeans"]
 
+# A way to discretize a feature: strategy, number of bins and bin edges
+type Discretization = tuple[str, int, np.ndarray]
 
-def BAYES_summarize_dataset() -> None:
+
+class ShardStats:
     """
-    Computes all the values required for the bayesian classifier to work
+    The statistics of a shard (a subset of the plants) of the dataset
+    needed to choose the bin edges of the features: how many images each
+    plant has, and the values of each feature, stored exactly as the
+    distinct values and the number of times each one occurs.
+
+    The statistics of different shards can be combined with merge, and the
+    result does not depend on how the plants were split, nor on the order
+    of the merges, so that the model is the same for any number of shards.
+    Exact values are kept instead of approximate quantile sketches for
+    this reason: their size grows only with the distinct values, which is
+    small for the size of our dataset.
+    """
+
+    def __init__(self, features: Optional[list[str]] = None) -> None:
+        """
+        Creates new empty statistics
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - features: the names of the features, in order. If not given, they
+            are taken from the first plant added
+        """
+        self.features: list[str] = [] if features is None else features
+        self.plants: dict[str, int] = {}
+        self.values: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> ShardStats:
+        """
+        Creates new statistics from a dictionary representation of them
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics, as a ShardStats
+        """
+
+        if any(key not in details for key in ["features", "plants", "values"]):
+            raise Exception("Invalid JSON format")
+
+        res = cls(details["features"])
+        res.plants = details["plants"]
+        res.values = {
+            feature: (
+                np.array(values, dtype=np.float64),
+                np.array(counts, dtype=np.int64),
+            )
+            for feature, (values, counts) in details["values"].items()
+        }
+        return res
+
+    @classmethod
+    def from_plant_recaps(cls, plants: list[str]) -> ShardStats:
+        """
+        Computes the statistics of some plants, from their plant recaps
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plants: the plants of the shard
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics of the shard
+        """
+
+        res = cls()
+        for plant in plants:
+            res.add(plant, load_plant_recap(plant))
+        return res
+
+    def add(self, plant: str, plant_data: dict[str, list[float]]) -> None:
+        """
+        Adds the images of a plant to the statistics
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plant: the name of the plant
+        - plant_data: the plant recap, that associates each feature to its
+            values for all the images of the plant
+        """
+
+        other = ShardStats(list(plant_data.keys()))
+        other.plants[plant] = len(next(iter(plant_data.values()), []))
+        other.values = {
+            feature: np.unique(np.asarray(values, dtype=np.float64), return_counts=True)
+            for feature, values in plant_data.items()
+        }
+        self.merge(other)
+
+    def merge(self, other: ShardStats) -> None:
+        """
+        Adds the statistics of another shard to these ones
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - other: the statistics of the other shard
+        """
+
+        if len(self.features) == 0:
+            self.features = other.features
+        elif len(other.features) > 0 and other.features != self.features:
+            raise ValueError("The two shards have different features")
+
+        for plant, count in other.plants.items():
+            self.plants[plant] = self.plants.get(plant, 0) + count
+
+        for feature, (values, counts) in other.values.items():
+            if feature not in self.values:
+                self.values[feature] = (values, counts)
+                continue
+
+            all_values = np.concatenate((self.values[feature][0], values))
+            all_counts = np.concatenate((self.values[feature][1], counts))
+            distinct, inverse = np.unique(all_values, return_inverse=True)
+            merged_counts = np.zeros(len(distinct), dtype=np.int64)
+            np.add.at(merged_counts, inverse, all_counts)
+            self.values[feature] = (distinct, merged_counts)
+
+    def sorted_values(self, feature: str) -> np.ndarray:
+        """
+        Returns all the values of a feature, sorted ascending (the same
+        array np.sort would return on the values of all the images)
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - feature: the name of the feature
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The sorted values
+        """
+        values, counts = self.values[feature]
+        return np.repeat(values, counts)
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the statistics to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The statistics as JSON object (a dict)
+        """
+        return {
+            "features": self.features,
+            "plants": self.plants,
+            "values": {
+                feature: [values.tolist(), counts.tolist()]
+                for feature, (values, counts) in self.values.items()
+            },
+        }
 
-    It does:
-    - load the plant recap for all different plants
-    - choose how to discretize the features
-    - discretize the features
-    - compute all the probabilities required for the classification
-    - store them to a file
+
+class ShardBinCounts:
     """
+    For each candidate discretization of each feature, how many images of
+    each plant of a shard fall in each bin.
 
-    # Load data
-    labels, data = __load_all_data()
+    The counts of shards with different plants are combined with merge
+    (the counts of a plant present in both are summed)
+    """
 
-    to_store: dict[str, Any] = {"discretization": {}, "P(X|C)": {}}
-    data_discrete = {}
+    def __init__(self) -> None:
+        """
+        Creates new empty counts
+        """
+        # feature -> one dict per candidate, plant -> count of each bin
+        self.counts: dict[str, list[dict[str, list[int]]]] = {}
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> ShardBinCounts:
+        """
+        Creates new counts from a dictionary representation of them
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The counts, as a ShardBinCounts
+        """
+
+        if "counts" not in details:
+            raise Exception("Invalid JSON format")
+
+        res = cls()
+        res.counts = details["counts"]
+        return res
+
+    @classmethod
+    def from_plant_recaps(
+        cls, plants: list[str], candidates: dict[str, list[Discretization]]
+    ) -> ShardBinCounts:
+        """
+        Counts, from their plant recaps, the images of some plants that
+        fall in each bin of each candidate discretization
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plants: the plants of the shard
+        - candidates: for each feature, the discretizations to be tried
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The counts of the shard
+        """
+
+        res = cls()
+        for feature, options in candidates.items():
+            res.counts[feature] = [{} for _ in options]
+
+        for plant in plants:
+            plant_data = load_plant_recap(plant)
+            for feature, options in candidates.items():
+                values = np.asarray(plant_data[feature], dtype=np.float64)
+                for i, (_, num_bins, edges) in enumerate(options):
+                    # Discretize features, in the same way KBinsDiscretizer does
+                    binned = np.searchsorted(edges[1:-1], values, side="right")
+                    res.counts[feature][i][plant] = np.bincount(
+                        binned, minlength=num_bins
+                    ).tolist()
+
+        return res
+
+    def merge(self, other: ShardBinCounts) -> None:
+        """
+        Adds the counts of another shard to these ones
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - other: the counts of the other shard
+        """
+
+        for feature, options in other.counts.items():
+            if feature not in self.counts:
+                self.counts[feature] = [{} for _ in options]
+
+            for mine, theirs in zip(self.counts[feature], options):
+                for plant, count in theirs.items():
+                    if plant in mine:
+                        mine[plant] = [a + b for a, b in zip(mine[plant], count)]
+                    else:
+                        mine[plant] = count
+
+    def matrix(self, feature: str, candidate: int, plants: list[str]) -> np.ndarray:
+        """
+        Returns the counts of a candidate discretization as a matrix
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - feature: the name of the feature
+        - candidate: the index of the candidate discretization
+        - plants: the plants, in the order of the columns
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        A matrix with one row per bin and one column per plant
+        """
+        counts = self.counts[feature][candidate]
+        return np.array([counts[plant] for plant in plants], dtype=np.int64).T
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the counts to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The counts as JSON object (a dict)
+        """
+        return {"counts": self.counts}
+
+
+def BAYES_summarize_dataset(
+    num_bins_options: Optional[list[int]] = None,
+    strategies: Optional[list[str]] = None,
+    criterion: Optional[Callable[[np.ndarray], float]] = None,
+    workers: Optional[int] = None,
+    shards: Optional[int] = None,
+    density: Optional[float] = None,
+) -> None:
+    """
+    Computes all the values required for the bayesian classifier to work
 
-    # Discretize all features and store the discretization parameters
-    for feature in data.keys():
-        num_bins, bin_edges, discretized = __discretize_data(data[feature], labels)
-        data_discrete[feature] = discretized
+    It is split in map and reduce phases, so that the plant recaps are
+    read concurrently, one shard at a time, and never all in the same
+    process. The reducer still holds the distinct values of every feature
+    (ShardStats), which for continuous features are about as many as the
+    images: its memory grows with the size of the dataset.
+    - map: each shard of plants computes its ShardStats
+    - reduce: the statistics are merged
+    - map: the candidate bin edges of each feature are computed from them,
+        one feature per task
+    - map: each shard counts how many of its images fall in each bin of
+        each candidate (ShardBinCounts)
+    - reduce: the counts are merged, the best discretization of each
+        feature is chosen, and the probabilities are computed and stored
+        to a file
+
+    The model does not depend on the number of shards.
 
-        to_store["discretization"][feature] = {}
-        to_store["discretization"][feature]["num_bins"] = num_bins
-        to_store["discretization"][feature]["bin_edges"] = bin_edges
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - num_bins_options: the numbers of bins to be tried when discretizing
+        each feature. If not given, default_num_bins_options is used
+    - strategies: the discretization strategies to be tried, among
+        DISCRETIZATION_STRATEGIES. If not given, only "quantile" is used
+    - criterion: the function used to choose the best discretization of
+        each feature. If not given, gain_ratio is used
+    - workers: the number of processes that run the map phases (None for
+        one per CPU, 1 to run everything in the current process)
+    - shards: the number of shards the plants are split into (None for
+        one per worker)
+    - density: the pixel density the leaves were analysed at, if any (see
+        ImageFeatures), recorded in the model so that the classifiers
+        analyse the leaves at the same density
+    """
 
-    # Compute and store P(C) for each plant C
-    P_C = __compute_leaf_percentages(labels)
-    to_store["P(C)"] = P_C
+    plants = os.listdir(f"./dataset/images")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shards is None:
+        shards = workers
+    # Contiguous shards, so that the plants keep their order
+    plant_shards = [
+        [str(plant) for plant in shard]
+        for shard in np.array_split(np.array(plants, dtype=object), shards)
+        if len(shard) > 0
+    ]
 
-    # Compute and store P(X|C) for each plant C for each feature X
-    for feature in data.keys():
-        P_X_given_C = __compute_feature_given_leaf_percentages(
-            labels,
-            data_discrete[feature],
-            to_store["discretization"][feature]["num_bins"],
+    with __map_executor(workers) as executor:
+        stats = ShardStats()
+        for shard_stats in executor.map(ShardStats.from_plant_recaps, plant_shards):
+            stats.merge(shard_stats)
+
+        if num_bins_options is None:
+            num_bins_options = default_num_bins_options(sum(stats.plants.values()))
+        candidates = BAYES_candidate_discretizations(
+            stats,
+            num_bins_options,
+            ["quantile"] if strategies is None else strategies,
+            executor,
         )
-        to_store["P(X|C)"][feature] = P_X_given_C
 
-    # Store all values to the classification model data folder
-    with open("./classification_models_data/bayes.json", "w") as f:
+        counts = ShardBinCounts()
+        for shard_counts in executor.map(
+            ShardBinCounts.from_plant_recaps,
+            plant_shards,
+            [candidates] * len(plant_shards),
+        ):
+            counts.merge(shard_counts)
+
+    to_store = BAYES_reduce_model(
+        stats, candidates, counts, gain_ratio if criterion is None else criterion
+    )
+    to_store["density"] = density
+
+    # Store all values to the classification model data folder, and the
+    # binary model that the classifiers memory-map
+    with open(BAYES_MODEL_PATH, "w") as f:
         json.dump(to_store, f)
+    BAYES_store_binary_model(BAYES_MODEL_PATH)
 
-    # Store all data as csv file for computing correlation matrix
+    # Store all data as csv file for computing correlation matrix, one
+    # plant at a time
     with open("./dataset/alldata.csv", "w") as f:
-        f.write(",".join(data.keys()))
+        f.write(",".join(stats.features))
         f.write("\n")
-        for i in range(len(labels)):
-            f.write(
-                ",".join([str(data_discrete[feature][i]) for feature in data.keys()])
-            )
-            f.write("\n")
+        for plant in plants:
+            plant_data = load_plant_recap(plant)
+            discrete = [
+                np.searchsorted(
+                    np.asarray(to_store["discretization"][feature]["bin_edges"][1:-1]),
+                    np.asarray(plant_data[feature], dtype=np.float64),
+                    side="right",
+                )
+                for feature in stats.features
+            ]
+            for row in zip(*discrete):
+                f.write(",".join([str(val) for val in row]))
+                f.write("\n")
+
+
+def BAYES_candidate_discretizations(
+    stats: ShardStats,
+    num_bins_options: list[int],
+    strategies: list[str],
+    executor: Optional[Executor] = None,
+) -> dict[str, list[Discretization]]:
+    """
+    Computes the bin edges of all the discretizations to be tried for each
+    feature
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - stats: the statistics of the whole dataset
+    - num_bins_options: the options for the number of bins
+    - strategies: the options for the discretization strategy
+    - executor: if given, the features are processed concurrently on it,
+        one per task (the kmeans strategy is expensive)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    For each feature, the discretizations, in the order they are tried
+    """
 
+    sorted_values = [stats.sorted_values(feature) for feature in stats.features]
+    num_features = len(stats.features)
+    args = (
+        sorted_values,
+        [num_bins_options] * num_features,
+        [strategies] * num_features,
+    )
+
+    if executor is None:
+        candidates = map(__feature_candidates, *args)
+    else:
+        candidates = executor.map(__feature_candidates, *args)
+    return dict(zip(stats.features, candidates))
 
-def __load_all_data() -> tuple[list[str], dict[str, Any]]:
+
+def __feature_candidates(
+    sorted_values: np.ndarray, num_bins_options: list[int], strategies: list[str]
+) -> list[Discretization]:
     """
-    Loads all the data from all the plants, putting all the plants' data
-    in the same array, divided by feature.
+    Computes the bin edges of all the discretizations to be tried for a
+    feature
 
-    It also creates a list of corresponding labels
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - sorted_values: all the values of the feature, sorted ascending
+    - num_bins_options: the options for the number of bins
+    - strategies: the options for the discretization strategy
 
     ---------------------------------------------------------------------
     OUTPUT
     ------
-    - a list of labels, ordered in the same way as the data
-    - a dict with the features as keys, and the list of values for that
-        feature as value
+    The discretizations, in the order they are tried
+    """
+    return [
+        (strategy, num_bins, __bin_edges(sorted_values, num_bins, strategy))
+        for strategy in strategies
+        for num_bins in num_bins_options
+    ]
 
-    ---------------------------------------------------------------------
-    EXAMPLE
-    -------
-
-    Suppose to have features F1 and F2, and plants p1, p2, p3:
-    - p1 has 3 leaves, with values (F1, F2) = ```[(10,10), (11,11), (4,4)]```
-    - p2 has 2 leaves, with values (F1, F2) = ```[(4,5), (5,4)]```
-    - p3 has 1 leaf, with values (F1, F2) = ```[(1,3)]```
-
-    The result will be:
-    ```
-    (
-        ["p1", "p1", "p1", "p2", "p2", "p3"],
-        {
-            "F1": [10, 11, 4, 4, 5, 1],
-            "F2": [10, 11, 4, 5, 4, 3]
-        }
-    )
-    ```
 
+def BAYES_reduce_model(
+    stats: ShardStats,
+    candidates: dict[str, list[Discretization]],
+    counts: ShardBinCounts,
+    criterion: Callable[[np.ndarray], float],
+) -> dict[str, Any]:
     """
+    Chooses the best discretization of each feature, and computes the
+    probabilities of the model
+
+    All the combinations of number of bins and strategy are tried, and
+    the one with the greatest score according to criterion is selected
+    (the first one, in case of ties)
 
-    data: dict[str, Any] = {}
-    plants: list[str] = []
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - stats: the statistics of the whole dataset
+    - candidates: for each feature, the discretizations that were tried
+    - counts: the bin counts of the whole dataset
+    - criterion: the function that scores a discretization, given the
+        count matrix (see gain_ratio)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The model, as stored in bayes.json
+    """
 
-    for plant in os.listdir(f"./dataset/images"):
-        with open(f"./dataset/plant_recaps/{plant}.json", "r") as plant_recap_file:
-            plant_data = json.load(plant_recap_file)
+    plants = sorted(stats.plants.keys())
+    num_images = sum(stats.plants.values())
+
+    res: dict[str, Any] = {"discretization": {}, "P(X|C)": {}}
+
+    for feature in stats.features:
+        # Store the score and settings for the best discretization
+        max_score = 0.0
+        max_score_bins = 0
+        max_score_strategy = candidates[feature][0][0]
+        max_score_edges = np.array([])
+        max_score_count = np.zeros((0, len(plants)), dtype=np.int64)
+
+        for i, (strategy, num_bins, edges) in enumerate(candidates[feature]):
+            count = counts.matrix(feature, i, plants)
+            score = criterion(count)
+            if score > max_score:
+                max_score = score
+                max_score_bins = num_bins
+                max_score_strategy = strategy
+                max_score_edges = edges
+                max_score_count = count
+
+        res["discretization"][feature] = {
+            "num_bins": max_score_bins,
+            "strategy": max_score_strategy,
+            "bin_edges": [float(edge) for edge in max_score_edges],
+        }
+        res["P(X|C)"][feature] = __compute_feature_given_leaf_percentages(
+            plants, stats.plants, max_score_count, max_score_bins
+        )
 
-        if len(data.keys()) == 0:
-            for key in plant_data:
-                data[key] = []
+    # P(C) for each plant C
+    res["P(C)"] = {plant: float(stats.plants[plant]) / num_images for plant in plants}
 
-        for key in data.keys():
-            data[key] = [*data[key], *plant_data[key]]
-            num_imgs = len(plant_data[key])
+    return res
 
-        plants = [*plants, *[plant for _ in range(num_imgs)]]
 
-    return plants, data
+def load_plant_recap(plant: str) -> dict[str, list[float]]:
+    """
+    Loads the plant recap of a plant: the values of all the features for
+    all its images
 
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - plant: the name of the plant
 
-def __discretize_data(
-    data: list[Any], plants: list[str]
-) -> tuple[int, list[float], list[int]]:
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A dict with the features as keys, and the list of values for that
+    feature as value
     """
-    Given data for a feature, finds the best way to discretize it, and
-    then executes the discretization.
 
-    The discretization is based on quantiles, and the number of bins is
-    selected as the one with greatest entropy among:
+    with open(f"./dataset/plant_recaps/{plant}.json", "r") as plant_recap_file:
+        return json.load(plant_recap_file)
+
+
+def default_num_bins_options(num_data: int) -> list[int]:
+    """
+    Returns the common choices for the number of discretization bins, as
+    described in
+    [this paper](www.litrp.cl/cwpr2013/papers/jcc2013_submission_192.pdf):
     - ```10```
-    - ```max(1, floor(2 * log10(len(data))))```
-    - ```floor(1 + log2(len(data)))```
-    - ```floor(sqrt(len(data)))```
+    - ```max(1, floor(2 * log10(num_data)))```
+    - ```floor(1 + log2(num_data))```
+    - ```floor(sqrt(num_data))```
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - num_data: the number of data values to be discretized
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The list of the options for the number of bins
+    """
+
+    return [
+        10,
+        max(1, floor(2 * log10(num_data))),
+        floor(1 + log2(num_data)),
+        floor(sqrt(num_data)),
+    ]
+
+
+def gain_ratio(count: np.ndarray) -> float:
+    """
+    Scores a discretization as the ratio between the sum of the class
+    entropies of each bin and the split information of the binning.
 
-    These values are some common choices, as described in
-    [this paper](www.litrp.cl/cwpr2013/papers/jcc2013_submission_192.pdf)
+    This is the default criterion to choose the discretization of a
+    feature
 
     ---------------------------------------------------------------------
     PARAMETERS
     ----------
-    - data: the list of data values for a given feature
-    - plant: the list of plant names associated to data
+    - count: a matrix with one row per bin and one column per plant,
+        containing how many data values of each plant fall in each bin
 
     ---------------------------------------------------------------------
     OUTPUT
     ------
-    - the selected number of bins
-    - the selected bins (discretizer.bin_edges_)
-    - the discretized data
+    The score of the discretization (the higher, the better)
+    """
+
+    elements_per_bin = count.sum(axis=1)
+    non_empty = elements_per_bin > 0
+
+    # Entropy of the classes inside each bin
+    p = count[non_empty] / elements_per_bin[non_empty, None]
+    p = p[p > 0]
+    entropy = float(-(p * np.log2(p)).sum())
+
+    # Entropy of the bins themselves
+    p = elements_per_bin[non_empty] / count.sum()
+    splitinfo = float(-(p * np.log2(p)).sum())
 
+    return entropy / splitinfo if splitinfo != 0 else 0.0
+
+
+def __bin_edges(sorted_data: np.ndarray, num_bins: int, strategy: str) -> np.ndarray:
     """
+    Computes the bin edges of a feature, in the same way as sklearn's
+    KBinsDiscretizer (for "kmeans", with a 1D Lloyd algorithm), but
+    starting from the already sorted data, so that it is sorted only once
+    for all the options
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - sorted_data: the values of the feature, sorted ascending
+    - num_bins: the number of bins requested
+    - strategy: one of DISCRETIZATION_STRATEGIES
 
-    data = [[val] for val in data]
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The bin edges, including the minimum and maximum values
+    """
 
-    plants_count_empty = json.dumps(dict.fromkeys([plant for plant in set(plants)], 0))
+    data_min, data_max = sorted_data[0], sorted_data[-1]
 
-    # Store the score and settings for the best bin number
-    max_score = 0.0
-    max_score_bins = 0
-    max_score_edges = []
-    max_score_discretization = []
+    # A constant feature is placed all in the same bin
+    if data_min == data_max:
+        return np.array([-np.inf, np.inf])
 
-    # Compute the options for the number of bins
-    num_bins_options = [
-        10,
-        max(1, floor(2 * log10(len(data)))),
-        floor(1 + log2(len(data))),
-        floor(sqrt(len(data))),
-    ]
+    if strategy == "uniform":
+        return np.linspace(data_min, data_max, num_bins + 1)
 
-    for num_bins in num_bins_options:
-        # Create discretizer
-        discretizer = KBinsDiscretizer(
-            n_bins=num_bins, strategy="quantile", encode="ordinal"
+    if strategy == "quantile":
+        edges = np.asarray(
+            np.percentile(sorted_data, np.linspace(0, 100, num_bins + 1))
         )
 
-        # Discretize features
-        binned = discretizer.fit_transform(data)
-
-        # Count entries for each (bin, plant) and bin
-        count = [json.loads(plants_count_empty) for _ in range(num_bins)]
-        elements_per_bin = [0 for _ in range(num_bins)]
-        for plant, bin_num in zip(plants, binned):
-            bin_num = int(bin_num)
-            count[bin_num][plant] += 1
-            elements_per_bin[bin_num] += 1
-
-        # Compute entropy
-        entropy = 0.0
-        splitinfo = 0.0
-        for bin_num in range(num_bins):
-            for leaf_count in count[bin_num].values():
-                p = (
-                    float(leaf_count) / elements_per_bin[bin_num]
-                    if elements_per_bin[bin_num] != 0
-                    else 0.0
-                )
-                entropy_here = -p * log2(p) if p != 0 else 0.0
-                entropy += entropy_here
-
-            p = float(elements_per_bin[bin_num]) / len(data)
-            entropy_here = -p * log2(p) if p != 0 else 0.0
-            splitinfo += entropy_here
-
-        # Compute score and update max score settings if needed
-        score = entropy / splitinfo
-        if score > max_score:
-            max_score = score
-            max_score_bins = num_bins
-            max_score_edges = discretizer.bin_edges_
-            max_score_discretization = binned
-
-    # Return the values, while transforming the discretization from float to int
-    return (
-        max_score_bins,
-        list(max_score_edges[0]),
-        [int(val) for val in max_score_discretization],
-    )
+    elif strategy == "kmeans":
+        edges = __kmeans_bin_edges(sorted_data, num_bins)
+
+    else:
+        raise ValueError(f'Unknown discretization strategy "{strategy}"')
+
+    # Remove bins whose width is too small
+    return edges[np.ediff1d(edges, to_begin=np.inf) > 1e-8]
 
 
-def __compute_leaf_percentages(plants: list[str]) -> dict[str, float]:
+def __kmeans_bin_edges(sorted_data: np.ndarray, num_bins: int) -> np.ndarray:
     """
-    Given the set of labels of the dataset, computes the probability of
-    a random image to have each class (to be of each given leaf).
+    Runs a 1D k-means on the sorted data, with centers initialized
+    uniformly, and places the bin edges halfway between the centers.
 
-    In Bayes model, this is P(C)
+    Since the data is sorted, each cluster is a contiguous slice of it,
+    so the clusters means are computed from prefix sums
 
     ---------------------------------------------------------------------
     PARAMETERS
     ----------
-    - plants: a list with the label names, each inserted once per each
-        image of that leaf present in the dataset
+    - sorted_data: the values of the feature, sorted ascending
+    - num_bins: the number of clusters (bins)
 
     ---------------------------------------------------------------------
     OUTPUT
     ------
-    A dict that associates each plant to the frequency of that plant in
-    the dataset
+    The bin edges, including the minimum and maximum values
     """
 
-    count = dict.fromkeys([plant for plant in sorted(set(plants))], 0)
+    data_min, data_max = sorted_data[0], sorted_data[-1]
+    prefix_sums = np.concatenate(([0.0], np.cumsum(sorted_data)))
 
-    for plant in plants:
-        count[plant] += 1
+    uniform_edges = np.linspace(data_min, data_max, num_bins + 1)
+    centers = (uniform_edges[1:] + uniform_edges[:-1]) * 0.5
 
-    res = {}
+    for _ in range(300):
+        # Each value goes to the closest center (the lower one, if tied)
+        limits = np.searchsorted(
+            sorted_data, (centers[1:] + centers[:-1]) * 0.5, "right"
+        )
+        limits = np.concatenate(([0], limits, [len(sorted_data)]))
+        sizes = np.diff(limits)
+
+        non_empty = sizes > 0
+        new_centers = centers.copy()
+        new_centers[non_empty] = (
+            np.diff(prefix_sums[limits])[non_empty] / sizes[non_empty]
+        )
 
-    for plant in count.keys():
-        res[plant] = float(count[plant]) / len(plants)
+        # Empty clusters are moved to the values farthest from their center
+        num_empty = len(centers) - int(non_empty.sum())
+        if num_empty > 0:
+            assigned = np.repeat(centers, sizes)
+            farthest = np.argsort(-np.abs(sorted_data - assigned), kind="stable")
+            new_centers[~non_empty] = sorted_data[farthest[:num_empty]]
 
-    return res
+        new_centers.sort()
+
+        if np.allclose(new_centers, centers, rtol=0, atol=1e-10):
+            break
+        centers = new_centers
+
+    return np.r_[data_min, (centers[1:] + centers[:-1]) * 0.5, data_max]
+
+
+def __map_executor(workers: int) -> Executor:
+    """
+    Returns the executor of the map phases
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - workers: the number of worker processes (1 to run everything in the
+        current process)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The executor
+    """
+
+    if workers == 1:
+        return ThreadPoolExecutor(max_workers=1)
+    return ProcessPoolExecutor(max_workers=workers)
 
 
 def __compute_feature_given_leaf_percentages(
-    plants: list[str], data: list[int], num_bins: int
+    plants: list[str], images: dict[str, int], count: np.ndarray, num_bins: int
 ) -> dict[str, list[float]]:
     """
-    Given the discretized data for a feature, computes the probability of
-    a random leaf of a specific class to have each discrete value, for
-    each class.
+    Given how many images of each plant fall in each bin of a feature,
+    computes the probability of a random leaf of a specific class to have
+    each discrete value, for each class.
 
     In Bayes model, this is P(X|C)
 
     ---------------------------------------------------------------------
     PARAMETERS
     ----------
-    - plants: a list with the label names, each inserted once per each
-        image of that leaf present in the dataset
-    - data: a list with the discretized data values, in direct
-        correspondance with plants
+    - plants: the names of the plants, in the order of the columns of
+        count
+    - images: the number of images of each plant
+    - count: a matrix with one row per bin and one column per plant
     - num_bins: the number of bins used to discretize the specific
         feature
 
@@ -284,25 +800,12 @@ def __compute_feature_given_leaf_percentages(
 
     # Laplace smoothing: each data point counts as 3, and each bin has 1 extra count
 
-    count = dict.fromkeys([plant for plant in sorted(set(plants))], num_bins)
-
-    count_per_bin: dict[str, list[int]] = dict.fromkeys(
-        [plant for plant in set(plants)], []
-    )
-    for plant in count_per_bin.keys():
-        count_per_bin[plant] = [1 for _ in range(num_bins)]
-
-    for plant, bin_num in zip(plants, data):
-        count[plant] += 3
-        count_per_bin[plant][bin_num] += 3
-
     res: dict[str, list[float]] = {}
 
-    for plant in count.keys():
-        res[plant] = []
-
-        for bin_num in range(num_bins):
-            perc = float(count_per_bin[plant][bin_num]) / count[plant]
-            res[plant].append(perc)
+    for j, plant in enumerate(plants):
+        total = num_bins + 3 * images[plant]
+        res[plant] = [
+            float(1 + 3 * int(count[bin_num, j])) / total for bin_num in range(num_bins)
+        ]
 
     return res
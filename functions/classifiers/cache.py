@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from functions.utils.atomic import atomic_write
+from functions.utils.lru_folder import LRUFolder
+
+CLASSIFICATION_CACHE_PATH = "./classification_cache"
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class CachedClassification:
+    """
+    The result of the classification of an image, as stored in the cache:
+    the feature vector given to the model and the posterior it returned
+    """
+
+    def __init__(
+        self, features: list[str], vector: np.ndarray, posterior: dict[str, float]
+    ) -> None:
+        """
+        Creates a new cached classification
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - features: the names of the features, in the order of vector
+        - vector: the values of the features
+        - posterior: the probability of each plant, as returned by the
+            classifier
+        """
+        self.features = features
+        self.vector = vector
+        self.posterior = posterior
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> CachedClassification:
+        """
+        Creates a new cached classification from a dictionary representation
+        of it
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The same classification, but as a CachedClassification
+        """
+
+        if any(key not in details for key in ["features", "vector", "posterior"]):
+            raise Exception("Invalid JSON format")
+
+        return cls(
+            details["features"],
+            np.array(details["vector"], dtype=np.float64),
+            details["posterior"],
+        )
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the classification to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The classification as JSON object (a dict)
+        """
+        return {
+            "features": self.features,
+            "vector": self.vector.tolist(),
+            "posterior": self.posterior,
+        }
+
+
+class ClassificationCache:
+    """
+    An on-disk cache of classification results, keyed by the content of
+    the image, the version of the feature extractor and the version of the
+    model, so that re-submitted photos (even if copied elsewhere) are not
+    analysed again.
+
+    The cache is a folder with one json file per entry, so it can be shared
+    by many processes:
+    - files are written to a temporary file and then renamed, so readers
+        never see a partial entry
+    - an entry that disappears or cannot be parsed is just a miss
+    - the last access time of an entry is its modification time, which is
+        refreshed on every hit, and the least recently used entries are
+        removed when the folder grows over max_size bytes. The size is
+        counted as in LRUFolder, so that storing an entry does not cost a
+        scan of the whole cache.
+
+    To avoid hashing the whole image on every hit, the hash of each path is
+    remembered (in the "paths" subfolder) together with the size and
+    modification time of the file, and is reused while they do not change.
+    """
+
+    def __init__(
+        self,
+        extractor_version: str,
+        model_version: str,
+        folder: str = CLASSIFICATION_CACHE_PATH,
+        max_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        """
+        Opens (creating it if needed) a classification cache
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - extractor_version: identifies the algorithms that computed the
+            features (results of different algorithms are never mixed)
+        - model_version: identifies the model that computed the posterior
+        - folder: the folder where the cache is stored
+        - max_size: the maximum size of the cache, in bytes
+        """
+
+        self.__folder = folder
+        self.__version = hashlib.sha256(
+            f"{extractor_version}\n{model_version}".encode()
+        ).hexdigest()
+
+        os.makedirs(f"{folder}/entries", exist_ok=True)
+        os.makedirs(f"{folder}/paths", exist_ok=True)
+        self.__lru = LRUFolder([f"{folder}/entries", f"{folder}/paths"], max_size)
+
+    def get(self, img_path: str) -> Optional[CachedClassification]:
+        """
+        Looks for the classification of an image in the cache
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The cached classification, or None if the image is not in the cache
+        """
+
+        entry_path = self.__entry_path(img_path)
+        details = self.__read_json(entry_path)
+        if details is None:
+            return None
+
+        try:
+            res = CachedClassification.from_JSON(details)
+        except Exception:
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return res
+
+    def put(
+        self,
+        img_path: str,
+        features: list[str],
+        vector: np.ndarray,
+        posterior: dict[str, float],
+    ) -> None:
+        """
+        Stores the classification of an image in the cache, evicting the
+        least recently used entries if the cache becomes too big
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+        - features: the names of the features, in the order of vector
+        - vector: the values of the features
+        - posterior: the probability of each plant, as returned by the
+            classifier
+        """
+
+        entry = CachedClassification(features, vector, posterior)
+        self.__write_json(self.__entry_path(img_path), entry.to_JSON())
+
+        self.__lru.evict_if_needed()
+
+    def evict(self) -> None:
+        """
+        Scans the cache and, if its size is over max_size, removes the
+        least recently used files (see LRUFolder.evict)
+        """
+        self.__lru.evict()
+
+    def __entry_path(self, img_path: str) -> str:
+        """
+        Returns the path of the cache file of an image
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The path of the cache file (that may not exist)
+        """
+        key = hashlib.sha256(
+            f"{self.content_hash(img_path)}\n{self.__version}".encode()
+        ).hexdigest()
+        return f"{self.__folder}/entries/{key}.json"
+
+    def content_hash(self, img_path: str) -> str:
+        """
+        Computes the hash of the content of an image file, reusing the one
+        remembered for that path if the file has not changed since
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The sha256 of the file content, as hex string
+        """
+
+        abs_path = os.path.abspath(img_path)
+        stat = os.stat(abs_path)
+        memo_path = (
+            f"{self.__folder}/paths/"
+            f"{hashlib.sha256(abs_path.encode()).hexdigest()}.json"
+        )
+
+        memo = self.__read_json(memo_path)
+        if (
+            memo is not None
+            and memo.get("size", None) == stat.st_size
+            and memo.get("mtime_ns", None) == stat.st_mtime_ns
+        ):
+            return str(memo["sha256"])
+
+        with open(abs_path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+        self.__write_json(
+            memo_path,
+            {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest},
+        )
+        return digest
+
+    @staticmethod
+    def __read_json(path: str) -> Optional[dict[str, Any]]:
+        """
+        Reads a json file of the cache, tolerating files that are missing or
+        invalid
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The content of the file, or None if it cannot be read
+        """
+
+        try:
+            with open(path, "r") as f:
+                res = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return res if isinstance(res, dict) else None
+
+    def __write_json(self, path: str, data: dict[str, Any]) -> None:
+        """
+        Writes a json file of the cache atomically (see atomic_write)
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file
+        - data: the content of the file
+        """
+
+        content = json.dumps(data).encode()
+        with atomic_write(path, "wb") as f:
+            f.write(content)
+
+        # A replaced file is counted again: the next scan corrects it
+        self.__lru.add(len(content))
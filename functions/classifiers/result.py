@@ -1,4 +1,11 @@
-def print_classification_result(perc: dict[str, float], verbose: bool) -> None:
+from typing import Optional
+
+from functions.utils.rectangle import Rectangle
+
+
+def print_classification_result(
+    perc: dict[str, float], verbose: bool, features: Optional[list[str]] = None
+) -> None:
     """
     Prints the result of a classification task in a tidy way
 
@@ -6,6 +13,9 @@ def print_classification_result(perc: dict[str, float], verbose: bool) -> None:
     PARAMETERS
     ----------
     - perc: a dict in the format ```{"plant": percentage}```
+    - verbose: whether to print the percentages of all the plants
+    - features: if given, the features used for the classification, which
+        are printed too
     """
 
     max = -1.0
@@ -24,3 +34,30 @@ def print_classification_result(perc: dict[str, float], verbose: bool) -> None:
         print("Full classification result:")
         for leaf, val in reversed(sorted(perc.items(), key=lambda x: x[1])):
             print(f"- {(val/sum*100):8.4f}% --> {leaf}")
+    if features is not None:
+        print(f"Features used ({len(features)}): {', '.join(features)}")
+
+
+def print_sheet_classification_result(
+    results: list[tuple[Rectangle, dict[str, float]]], verbose: bool
+) -> None:
+    """
+    Prints the results of the classification of all the leaves on a sheet
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - results: for each leaf, its bounding box and a dict in the format
+        ```{"plant": percentage}```
+    - verbose: whether to print the percentages of all the plants
+    """
+
+    if len(results) == 0:
+        print("No leaves found on the sheet")
+
+    for i, (box, perc) in enumerate(results):
+        print(
+            f"Leaf {i + 1} at (x: {box.horiz.corner}, y: {box.vert.corner}), "
+            f"{box.horiz.length}x{box.vert.length} px:"
+        )
+        print_classification_result(perc, verbose)
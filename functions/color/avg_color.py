@@ -1,3 +1,5 @@
+from typing import Optional
+
 from cv2.typing import MatLike
 import cv2
 
@@ -6,7 +8,9 @@ from functions.utils.image import crop_image
 from functions.utils.leaf import get_leaf_mask
 
 
-def get_avg_color(img: MatLike, leaf_roi: Rectangle) -> tuple[float, float, float]:
+def get_avg_color(
+    img: MatLike, leaf_roi: Rectangle, density: Optional[float] = None
+) -> tuple[float, float, float]:
     """
     Returns the color obtained as the average color of all the leaf px
 
@@ -15,6 +19,8 @@ def get_avg_color(img: MatLike, leaf_roi: Rectangle) -> tuple[float, float, floa
     ----------
     - img: the image, in BGR
     - leaf_roi: the region where the leaf is
+    - density: the pixel density of the image, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
 
     ---------------------------------------------------------------------
     OUTPUT
@@ -25,7 +31,7 @@ def get_avg_color(img: MatLike, leaf_roi: Rectangle) -> tuple[float, float, floa
     img = crop_image(img, leaf_roi)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
 
-    mask = get_leaf_mask(img)
+    mask = get_leaf_mask(img, density)
 
     avg = cv2.mean(img, mask)
 
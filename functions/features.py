@@ -1,24 +1,32 @@
 from __future__ import annotations
 
 from cv2.typing import MatLike
-from typing import Optional, Any
+from typing import Callable, Iterator, Optional, Any
 from custom_types.tuple_of_11 import tuple_of_11
 from custom_types.tuple_of_11 import to_tuple_of_11
-from custom_types.tuple_of_11 import tuple_of_11_to_python_tuple
 
 
+from contextlib import contextmanager
+
 import json
 import cv2
+import numpy as np
 
 from functions.utils.rectangle import Rectangle
-from functions.utils.segment import Segment
-from functions.utils.leaf import get_leaf_mask
+from functions.utils.segment import Segment, SegmentArray
+from functions.utils.leaf import get_leaf_mask_from_bgr
+from functions.utils.occupancy import LeafOccupancy, get_leaf_occupancy
+from functions.utils.decoded_cache import DecodedImageCache
+from functions.utils.tracing import trace_span
+from functions.utils.memory import memory_stage
+from functions.utils.density import canonical_size, resample_roi
 
 from functions.lengths.px_size import get_px_size
+from functions.lengths.calibration import PaperCalibration
 from functions.lengths.paper_roi import find_roi_boundaries, roi_boundaries_as_rect
 from functions.lengths.leaf_height import find_leaf_height
 from functions.lengths.leaf_width import get_leaf_widths, get_leaf_roi
-from functions.lengths.leaf_tip import get_top_tip_angle
+from functions.lengths.leaf_tip import TIP_ANGLE_ESTIMATORS
 from functions.lengths.leaf_contour import (
     find_leaf_contour,
     get_leaf_convexity,
@@ -26,6 +34,43 @@ from functions.lengths.leaf_contour import (
 )
 from functions.color.avg_color import get_avg_color
 
+# Version of the feature extraction algorithms. It must be increased
+# whenever a change can alter the value of a feature, so that results
+# cached with the old algorithms are not reused
+EXTRACTOR_VERSION = 1
+
+
+def extractor_version(
+    tip_estimator: str = "hough",
+    density: Optional[float] = None,
+    max_side: Optional[int] = None,
+) -> str:
+    """
+    Identifies the algorithms that compute the features of an
+    ImageFeatures
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - tip_estimator: the name of the algorithm that computes the tip
+        angle, among the keys of TIP_ANGLE_ESTIMATORS
+    - density: the pixel density the leaf is analysed at, if any (see
+        ImageFeatures)
+    - max_side: the longest side the images were reduced to before the
+        analysis, if any (see DecodedImageCache)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A string that changes whenever the features may change
+    """
+    res = f"{EXTRACTOR_VERSION}/{tip_estimator}"
+    if density is not None:
+        res += f"/{density:g}"
+    if max_side is not None:
+        res += f"/max_side={max_side}"
+    return res
+
 
 class ImageFeatures:
     """
@@ -44,18 +89,89 @@ class ImageFeatures:
         "model features" section. It must be an Optional[type]
     - add the getters for the value, that also update the attribute and
         set self.__modified to True if the value was changed
+    - wrap the computation in the getter in a span (with self.__span), so
+        that it appears in the traces
     - for any ImageFeature.__get... you call in the getter you added,
         go in that function and set as None the attribute you are working
         on, in order to ensure that your value is not cached if a
         dependency is changed
-    - add the getter to the correct location in the dict in to_JSON
+    - add the getter to the dict in __feature_getters (model features) or
+        to the "internal" section of to_JSON (internal values)
     - add a parser in load_details_from_file
     """
 
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        tip_estimator: str = "hough",
+        img: Optional[MatLike] = None,
+        calibration: Optional[PaperCalibration] = None,
+        check_calibration: bool = False,
+        decoded_cache: Optional[DecodedImageCache] = None,
+        low_memory: bool = False,
+        density: Optional[float] = None,
+    ) -> None:
+        """
+        Creates a new ImageFeatures, without computing anything yet
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the image
+        - tip_estimator: the name of the algorithm that computes the tip
+            angle, among the keys of TIP_ANGLE_ESTIMATORS
+        - img: the image already decoded, in BGR, if available (it is only
+            read, never modified). If not given, it is read from path when
+            needed
+        - calibration: the position of the paper and the size of the
+            pixels, if already known (they are not computed then)
+        - check_calibration: if set, the calibration is used only if the
+            paper is still where it expects (see PaperCalibration.matches),
+            otherwise the position and the pixel size are computed again
+        - decoded_cache: if given, and img is not, the image is taken from
+            this cache of decoded images instead of being decoded. If the
+            cache reduces the images, the description records it, and is
+            not reused by an ImageFeatures that analyses the full image
+            (nor the other way round)
+        - low_memory: if set, the image and the leaf masks are released as
+            soon as all the values computed from them are known, instead
+            of being kept until the ImageFeatures is deleted (an image
+            given as img is not released, as the caller keeps it anyway).
+            If a released one is needed again (for example, after a value
+            is invalidated), it is computed again
+        - density: if given, as soon as the paper and the pixel size are
+            known the paper ROI is resampled to this pixel density (in
+            pixels per mm, the same along both axes), and the leaf is
+            analysed there, with kernels of the same size in mm: the cost
+            does not depend on the resolution of the camera. The segments
+            and the lengths in pixels (perimeter and convexity) are then in
+            pixels of the resampled ROI. If not given, the leaf is analysed
+            at the native resolution of the image
+        """
+
+        if tip_estimator not in TIP_ANGLE_ESTIMATORS:
+            raise ValueError(f'Unknown tip angle estimator "{tip_estimator}"')
+        if density is not None and density <= 0:
+            raise ValueError(f"Invalid pixel density {density}: it must be positive")
+
         # Image, in BGR
-        self.__img: Optional[MatLike] = None
+        self.__img: Optional[MatLike] = img
         self.__path: str = path
+        self.__decoded_cache: Optional[DecodedImageCache] = decoded_cache
+        # The longest side the image is reduced to, if any
+        self.__max_side: Optional[int] = (
+            decoded_cache.max_side
+            if decoded_cache is not None and img is None
+            else None
+        )
+        self.__low_memory: bool = low_memory
+        self.__owns_img: bool = img is None
+        self.__density: Optional[float] = density
+
+        # Algorithms
+        self.__tip_estimator: str = tip_estimator
+        self.__calibration: Optional[PaperCalibration] = calibration
+        self.__check_calibration: bool = check_calibration
 
         # Modified flag
         self.__modified: bool = False
@@ -65,10 +181,13 @@ class ImageFeatures:
         self.__px_height_in_mm: Optional[float] = None
         self.__paper_roi: Optional[Rectangle] = None
         self.__height_segment: Optional[Segment] = None
-        self.__widths_segments: Optional[tuple_of_11[Segment]] = None
+        self.__widths_segments: Optional[SegmentArray] = None
         self.__leaf_max_width: Optional[Segment] = None
         self.__roi_boundaries: Optional[tuple[int, int, int, int]] = None
         self.__leaf_mask_of_roi: Optional[MatLike] = None
+        self.__leaf_occupancy: Optional[LeafOccupancy] = None
+        # The paper ROI resampled to the density, in BGR
+        self.__canonical_img: Optional[MatLike] = None
 
         # Model features
         self.__height: Optional[float] = None
@@ -82,41 +201,20 @@ class ImageFeatures:
         self.__avg_color_val: Optional[float] = None
 
     def to_JSON(self) -> dict[str, dict[str, Any]]:
-        width_segments = tuple_of_11_to_python_tuple(self.__get_widths_segments())
-        width_segments_json = [w.to_JSON() for w in width_segments]
 
         res: dict[str, dict[str, Any]] = {
-            "features": {
-                "height": self.__get_leaf_height(),
-                "max_width": self.__get_leaf_max_width(),
-                "tip_angle": self.__get_leaf_tip_angle(),
-                "leaf_convexity": self.__get_leaf_convexity(),
-                "perimeter": self.__get_leaf_perimeter(),
-                #
-                "width_0perc": self.__get_widths()[0],
-                # "width_10perc": self.__get_widths()[1],
-                "width_20perc": self.__get_widths()[2],
-                # "width_30perc": self.__get_widths()[3],
-                "width_40perc": self.__get_widths()[4],
-                # "width_50perc": self.__get_widths()[5],
-                "width_60perc": self.__get_widths()[6],
-                # "width_70perc": self.__get_widths()[7],
-                "width_80perc": self.__get_widths()[8],
-                # "width_90perc": self.__get_widths()[9],
-                "width_100perc": self.__get_widths()[10],
-                #
-                "avg_color_hue": self.__get_avg_color()[0],
-                "avg_color_sat": self.__get_avg_color()[1],
-                "avg_color_val": self.__get_avg_color()[2],
-            },
+            "features": self.get_features(),
             "internal": {
                 "px_width_in_mm": self.__get_px_width_in_mm(),
                 "px_height_in_mm": self.__get_px_height_in_mm(),
                 "paper_roi": self.__get_paper_roi().to_JSON(),
                 "height_segment": self.__get_leaf_height_segment().to_JSON(),
-                "widths": width_segments_json,
+                "widths": self.__get_widths_segments().to_JSON(),
                 "max_width": self.__get_leaf_max_width_segment().to_JSON(),
                 "roi_boundaries": self.__get_roi_boundaries(),
+                "tip_estimator": self.__tip_estimator,
+                "density": self.__density,
+                "max_side": self.__max_side,
             },
         }
 
@@ -146,6 +244,12 @@ class ImageFeatures:
 
         internals, features = data["internal"], data["features"]
 
+        # Nothing is valid if the image was reduced to another size: even
+        # the pixel size and the paper ROI are in its pixels (files without
+        # the information were computed on the full image)
+        if internals.get("max_side", None) != self.__max_side:
+            return self
+
         if internals.get("px_width_in_mm", None):
             self.__px_width_in_mm = internals["px_width_in_mm"]
 
@@ -155,20 +259,24 @@ class ImageFeatures:
         if internals.get("paper_roi", None):
             self.__paper_roi = Rectangle.from_JSON(internals["paper_roi"])
 
+        if internals.get("roi_boundaries", None):
+            self.__roi_boundaries = internals["roi_boundaries"]
+
+        # The other values are valid only if the leaf was analysed at the
+        # same density (files without the information were analysed at the
+        # native resolution)
+        if internals.get("density", None) != self.__density:
+            return self
+
         if internals.get("height_segment", None):
             self.__height_segment = Segment.from_JSON(internals["height_segment"])
 
         if internals.get("widths", None):
-            self.__widths_segments = to_tuple_of_11(
-                [Segment.from_JSON(segm) for segm in internals["widths"]]
-            )
+            self.__widths_segments = SegmentArray.from_JSON(internals["widths"])
 
         if internals.get("max_width", None):
             self.__leaf_max_width = Segment.from_JSON(internals["max_width"])
 
-        if internals.get("roi_boundaries", None):
-            self.__roi_boundaries = internals["roi_boundaries"]
-
         # Features
 
         if features.get("height", None):
@@ -177,7 +285,11 @@ class ImageFeatures:
         if features.get("max_width", None):
             self.__max_width = features["max_width"]
 
-        if features.get("tip_angle", None):
+        # The tip angle is valid only if computed with the same algorithm
+        # (files without the information were computed with hough)
+        if features.get("tip_angle", None) and (
+            internals.get("tip_estimator", "hough") == self.__tip_estimator
+        ):
             self.__tip_angle = features["tip_angle"]
 
         if features.get("leaf_convexity", None):
@@ -217,55 +329,193 @@ class ImageFeatures:
             with open(path, "w") as f:
                 f.write(result)
 
+    def is_complete(self) -> bool:
+        """
+        Tells if all the values stored by to_JSON are already known (for
+        example, loaded from a file), so that nothing has to be computed
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether all the values are known
+        """
+        return all(
+            value is not None
+            for value in [
+                self.__px_width_in_mm,
+                self.__px_height_in_mm,
+                self.__paper_roi,
+                self.__height_segment,
+                self.__widths_segments,
+                self.__leaf_max_width,
+                self.__roi_boundaries,
+                self.__height,
+                self.__max_width,
+                self.__tip_angle,
+                self.__leaf_convexity,
+                self.__perimeter,
+                self.__avg_color_hue,
+                self.__avg_color_sat,
+                self.__avg_color_val,
+            ]
+        )
+
     def get_features(self) -> dict[str, Any]:
-        return self.to_JSON()["features"]
+        """
+        Computes all the model features of the image, without building the
+        internal values section of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        A dict that associates each feature name to its value
+        """
+        return {name: getter() for name, getter in self.__feature_getters().items()}
+
+    def get_feature_vector(
+        self, features: Optional[list[str]] = None
+    ) -> np.ndarray[Any, Any]:
+        """
+        Computes the requested model features of the image, and returns them
+        as an array. Only the values needed by those features are computed
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - features: the names of the features, in the order expected by the
+            model. If not given, all the features are returned, in the same
+            order as get_features
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The values of the features, as a float64 array
+        """
+
+        getters = self.__feature_getters()
+        names = list(getters.keys()) if features is None else features
+
+        unknown = [name for name in names if name not in getters]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown features: {', '.join(unknown)}")
+
+        return np.fromiter(
+            (getters[name]() for name in names), dtype=np.float64, count=len(names)
+        )
+
+    def __feature_getters(self) -> dict[str, Callable[[], float]]:
+        """
+        Lists the model features of the image, each with the getter that
+        computes it. The order is the one of the "features" section of
+        to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        A dict that associates each feature name to its getter
+        """
+        return {
+            "height": self.__get_leaf_height,
+            "max_width": self.__get_leaf_max_width,
+            "tip_angle": self.__get_leaf_tip_angle,
+            "leaf_convexity": self.__get_leaf_convexity,
+            "perimeter": self.__get_leaf_perimeter,
+            #
+            "width_0perc": lambda: self.__get_widths()[0],
+            # "width_10perc": lambda: self.__get_widths()[1],
+            "width_20perc": lambda: self.__get_widths()[2],
+            # "width_30perc": lambda: self.__get_widths()[3],
+            "width_40perc": lambda: self.__get_widths()[4],
+            # "width_50perc": lambda: self.__get_widths()[5],
+            "width_60perc": lambda: self.__get_widths()[6],
+            # "width_70perc": lambda: self.__get_widths()[7],
+            "width_80perc": lambda: self.__get_widths()[8],
+            # "width_90perc": lambda: self.__get_widths()[9],
+            "width_100perc": lambda: self.__get_widths()[10],
+            #
+            "avg_color_hue": lambda: self.__get_avg_color()[0],
+            "avg_color_sat": lambda: self.__get_avg_color()[1],
+            "avg_color_val": lambda: self.__get_avg_color()[2],
+        }
 
     def __get_px_width_in_mm(self) -> float:
         if self.__px_width_in_mm:
             return self.__px_width_in_mm
 
-        self.__px_width_in_mm = get_px_size(
-            cv2.cvtColor(self.__get_img(), cv2.COLOR_BGR2HSV),
-            self.__get_paper_roi(),
-            False,
-        )
+        calibration = self.__get_calibration()
+        if calibration is not None:
+            self.__px_width_in_mm = calibration.px_width_in_mm
+        else:
+            with self.__span("px_width_in_mm"):
+                self.__px_width_in_mm = get_px_size(
+                    cv2.cvtColor(self.__get_img(), cv2.COLOR_BGR2HSV),
+                    self.__get_paper_roi(),
+                    False,
+                )
         self.__modified = True
         self.__max_width = None
+        self.__canonical_img = None
         return self.__px_width_in_mm
 
     def __get_px_height_in_mm(self) -> float:
         if self.__px_height_in_mm:
             return self.__px_height_in_mm
 
-        self.__px_height_in_mm = get_px_size(
-            cv2.cvtColor(self.__get_img(), cv2.COLOR_BGR2HSV),
-            self.__get_paper_roi(),
-            True,
-        )
+        calibration = self.__get_calibration()
+        if calibration is not None:
+            self.__px_height_in_mm = calibration.px_height_in_mm
+        else:
+            with self.__span("px_height_in_mm"):
+                self.__px_height_in_mm = get_px_size(
+                    cv2.cvtColor(self.__get_img(), cv2.COLOR_BGR2HSV),
+                    self.__get_paper_roi(),
+                    True,
+                )
         self.__modified = True
         self.__height = None
+        self.__canonical_img = None
         return self.__px_height_in_mm
 
     def __get_paper_roi(self) -> Rectangle:
         if self.__paper_roi:
             return self.__paper_roi
 
-        self.__paper_roi = roi_boundaries_as_rect(find_roi_boundaries(self.__get_img()))
+        calibration = self.__get_calibration()
+        if calibration is not None:
+            self.__paper_roi = calibration.paper_roi()
+        else:
+            with self.__span("paper_roi"):
+                self.__paper_roi = roi_boundaries_as_rect(
+                    find_roi_boundaries(self.__get_img())
+                )
         self.__modified = True
         self.__px_width_in_mm = None
         self.__px_height_in_mm = None
+        self.__canonical_img = None
+        self.__leaf_occupancy = None
         self.__height_segment = None
         self.__widths_segments = None
         self.__leaf_max_width = None
         return self.__paper_roi
 
+    def __get_leaf_occupancy(self) -> LeafOccupancy:
+        if self.__leaf_occupancy is not None:
+            return self.__leaf_occupancy
+
+        with self.__span("leaf_occupancy"):
+            self.__leaf_occupancy = get_leaf_occupancy(
+                self.__get_work_img(), self.__get_work_roi()
+            )
+        return self.__leaf_occupancy
+
     def __get_leaf_height_segment(self) -> Segment:
         if self.__height_segment:
             return self.__height_segment
 
-        self.__height_segment = find_leaf_height(
-            self.__get_img(), self.__get_paper_roi()
-        )
+        with self.__span("leaf_height"):
+            self.__height_segment = find_leaf_height(
+                self.__get_leaf_occupancy(), self.__get_work_roi()
+            )
         self.__modified = True
         self.__height = None
         self.__widths_segments = None
@@ -278,7 +528,7 @@ class ImageFeatures:
             return self.__height
 
         height_px = self.__get_leaf_height_segment().length
-        self.__height = height_px * self.__get_px_height_in_mm()
+        self.__height = height_px * self.__get_work_px_height_in_mm()
         self.__modified = True
         return self.__height
 
@@ -286,8 +536,13 @@ class ImageFeatures:
         if self.__roi_boundaries is not None:
             return self.__roi_boundaries
 
-        l, r, t, b = find_roi_boundaries(self.__get_img())
-        self.__roi_boundaries = (int(l), int(r), int(t), int(b))
+        calibration = self.__get_calibration()
+        if calibration is not None:
+            self.__roi_boundaries = calibration.roi_boundaries
+        else:
+            with self.__span("roi_boundaries"):
+                l, r, t, b = find_roi_boundaries(self.__get_img())
+            self.__roi_boundaries = (int(l), int(r), int(t), int(b))
         self.__leaf_mask_of_roi = None
         self.__modified = True
         return self.__roi_boundaries
@@ -296,10 +551,15 @@ class ImageFeatures:
         if self.__leaf_mask_of_roi is not None:
             return self.__leaf_mask_of_roi
 
-        img = self.__get_img()
-        l, r, t, b = self.__get_roi_boundaries()
-        img = img[t:b, l:r]
-        self.__leaf_mask_of_roi = get_leaf_mask(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+        if self.__density is not None:
+            # The resampled ROI is the paper ROI, not the (padded) ROI
+            # boundaries: the kernels of the next steps are sized for it
+            img = self.__get_work_img()
+        else:
+            l, r, t, b = self.__get_roi_boundaries()
+            img = self.__get_img()[t:b, l:r]
+        with self.__span("leaf_mask"):
+            self.__leaf_mask_of_roi = get_leaf_mask_from_bgr(img, self.__density)
 
         self.__modified = True
         return self.__leaf_mask_of_roi
@@ -309,7 +569,10 @@ class ImageFeatures:
             return self.__tip_angle
 
         leaf_mask = self.__get_leaf_mask_of_roi()
-        self.__tip_angle = get_top_tip_angle(leaf_mask)
+        with self.__span("tip_angle"):
+            self.__tip_angle = TIP_ANGLE_ESTIMATORS[self.__tip_estimator](
+                leaf_mask, self.__density
+            )
 
         self.__modified = True
         return self.__tip_angle
@@ -319,8 +582,9 @@ class ImageFeatures:
             return self.__leaf_convexity
 
         leaf_mask = self.__get_leaf_mask_of_roi()
-        contour = find_leaf_contour(leaf_mask)
-        self.__leaf_convexity = get_leaf_convexity(contour)
+        with self.__span("convexity"):
+            contour = find_leaf_contour(leaf_mask, self.__density)
+            self.__leaf_convexity = get_leaf_convexity(contour)
 
         self.__modified = True
         return self.__leaf_convexity
@@ -330,19 +594,23 @@ class ImageFeatures:
             return self.__perimeter
 
         leaf_mask = self.__get_leaf_mask_of_roi()
-        contour = find_leaf_contour(leaf_mask)
-        self.__perimeter = get_leaf_perimeter(contour)
+        with self.__span("perimeter"):
+            contour = find_leaf_contour(leaf_mask, self.__density)
+            self.__perimeter = get_leaf_perimeter(contour)
 
         self.__modified = True
         return self.__perimeter
 
-    def __get_widths_segments(self) -> tuple_of_11[Segment]:
-        if self.__widths_segments:
+    def __get_widths_segments(self) -> SegmentArray:
+        if self.__widths_segments is not None:
             return self.__widths_segments
 
-        self.__widths_segments = get_leaf_widths(
-            self.__get_img(), self.__get_paper_roi(), self.__get_leaf_height_segment()
-        )
+        with self.__span("widths"):
+            self.__widths_segments = get_leaf_widths(
+                self.__get_leaf_occupancy(),
+                self.__get_work_roi(),
+                self.__get_leaf_height_segment(),
+            )
         self.__modified = True
         self.__leaf_max_width = None
         self.__widths = None
@@ -352,12 +620,13 @@ class ImageFeatures:
         if self.__leaf_max_width:
             return self.__leaf_max_width
 
-        self.__leaf_max_width = get_leaf_roi(
-            self.__get_img(),
-            self.__get_paper_roi(),
-            self.__get_widths_segments(),
-            self.__get_leaf_height_segment(),
-        ).get_horiz()
+        with self.__span("max_width"):
+            self.__leaf_max_width = get_leaf_roi(
+                self.__get_leaf_occupancy(),
+                self.__get_work_roi(),
+                self.__get_widths_segments(),
+                self.__get_leaf_height_segment(),
+            ).get_horiz()
         self.__modified = True
         self.__max_width = None
         self.__widths = None
@@ -369,7 +638,7 @@ class ImageFeatures:
             return self.__max_width
 
         width_px = self.__get_leaf_max_width_segment().length
-        self.__max_width = width_px * self.__get_px_width_in_mm()
+        self.__max_width = width_px * self.__get_work_px_width_in_mm()
         self.__modified = True
         return self.__max_width
 
@@ -378,11 +647,9 @@ class ImageFeatures:
             return self.__widths
 
         maxw = self.__get_leaf_max_width_segment().length
-        widths_segm = tuple_of_11_to_python_tuple(self.__get_widths_segments())
-
-        widths_perc_list = [segm.length * 1.0 / maxw for segm in widths_segm]
+        widths_segm = self.__get_widths_segments()
 
-        self.__widths = to_tuple_of_11(widths_perc_list)
+        self.__widths = to_tuple_of_11((widths_segm.lengths / maxw).tolist())
 
         self.__modified = True
         return self.__widths
@@ -397,15 +664,174 @@ class ImageFeatures:
         if self.__avg_color_hue and self.__avg_color_sat and self.__avg_color_val:
             return (self.__avg_color_hue, self.__avg_color_sat, self.__avg_color_val)
 
-        self.__avg_color_hue, self.__avg_color_sat, self.__avg_color_val = (
-            get_avg_color(self.__get_img(), self.__get_leaf_roi())
-        )
+        with self.__span("avg_color"):
+            self.__avg_color_hue, self.__avg_color_sat, self.__avg_color_val = (
+                get_avg_color(
+                    self.__get_work_img(), self.__get_leaf_roi(), self.__density
+                )
+            )
 
         self.__modified = True
         return (self.__avg_color_hue, self.__avg_color_sat, self.__avg_color_val)
 
+    def __get_calibration(self) -> Optional[PaperCalibration]:
+        if self.__calibration is None or not self.__check_calibration:
+            return self.__calibration
+
+        # Check the calibration only once, the first time it is needed
+        self.__check_calibration = False
+        with self.__span("check_calibration"):
+            matches = self.__calibration.matches(self.__get_img())
+        if not matches:
+            print(
+                f'The paper sheet in "{self.__path}" is not where the calibration '
+                "expects it: it will be detected again"
+            )
+            self.__calibration = None
+
+        return self.__calibration
+
     def __get_img(self) -> MatLike:
         if self.__img is None:
-            self.__img = cv2.imread(self.__path)
+            with self.__span("decode"):
+                if self.__decoded_cache is not None:
+                    self.__img = self.__decoded_cache.load(self.__path)
+                else:
+                    self.__img = cv2.imread(self.__path)
 
         return self.__img
+
+    def __get_work_img(self) -> MatLike:
+        """
+        The image the leaf is analysed on: the paper ROI resampled to the
+        density if one was given, otherwise the whole image
+        """
+        if self.__density is None:
+            return self.__get_img()
+        if self.__canonical_img is not None:
+            return self.__canonical_img
+
+        img = self.__get_img()
+        paper_roi = self.__get_paper_roi()
+        px_width_in_mm = self.__get_px_width_in_mm()
+        px_height_in_mm = self.__get_px_height_in_mm()
+        with self.__span("resample"):
+            self.__canonical_img = resample_roi(
+                img, paper_roi, px_width_in_mm, px_height_in_mm, self.__density
+            )
+        self.__leaf_occupancy = None
+        self.__leaf_mask_of_roi = None
+        return self.__canonical_img
+
+    def __get_work_roi(self) -> Rectangle:
+        """
+        The paper ROI in the image the leaf is analysed on: the whole
+        resampled paper ROI if a density was given (its size is known
+        without resampling it)
+        """
+        if self.__density is None:
+            return self.__get_paper_roi()
+        width, height = canonical_size(
+            self.__get_paper_roi(),
+            self.__get_px_width_in_mm(),
+            self.__get_px_height_in_mm(),
+            self.__density,
+        )
+        return Rectangle.from_values(0, 0, width, height)
+
+    def __get_work_px_width_in_mm(self) -> float:
+        if self.__density is None:
+            return self.__get_px_width_in_mm()
+        return 1 / self.__density
+
+    def __get_work_px_height_in_mm(self) -> float:
+        if self.__density is None:
+            return self.__get_px_height_in_mm()
+        return 1 / self.__density
+
+    @contextmanager
+    def __span(self, name: str) -> Iterator[None]:
+        """
+        Records the computation of a value as a span of the trace, and
+        measures its memory, tagged with the path of the image (if enabled,
+        see trace_span and memory_stage)
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - name: the name of the span
+        """
+
+        with trace_span(name, "features", image=self.__path), memory_stage(
+            name, self.__path
+        ):
+            yield
+
+        if self.__low_memory:
+            self.__release_buffers()
+
+    def __release_buffers(self) -> None:
+        """
+        In low memory mode, releases the leaf masks and the image once all
+        the values computed from them are known
+        """
+
+        if all(
+            value is not None
+            for value in [
+                self.__height_segment,
+                self.__widths_segments,
+                self.__leaf_max_width,
+            ]
+        ):
+            self.__leaf_occupancy = None
+
+        if all(
+            value is not None
+            for value in [self.__tip_angle, self.__leaf_convexity, self.__perimeter]
+        ):
+            self.__leaf_mask_of_roi = None
+
+        if (
+            self.__owns_img
+            and self.__canonical_img is not None
+            and not self.__check_calibration
+            and all(
+                value is not None
+                for value in [
+                    self.__px_width_in_mm,
+                    self.__px_height_in_mm,
+                    self.__paper_roi,
+                    self.__roi_boundaries,
+                ]
+            )
+        ):
+            # The rest of the analysis only needs the resampled ROI
+            self.__img = None
+
+        if (
+            self.__leaf_occupancy is None
+            and self.__leaf_mask_of_roi is None
+            and not self.__check_calibration
+            and all(
+                value is not None
+                for value in [
+                    self.__height_segment,
+                    self.__widths_segments,
+                    self.__leaf_max_width,
+                    self.__tip_angle,
+                    self.__leaf_convexity,
+                    self.__perimeter,
+                    self.__px_width_in_mm,
+                    self.__px_height_in_mm,
+                    self.__paper_roi,
+                    self.__roi_boundaries,
+                    self.__avg_color_hue,
+                    self.__avg_color_sat,
+                    self.__avg_color_val,
+                ]
+            )
+        ):
+            self.__canonical_img = None
+            if self.__owns_img:
+                self.__img = None
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+from cv2.typing import MatLike
+
+from functions.utils.rectangle import Rectangle
+from functions.lengths.paper_roi import find_roi_boundaries, roi_boundaries_as_rect
+from functions.lengths.px_size import get_px_size
+
+# Lightness (in HLS) above which a pixel is considered white paper, as in
+# the detection of the paper sheet
+PAPER_MIN_LIGHTNESS = 125
+
+# Width of the strips checked along the sides of the ROI, as a fraction of
+# the ROI size
+CHECK_STRIP_FRACTION = 0.02
+
+# Only one pixel every CHECK_STEP rows and columns of the strips is checked
+CHECK_STEP = 4
+
+# Minimum fraction of paper pixels in each strip inside the ROI for the
+# calibration to be still valid
+CHECK_MIN_PAPER = 0.9
+
+# Distance of the strips outside the ROI from it, as a fraction of the
+# smallest size of the image (beyond the padding applied by
+# find_roi_boundaries, so they fall on the background), and maximum
+# fraction of paper pixels in them
+CHECK_OUTSIDE_DISTANCE = 0.04
+CHECK_MAX_OUTSIDE_PAPER = 0.5
+
+# Folder where the calibration profiles of the rigs are stored, one json
+# file per profile
+PROFILES_FOLDER = "./calibration_profiles"
+
+
+def profile_path(name: str, folder: Optional[str] = None) -> str:
+    """
+    Returns the path of the file of a calibration profile
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - name: the name of the profile (letters, digits, "_" and "-" only)
+    - folder: the folder of the profiles (None for PROFILES_FOLDER)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The path of the json file of the profile
+    """
+
+    if re.fullmatch(r"[\w-]+", name) is None:
+        raise ValueError(f'Invalid profile name "{name}"')
+
+    return os.path.join(PROFILES_FOLDER if folder is None else folder, f"{name}.json")
+
+
+class PaperCalibration:
+    """
+    The position of the paper sheet in the picture, and the size of its
+    pixels: the results of the most expensive steps of the analysis, which
+    depend only on the camera and sheet placement, and can therefore be
+    reused for all the pictures taken in the same conditions
+    """
+
+    def __init__(
+        self,
+        roi_boundaries: tuple[int, int, int, int],
+        px_width_in_mm: float,
+        px_height_in_mm: float,
+    ) -> None:
+        """
+        Creates a new calibration
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - roi_boundaries: the paper ROI, as returned by find_roi_boundaries
+        - px_width_in_mm: the width of a pixel, in mm
+        - px_height_in_mm: the height of a pixel, in mm
+        """
+        self.roi_boundaries = roi_boundaries
+        self.px_width_in_mm = px_width_in_mm
+        self.px_height_in_mm = px_height_in_mm
+
+    @classmethod
+    def detect(cls, img: MatLike) -> PaperCalibration:
+        """
+        Computes the calibration from a picture, with the same algorithms
+        used for the single images
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img: the picture, in BGR
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The calibration
+        """
+
+        l, r, t, b = find_roi_boundaries(img)
+        roi_boundaries = (int(l), int(r), int(t), int(b))
+        paper_roi = roi_boundaries_as_rect(roi_boundaries)
+
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        return cls(
+            roi_boundaries,
+            get_px_size(hsv, paper_roi, False),
+            get_px_size(hsv, paper_roi, True),
+        )
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> PaperCalibration:
+        """
+        Creates a new calibration from a dictionary representation of it
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The calibration, as a PaperCalibration
+        """
+
+        if any(
+            key not in details
+            for key in ["roi_boundaries", "px_width_in_mm", "px_height_in_mm"]
+        ):
+            raise Exception("Invalid JSON format")
+
+        l, r, t, b = details["roi_boundaries"]
+        return cls(
+            (int(l), int(r), int(t), int(b)),
+            details["px_width_in_mm"],
+            details["px_height_in_mm"],
+        )
+
+    @classmethod
+    def load_profile(cls, name: str, folder: Optional[str] = None) -> PaperCalibration:
+        """
+        Loads a calibration saved with store_profile
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - name: the name of the profile
+        - folder: the folder of the profiles (None for PROFILES_FOLDER)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The calibration
+        """
+
+        path = profile_path(name, folder)
+        if not os.path.exists(path):
+            raise ValueError(f'Unknown calibration profile "{name}"')
+
+        with open(path, "r") as f:
+            return cls.from_JSON(json.load(f))
+
+    def store_profile(
+        self,
+        name: str,
+        reference: Optional[str] = None,
+        folder: Optional[str] = None,
+    ) -> str:
+        """
+        Saves the calibration as a named profile, replacing the profile
+        with the same name if it exists
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - name: the name of the profile
+        - reference: the path of the picture the calibration was computed
+            from, stored only for reference
+        - folder: the folder of the profiles (None for PROFILES_FOLDER)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The path of the file of the profile
+        """
+
+        path = profile_path(name, folder)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        details = self.to_JSON()
+        if reference is not None:
+            details["reference"] = reference
+
+        with open(path, "w") as f:
+            json.dump(details, f, indent=4)
+        return path
+
+    def paper_roi(self) -> Rectangle:
+        """
+        Returns the paper ROI as a Rectangle
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The paper ROI
+        """
+        return roi_boundaries_as_rect(self.roi_boundaries)
+
+    def matches(self, img: MatLike) -> bool:
+        """
+        Cheaply checks if a picture was taken in the same conditions as the
+        calibration: thin strips along the 4 sides of the paper ROI must
+        still be (almost all) white paper, while strips a bit further out
+        must be (mostly) background, otherwise the sheet moved or the
+        camera zoomed.
+        Only a few thousand pixels are checked, so it can be run on every
+        frame of a video
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img: the picture, in BGR
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the calibration can be used for the picture
+        """
+
+        l, r, t, b = self.roi_boundaries
+        if r > img.shape[1] or b > img.shape[0] or l >= r or t >= b:
+            return False
+
+        strip_w = max(1, int((r - l) * CHECK_STRIP_FRACTION))
+        strip_h = max(1, int((b - t) * CHECK_STRIP_FRACTION))
+
+        inside = [
+            img[t:b:CHECK_STEP, l : l + strip_w : CHECK_STEP],
+            img[t:b:CHECK_STEP, r - strip_w : r : CHECK_STEP],
+            img[t : t + strip_h : CHECK_STEP, l:r:CHECK_STEP],
+            img[b - strip_h : b : CHECK_STEP, l:r:CHECK_STEP],
+        ]
+        if any(self.__paper_fraction(strip) < CHECK_MIN_PAPER for strip in inside):
+            return False
+
+        # The strips outside the image (if the sheet touches its border)
+        # are empty, and not checked
+        d = int(CHECK_OUTSIDE_DISTANCE * min(img.shape[:2]))
+        outside = [
+            img[t:b:CHECK_STEP, max(0, l - d - strip_w) : max(0, l - d) : CHECK_STEP],
+            img[t:b:CHECK_STEP, r + d : r + d + strip_w : CHECK_STEP],
+            img[max(0, t - d - strip_h) : max(0, t - d) : CHECK_STEP, l:r:CHECK_STEP],
+            img[b + d : b + d + strip_h : CHECK_STEP, l:r:CHECK_STEP],
+        ]
+        if any(
+            self.__paper_fraction(strip) > CHECK_MAX_OUTSIDE_PAPER
+            for strip in outside
+            if strip.size > 0
+        ):
+            return False
+
+        return True
+
+    @staticmethod
+    def __paper_fraction(strip: MatLike) -> float:
+        """
+        Computes the fraction of pixels of a region that are white paper
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - strip: the region, in BGR
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The fraction of paper pixels, between 0 and 1
+        """
+
+        hls = cv2.cvtColor(np.ascontiguousarray(strip), cv2.COLOR_BGR2HLS)
+        paper = np.count_nonzero(hls[:, :, 1] >= PAPER_MIN_LIGHTNESS)
+        return paper / (strip.shape[0] * strip.shape[1])
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the calibration to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The calibration as JSON object (a dict)
+        """
+        return {
+            "roi_boundaries": list(self.roi_boundaries),
+            "px_width_in_mm": self.px_width_in_mm,
+            "px_height_in_mm": self.px_height_in_mm,
+        }
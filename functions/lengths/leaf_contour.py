@@ -1,9 +1,19 @@
+from typing import Optional
+
 import cv2
 import numpy as np
 
 from cv2.typing import MatLike
 
-def find_leaf_contour(mask: MatLike) -> MatLike:
+from functions.utils.density import DATASET_PX_PER_MM, kernel_size
+
+# Size of the closing that fills the holes of the leaf, and of the opening
+# that removes the noise, in mm (104 and 12 pixels on the photos of the
+# dataset)
+CONTOUR_CLOSING_MM = 104 / DATASET_PX_PER_MM
+CONTOUR_OPENING_MM = 12 / DATASET_PX_PER_MM
+
+def find_leaf_contour(mask: MatLike, density: Optional[float] = None) -> MatLike:
     """
     The function retrives the leaf contour using openCV findContours
     function
@@ -12,6 +22,8 @@ def find_leaf_contour(mask: MatLike) -> MatLike:
     PARAMETERS
     ----------
     - leafMask: the tresholded image of the leaf, a bitmap
+    - density: the pixel density of the mask, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
 
     ---------------------------------------------------------------------
     OUTPUT
@@ -25,13 +37,17 @@ def find_leaf_contour(mask: MatLike) -> MatLike:
     # in distinguishing between different contours
     ker2 = np.ones((6,6), np.uint8)
     ker3 = np.ones((2,2), np.uint8)
-    kerR  = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(104, 104))
+    closing = kernel_size(CONTOUR_CLOSING_MM, density)
+    kerR  = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(closing, closing))
 
+    # (the mask of the caller is not modified: the next steps work in place
+    # on the dilated copy)
     mask = cv2.dilate(mask, kerR)
-    mask = cv2.erode(mask, kerR)
+    cv2.erode(mask, kerR, dst=mask)
 
     # noise cleanup
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((12,12)))
+    opening = kernel_size(CONTOUR_OPENING_MM, density)
+    cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((opening, opening)), dst=mask)
 
     # add a 10px black border around the image, so the leaves which exceed the image
     # dimensions are properly elaborated by Canny and then by the findContour function
@@ -41,10 +57,13 @@ def find_leaf_contour(mask: MatLike) -> MatLike:
     # the new coordinates are not usable on the leaf maske beacuse now the image is bigger,
     # however the features which will be extracted are not position related so we'll ignore that 
 
+    del mask
+
     edge = cv2.Canny(maskEx, 175, 175)
-    edge = cv2.dilate(edge, ker2)   
-    edge = cv2.erode(edge, ker2)
-    edge = cv2.dilate(edge, ker3)  
+    del maskEx
+    cv2.dilate(edge, ker2, dst=edge)
+    cv2.erode(edge, ker2, dst=edge)
+    cv2.dilate(edge, ker3, dst=edge)
 
     contours, hierarchy = cv2.findContours(edge, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     # contours contains all the detected contours
@@ -1,9 +1,6 @@
-from cv2.typing import MatLike
-import cv2
-
 from functions.utils.segment import Segment
 from functions.utils.rectangle import Rectangle
-from functions.utils.leaf import is_px_leaf
+from functions.utils.occupancy import LeafOccupancy
 
 
 MIN_LEAF_HUE = 0
@@ -12,32 +9,8 @@ MIN_LEAF_SAT = 110
 MAX_LEAF_VAL = 150
 
 
-def __is_leaf_in_line(img: MatLike, horiz_segment: Segment, y_coord: int) -> bool:
-    """
-    Checks if a line of pixels contains the leaf
-    ---------------------------------------------------------------------
-
-    Parameters
-    ----------
-    - img: the image to consider, in HSV
-    - horiz_segment: the horizontal ROI where to look for
-    - y_coord: the line of pixels to be analyzed
-
-    ---------------------------------------------------------------------
-    Returns
-    -------
-    Whether the chosen line includes parts of the leaf or not
-    """
-
-    for x in range(horiz_segment.corner, horiz_segment.other_corner()):
-        if (is_px_leaf(img[y_coord, x])):
-            return True
-
-    return False
-
-
 def __find_leaf_extreme_recurs(
-    img: MatLike, region: Rectangle, top_border: bool
+    occupancy: LeafOccupancy, region: Rectangle, top_border: bool
 ) -> int:
     """
     Recursively finds the highest or lowest y level where there is the
@@ -46,7 +19,7 @@ def __find_leaf_extreme_recurs(
 
     Parameters
     ----------
-    - img: the image to consider, in HSV
+    - occupancy: the leaf occupancy index of the image
     - region: the paper region, where to search
     - top_border: whether to look for the topmost (True) or bottommost
         (False) point of the leaf
@@ -58,7 +31,7 @@ def __find_leaf_extreme_recurs(
     """
 
     middle = region.vert.middle()
-    leaf_present_in_middle = __is_leaf_in_line(img, region.get_horiz(), middle)
+    leaf_present_in_middle = occupancy.is_row_occupied(middle)
 
     # If the region to search is 1-tall, it's the end of the search
     if region.vert.length == 1:
@@ -73,22 +46,22 @@ def __find_leaf_extreme_recurs(
         vert = region.vert.second_half()
 
     res = __find_leaf_extreme_recurs(
-        img, Rectangle(region.get_horiz(), vert), top_border
+        occupancy, Rectangle(region.get_horiz(), vert), top_border
     )
 
-    if (region.get_vert().length < 0.05 * img.shape[0]) or __is_leaf_in_line(
-        img, region.get_horiz(), res
-    ):
+    if (
+        region.get_vert().length < 0.05 * occupancy.mask.shape[0]
+    ) or occupancy.is_row_occupied(res):
         return res
 
     vert = region.get_vert().other_half(vert)
 
     return __find_leaf_extreme_recurs(
-        img, Rectangle(region.get_horiz(), vert), top_border
+        occupancy, Rectangle(region.get_horiz(), vert), top_border
     )
 
 
-def find_leaf_height(img: MatLike, region: Rectangle) -> Segment:
+def find_leaf_height(occupancy: LeafOccupancy, region: Rectangle) -> Segment:
     """
     Performs a binary search along the height of the image to find the y
     coordinates of the first and last px that includes the leaf.
@@ -96,7 +69,8 @@ def find_leaf_height(img: MatLike, region: Rectangle) -> Segment:
     ---------------------------------------------------------------------
     Parameters
     ----------
-    - img: the image to consider, in BGR
+    - occupancy: the leaf occupancy index of the image, computed on the
+        same region
     - region: the paper region, where to search
 
     ---------------------------------------------------------------------
@@ -106,9 +80,7 @@ def find_leaf_height(img: MatLike, region: Rectangle) -> Segment:
     relative to the full image)
     """
 
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-    top = __find_leaf_extreme_recurs(img, region, True)
-    bottom = __find_leaf_extreme_recurs(img, region, False)
+    top = __find_leaf_extreme_recurs(occupancy, region, True)
+    bottom = __find_leaf_extreme_recurs(occupancy, region, False)
 
     return Segment(top, bottom - top)
@@ -2,10 +2,20 @@ import cv2
 import numpy as np
 from cv2.typing import MatLike
 import math
-from typing import Tuple
+from typing import Optional, Tuple
 
+from functions.utils.density import DATASET_PX_PER_MM, kernel_size
 
-def get_top_tip_angle(thImg: MatLike) -> float:
+# Parameters of the Hough transform that finds the segments of the edge, in
+# mm (50, 40 and 30 pixels on the photos of the dataset): the minimum
+# number of edge pixels on a segment, its minimum length and the largest
+# gap between two of its pixels
+HOUGH_THRESHOLD_MM = 50 / DATASET_PX_PER_MM
+HOUGH_MIN_LINE_LENGTH_MM = 40 / DATASET_PX_PER_MM
+HOUGH_MAX_LINE_GAP_MM = 30 / DATASET_PX_PER_MM
+
+
+def get_top_tip_angle(thImg: MatLike, density: Optional[float] = None) -> float:
     """
     Returns the the top tip angle of the leaf passed as a tresholded
     image. It uses the Hough tranform to find the segments that compose
@@ -16,6 +26,8 @@ def get_top_tip_angle(thImg: MatLike) -> float:
     PARAMETERS
     ----------
     - thImg: the mask (bitmap) of the leaf
+    - density: the pixel density of the mask, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
 
     ---------------------------------------------------------------------
     OUTPUT
@@ -28,7 +40,14 @@ def get_top_tip_angle(thImg: MatLike) -> float:
     leafEdge = cv2.morphologyEx(thImg, cv2.MORPH_GRADIENT, kernel)
 
     
-    lines = cv2.HoughLinesP(leafEdge, 1, np.pi / 180, 50, minLineLength=40, maxLineGap=30)
+    lines = cv2.HoughLinesP(
+        leafEdge,
+        1,
+        np.pi / 180,
+        kernel_size(HOUGH_THRESHOLD_MM, density),
+        minLineLength=kernel_size(HOUGH_MIN_LINE_LENGTH_MM, density),
+        maxLineGap=kernel_size(HOUGH_MAX_LINE_GAP_MM, density),
+    )
 
     if len(lines) < 1:
         raise ValueError("The hough transform has not been able to locate any segment. Please check the imput")
@@ -153,3 +172,80 @@ def get_top_tip_angle(thImg: MatLike) -> float:
     tipAngle = tipAngle/math.pi*180
 
     return tipAngle
+
+
+# Fraction of the leaf height, starting from the top, where the sides of
+# the tip are measured
+TIP_BAND_FRACTION = 0.08
+# Minimum height of the band, in mm (8 pixels on the photos of the dataset)
+TIP_BAND_MIN_MM = 8 / DATASET_PX_PER_MM
+# Fraction of the band, at its top, ignored because the apex is rounded
+TIP_SKIP_FRACTION = 0.1
+
+
+def get_top_tip_angle_from_contour(
+    thImg: MatLike, density: Optional[float] = None
+) -> float:
+    """
+    Returns the the top tip angle of the leaf passed as a tresholded
+    image, without using the Hough transform.
+    It considers only a thin band at the top of the leaf: for each row
+    of the band, it takes the leftmost and rightmost pixels of the leaf
+    (the two sides of the contour near the apex), fits a line on each
+    side and returns the angle between the two lines.
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - thImg: the mask (bitmap) of the leaf
+    - density: the pixel density of the mask, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The angle of the top tip, expressed in degrees
+    """
+
+    leafRows = np.flatnonzero(thImg.any(axis=1))
+    if len(leafRows) == 0:
+        raise ValueError("The mask does not contain any leaf. Please check the imput")
+
+    top = leafRows[0]
+    bandHeight = max(
+        kernel_size(TIP_BAND_MIN_MM, density),
+        int(TIP_BAND_FRACTION * (leafRows[-1] - top)),
+    )
+    band = thImg[top : top + bandHeight]
+
+    # keep only the part of the band connected to the apex, to ignore
+    # other leaf parts or noise that reach the band
+    _, labels = cv2.connectedComponents(band)
+    apex = labels[0, np.flatnonzero(band[0])[0]]
+    tip = labels == apex
+
+    # leftmost and rightmost tip pixel of each row
+    rows = np.flatnonzero(tip.any(axis=1))
+    rows = rows[int(TIP_SKIP_FRACTION * len(rows)) :]
+    left = np.argmax(tip[rows], axis=1)
+    right = tip.shape[1] - 1 - np.argmax(tip[rows, ::-1], axis=1)
+
+    if len(rows) < 2:
+        raise ValueError("Couldn't detect the tip of the leaf")
+
+    # fit x = m*y + q on each side: the angle of each side from the
+    # vertical is atan(m)
+    leftSlope = np.polyfit(rows, left, 1)[0]
+    rightSlope = np.polyfit(rows, right, 1)[0]
+
+    tipAngle = math.atan(rightSlope) - math.atan(leftSlope)
+
+    # conversion to degrees
+    return float(tipAngle / math.pi * 180)
+
+
+# The available tip angle estimators, by name
+TIP_ANGLE_ESTIMATORS = {
+    "hough": get_top_tip_angle,
+    "contour": get_top_tip_angle_from_contour,
+}
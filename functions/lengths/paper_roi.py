@@ -5,6 +5,7 @@ import math
 from typing import Tuple
 
 from functions.utils.rectangle import Rectangle
+from functions.utils.leaf import MASK_STRIP_ROWS
 
 WHITE_THRESHOLD = 80 
 NUM_OF_SAMPLES = 30
@@ -32,20 +33,24 @@ def __detect_lines(img: MatLike) -> Tuple[MatLike, MatLike]:
     """
 
 
-    imgHLS = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
-
-    thImg = cv2.inRange(imgHLS, np.array([0,125,0]), np.array([255,255,255]))
+    # the image is converted to HLS and thresholded MASK_STRIP_ROWS rows at a
+    # time, so that its HLS version is never stored in full
+    thImg = np.empty(img.shape[:2], np.uint8)
+    for row in range(0, img.shape[0], MASK_STRIP_ROWS):
+        imgHLS = cv2.cvtColor(img[row : row + MASK_STRIP_ROWS], cv2.COLOR_BGR2HLS)
+        cv2.inRange(imgHLS, np.array([0,125,0]), np.array([255,255,255]), dst=thImg[row : row + MASK_STRIP_ROWS])
 
 
+    # in place, to avoid allocating a new image for each step
     ker1 = np.ones((26, 26), np.uint8)
-    thImg = cv2.erode(thImg, ker1)
-    thImg = cv2.dilate(thImg, ker1)
+    cv2.erode(thImg, ker1, dst=thImg)
+    cv2.dilate(thImg, ker1, dst=thImg)
 
     ker = np.ones((3, 3), np.uint8)
 
     contour = cv2.morphologyEx(thImg, cv2.MORPH_GRADIENT, ker)
 
-    contour = cv2.dilate(contour, ker)
+    cv2.dilate(contour, ker, dst=contour)
 
     # lines is a list of each line found expressed like [x1 y1 x2 y1] (!)
 
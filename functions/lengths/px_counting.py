@@ -39,17 +39,19 @@ def count_paper_pixels(
     """
 
 	# Consider only saturations < max_paper_sat, with an opening on that to remove noise
+    # (in place, to avoid allocating a new image for each step)
     saturation = img[:, :, 1]
     saturation = cv2.threshold(saturation, max_paper_sat, 255, cv2.THRESH_BINARY_INV)[1]
-    saturation = cv2.morphologyEx(saturation, cv2.MORPH_OPEN, np.ones((51, 51)))
+    cv2.morphologyEx(saturation, cv2.MORPH_OPEN, np.ones((51, 51)), dst=saturation)
 
 	# Consider only values > min_paper_val, with an opening on that to remove noise
     value = img[:, :, 2]
     value = cv2.threshold(value, min_paper_val, 255, cv2.THRESH_BINARY)[1]
-    value = cv2.morphologyEx(value, cv2.MORPH_OPEN, np.ones((51, 51)))
+    cv2.morphologyEx(value, cv2.MORPH_OPEN, np.ones((51, 51)), dst=value)
 
 	# AND the two, to have a mask of where the paper is
-    img = cv2.bitwise_and(saturation, value)
+    img = cv2.bitwise_and(saturation, value, dst=saturation)
+    del value
 
 	# If the request is to compute the vertical paper size, rotate the image
     # to compute the horizontal paper size and obtain the same value
@@ -38,18 +38,19 @@ def __max_sat_min_val(img: MatLike, paper_roi: Rectangle) -> tuple[int, int]:
     leaf = get_leaf_mask(img)
     paper = cv2.bitwise_not(leaf)
 
-    # Remove the lighter area around the leaf
+    # Remove the lighter area around the leaf (in place, as the next steps,
+    # to avoid allocating a new mask for each step)
     erosion_size = paper_roi.horiz.length // 10
-    paper = cv2.erode(paper, np.ones((erosion_size, erosion_size)))
-    leaf = cv2.dilate(leaf, np.ones((erosion_size, erosion_size)))
+    cv2.erode(paper, np.ones((erosion_size, erosion_size)), dst=paper)
+    cv2.dilate(leaf, np.ones((erosion_size, erosion_size)), dst=leaf)
 
     # Remove the leaf from the saturation channel
     sat = img[:, :, 1]
-    masked_sat = cv2.bitwise_and(sat, paper)
+    masked_sat = cv2.bitwise_and(sat, paper, dst=paper)
 
     # Remove the leaf from the value channel
     val = img[:, :, 2]
-    masked_val = cv2.bitwise_or(val, leaf)
+    masked_val = cv2.bitwise_or(val, leaf, dst=leaf)
     # cv2.imwrite("./test/valmask.jpg", masked_val)
 
     # Return the max saturation
@@ -0,0 +1,752 @@
+from __future__ import annotations
+
+from cv2.typing import MatLike
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from custom_types.tuple_of_11 import tuple_of_11, to_tuple_of_11
+
+from functions.utils.rectangle import Rectangle
+from functions.utils.segment import Segment
+
+# Frozen copies of the measures of the baseline extractor (EXTRACTOR_VERSION
+# 1), that the model was trained with, together with the steps that compute
+# their inputs: the leaf pixels are tested one at a time with is_px_leaf on
+# the HSV image, and the paper ROI comes from the original line detection.
+# Faster implementations of the same measures must give the same results,
+# and are checked against these with benchmarks/equivalence.py: do not
+# optimize or otherwise modify them (they were only formatted with black).
+#
+# - MIN_LEAF_HUE ... MAX_LEAF_VAL, is_px_leaf, get_leaf_mask: from
+#     functions/utils/leaf.py
+# - crop_image: from functions/utils/image.py
+# - WHITE_THRESHOLD, NUM_OF_SAMPLES, find_roi_boundaries,
+#     roi_boundaries_as_rect: from functions/lengths/paper_roi.py, with
+#     detect_lines and find_paper_margin (__detect_lines and
+#     __find_paper_margin there)
+# - count_paper_pixels: from functions/lengths/px_counting.py
+# - max_sat_min_val: __max_sat_min_val of functions/lengths/px_size.py
+# - find_leaf_height: from functions/lengths/leaf_height.py
+# - get_leaf_widths, get_leaf_roi: from functions/lengths/leaf_width.py
+
+MIN_LEAF_HUE = 0
+MAX_LEAF_HUE = 80
+MIN_LEAF_SAT = 100
+MAX_LEAF_VAL = 150
+
+WHITE_THRESHOLD = 80
+NUM_OF_SAMPLES = 30
+
+
+def is_px_leaf(px: tuple[int, int, int]) -> bool:
+    """
+    Looking at the colors, tells if a pixel can be part of a leaf or not
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - px: the pixel to analyse, described as HSV tuple
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Whether the pixel can belong to a leaf or not
+    """
+
+    hue, sat, val = px
+
+    if (
+        hue >= MIN_LEAF_HUE
+        and hue <= MAX_LEAF_HUE
+        and sat >= MIN_LEAF_SAT
+        and val <= MAX_LEAF_VAL
+    ):
+        return True
+
+    return False
+
+
+def get_leaf_mask(img: MatLike) -> MatLike:
+    """
+    Returns a mask to identify the exact region where the leaf is.
+    It is done by first applying thresholds on the 3 channels, then the
+    masks are and-ed, and finally a closing operation is executed to
+    remove some noise inside the leaf
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in HSV
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The mask that represents the leaf
+    """
+
+    min_hue_mask = cv2.threshold(img[:, :, 0], MIN_LEAF_HUE, 255, cv2.THRESH_BINARY)[1]
+    res = min_hue_mask
+
+    max_hue_mask = cv2.threshold(
+        img[:, :, 0], MAX_LEAF_HUE, 255, cv2.THRESH_BINARY_INV
+    )[1]
+    res = cv2.bitwise_and(res, max_hue_mask)
+
+    min_sat_mask = cv2.threshold(img[:, :, 1], MIN_LEAF_SAT, 255, cv2.THRESH_BINARY)[1]
+    res = cv2.bitwise_and(res, min_sat_mask)
+
+    max_val_mask = cv2.threshold(
+        img[:, :, 2], MAX_LEAF_VAL, 255, cv2.THRESH_BINARY_INV
+    )[1]
+    res = cv2.bitwise_and(res, max_val_mask)
+
+    return cv2.morphologyEx(res, cv2.MORPH_CLOSE, np.ones((21, 21)))
+
+
+def crop_image(img: MatLike, roi: Rectangle) -> MatLike:
+    """
+    Crops an image to a specific rectangular region
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image to be cropped
+    - roi: the rectangle of image to be kept
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The image, cropped to the specified region
+    """
+    return img[
+        roi.get_vert().corner : roi.get_vert().other_corner(),
+        roi.get_horiz().corner : roi.get_horiz().other_corner(),
+        :,
+    ]
+
+
+def detect_lines(img: MatLike) -> Tuple[MatLike, MatLike]:
+    """
+    The function uses the Hough transform to detect the border of the
+    paper sheet
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+
+    - img: the image, in BGR
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A tuple, composed of:
+    - the list of segments, expressed like [x1 y1 x2 y1] (!)
+        note that each element is still a list, of only one element(?),
+        to access the points you must acces line[0] = [x1 y1 x2 y2]
+    - the image thresholded with the WHITE_THRESHOLD value
+    """
+
+    imgHLS = cv2.cvtColor(img, cv2.COLOR_BGR2HLS)
+
+    thImg = cv2.inRange(imgHLS, np.array([0, 125, 0]), np.array([255, 255, 255]))
+
+    ker1 = np.ones((26, 26), np.uint8)
+    thImg = cv2.erode(thImg, ker1)
+    thImg = cv2.dilate(thImg, ker1)
+
+    ker = np.ones((3, 3), np.uint8)
+
+    contour = cv2.morphologyEx(thImg, cv2.MORPH_GRADIENT, ker)
+
+    contour = cv2.dilate(contour, ker)
+
+    # lines is a list of each line found expressed like [x1 y1 x2 y1] (!)
+
+    lines = cv2.HoughLinesP(contour, 1, np.pi / 2, 50, minLineLength=150, maxLineGap=80)
+    # ! note that line is still a list, of only one element, to access
+    #   the points you must acces line[0] = [x1 y1 x2 y2]
+
+    return lines, thImg
+
+
+def find_paper_margin(thImg: MatLike) -> Tuple[int, int, int, int]:
+    """
+    The function finds the 4 margins of the paper sheet, using a median
+    value.
+    From each side it checks NUM_OF_SAMPLES times the distance of the
+    paper's white, then it returns the median value
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - thImg: the image thresholded with the WHITE_THRESHOLD value
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - marginL, marginR, marginT, marginB are the pixel positions of the
+      left, right, top and bottom margin of the paper sheet
+    """
+
+    imgH, imgW = thImg.shape[:2]
+    marginL = 0
+    marginR = imgW
+    marginT = 0
+    marginB = imgH
+
+    # trovo il margine sinistro: partendo dal bordo immagine avanzo fino al foglio per più (NUM_OF_SAMPLES) volte
+    # la coordinata x del margine sarà la mediana dei valori deltaX , cioè la mediana delle coordinate dei punti del bordo
+
+    # left border
+    samples = []
+    deltaY = 0
+    for i in range(NUM_OF_SAMPLES):
+
+        deltaX = 0
+        while (thImg[imgH // 5 + deltaY, 0 + deltaX] == 0) and (
+            deltaX < imgW // 2
+        ):  # N.B. !!! img(y, x)
+            deltaX += 1
+
+        samples.append(deltaX)
+
+        deltaY += int((3 / 5 * imgH) / NUM_OF_SAMPLES)
+
+    samples.sort()
+    marginL = samples[len(samples) // 2]
+    samples.clear()
+
+    # right border
+    samples = []
+    deltaY = 0
+    for i in range(NUM_OF_SAMPLES):
+
+        deltaX = imgW - 1
+        while (thImg[imgH // 5 + deltaY, 0 + deltaX] == 0) and (
+            deltaX > imgW // 2
+        ):  # N.B. !!! img(y, x)
+            deltaX -= 1
+
+        samples.append(deltaX)
+
+        deltaY += int((3 / 5 * imgH) / NUM_OF_SAMPLES)
+
+    samples.sort()
+    marginR = samples[len(samples) // 2]
+    samples.clear()
+
+    # top border
+    samples = []
+    deltaX = 0
+    for i in range(NUM_OF_SAMPLES):
+
+        deltaY = 0
+        while (thImg[0 + deltaY, imgW // 6 + deltaX] == 0) and (
+            deltaY < 2 * imgH // 3
+        ):  # N.B. !!! img(y, x)
+            deltaY += 1
+
+        samples.append(deltaY)
+
+        deltaX += int((4 / 6 * imgW) / NUM_OF_SAMPLES)
+
+    samples.sort()
+    marginT = samples[len(samples) // 2]
+    samples.clear()
+
+    # bottom border
+    samples = []
+    deltaX = 0
+    for i in range(NUM_OF_SAMPLES):
+
+        deltaY = imgH - 1
+        while (thImg[0 + deltaY, imgW // 6 + deltaX] == 0) and (
+            deltaY > 2 * imgH // 3
+        ):  # N.B. !!! img(y, x)
+            deltaY -= 1
+
+        samples.append(deltaY)
+
+        deltaX += int((4 / 6 * imgW) / NUM_OF_SAMPLES)
+
+    samples.sort()
+    marginB = samples[len(samples) // 2]
+    samples.clear()
+
+    return marginL, marginR, marginT, marginB
+
+
+def find_roi_boundaries(img: MatLike) -> Tuple[int, int, int, int]:
+    """
+    The function finds the 4 pixel values of the paper sheet side,
+    in such a way to extract a rectangular region of interest which
+    inlcludes only white paper and the leaf.
+    It iterates on the segments found by the function detect_lines
+    and it assign them to the relative paper margin. Then the most
+    conservative value is chosen, so there will be no backruond
+    in the extracted roi. The roi will be img[roiT:roiB , roiL:roiR]
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+
+    - img: the image, in BGR
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - roiL, roiR, roiT, roiB: pixel values of the 4 sides of the roi,
+        the left, right, top and bottom one. A slice can be calculated
+        like img[ roiT:roiB , roiL:roiR ]
+    """
+
+    # % of the min between height and width of the image that i want my roi to be reduced by
+    PADDING = 2
+
+    # constant percentual value, relative to the min beween the image width and height
+    # it dictates if a segment belongs or not to a border, based on the distance
+    DIST_PERC = 1.8
+
+    imgH, imgW = img.shape[:2]
+    roiL = 0
+    roiR = imgW
+    roiT = 0
+    roiB = imgH
+
+    lines, thImg = detect_lines(img)
+
+    marginL, marginR, marginT, marginB = find_paper_margin(thImg)
+
+    def isVertical(points: list[int]) -> int:
+        if abs(points[2] - points[0]) < 40:
+            return 1
+        return 0
+
+    def isHorizontal(points: list[int]) -> int:
+        if abs(points[3] - points[1]) < 40:
+            return 1
+        return 0
+
+    def belongsToSide(point: int, side: int) -> int:
+        if (point < side + int(((DIST_PERC / 100) * min(imgW, imgH)))) and (
+            point > side - int(((DIST_PERC / 100) * min(imgW, imgH)))
+        ):
+            return 1
+        return 0
+
+    for line in lines:
+        line = line[0]
+        if isVertical(line):
+
+            # check if the segmemt belongs to the left border
+            if belongsToSide(line[0], marginL) or belongsToSide(line[2], marginL):
+                # if true I eventually update roiL with a more conservative value
+                if max(line[0], line[2]) > roiL:
+                    roiL = max(line[0], line[2])
+
+            elif belongsToSide(line[0], marginR) or belongsToSide(line[2], marginR):
+                if min(line[0], line[2]) < roiR:
+                    roiR = min(line[0], line[2])
+
+        elif isHorizontal(line):
+
+            # check if the segment belongs to the top border
+            if belongsToSide(line[1], marginT) or belongsToSide(line[3], marginT):
+                # if it does i eventually update it with a more conservative value
+                if max(line[1], line[3]) > roiT:
+                    roiT = max(line[1], line[3])
+
+            elif belongsToSide(line[1], marginB) or belongsToSide(line[3], marginB):
+                if min(line[1], line[3]) < roiB:
+                    roiB = min(line[1], line[3])
+
+    # restirct the roi area with the specified padding
+    padd = int(PADDING / 100 * min(imgH, imgW))
+    roiL += padd
+    roiR -= padd
+    roiT += padd
+    roiB -= padd
+
+    return roiL, roiR, roiT, roiB
+
+
+def roi_boundaries_as_rect(roi: tuple[int, int, int, int]) -> Rectangle:
+    """
+    Given the paper ROI as a tuple, returns it as a Rectangle
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - roi: the result of the function find_roi_boundaries
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The ROI as a Rectangle
+    """
+
+    return Rectangle.from_values(roi[2], roi[0], roi[1] - roi[0], roi[3] - roi[2])
+
+
+def count_paper_pixels(
+    img: MatLike,
+    level: int,
+    vert: bool,
+    max_paper_sat: int,
+    min_paper_val: int,
+) -> Segment:
+    """
+    Checks which pixels of a row/col of an image are part of a white
+    paper sheet.
+
+    This is performed by counting what is not white at the left/right or
+    at the top/bottom of the selected row/col of the image.
+
+    ---------------------------------------------------------------------
+    Parameters
+    ----------
+    - img: the row of the image to be considered, in HSV
+    - level: the row/column to be evaluated
+    - vert: if the function should count the paper pixels in a column
+        (vert=True, level=col) or in a row (vert=False, level=row)
+    - max_paper_sat: an approximate value of the maximum saturation of
+        the paper pixels
+    - min_paper_val: an approximate value of the maximum value of the
+        paper pixels
+
+    ---------------------------------------------------------------------
+    Returns
+    The segment that describes the paper sheet in the middle of the image
+    """
+
+    # Consider only saturations < max_paper_sat, with an opening on that to remove noise
+    saturation = img[:, :, 1]
+    saturation = cv2.threshold(saturation, max_paper_sat, 255, cv2.THRESH_BINARY_INV)[1]
+    saturation = cv2.morphologyEx(saturation, cv2.MORPH_OPEN, np.ones((51, 51)))
+
+    # Consider only values > min_paper_val, with an opening on that to remove noise
+    value = img[:, :, 2]
+    value = cv2.threshold(value, min_paper_val, 255, cv2.THRESH_BINARY)[1]
+    value = cv2.morphologyEx(value, cv2.MORPH_OPEN, np.ones((51, 51)))
+
+    # AND the two, to have a mask of where the paper is
+    img = cv2.bitwise_and(saturation, value)
+
+    # If the request is to compute the vertical paper size, rotate the image
+    # to compute the horizontal paper size and obtain the same value
+    if vert:
+        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+    w = img.shape[1]
+
+    margin_left: int = 0
+    margin_right: int = 0
+
+    # Measure margin from the left
+    for delta in range(w):
+        if img[level, 0 + delta]:
+            margin_left = delta
+            break
+
+    # Measure margin from the right
+    for delta in range(w):
+        if img[level, w - delta - 1]:
+            margin_right = delta
+            break
+
+    return Segment(margin_left, w - margin_left - margin_right)
+
+
+def max_sat_min_val(img: MatLike, paper_roi: Rectangle) -> tuple[int, int]:
+    """
+    Computes approximately the maximum saturation and minimum value of
+    pixels of paper
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the full image, in HSV
+    - paper_roi: a region where only paper and leaf exist
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A tuple of (max saturation, min value)
+    """
+
+    # Crop image to a region with only paper and leaf
+    img = crop_image(img, paper_roi)
+
+    # Compute the leaf and inverse (=paper) mask
+    leaf = get_leaf_mask(img)
+    paper = cv2.bitwise_not(leaf)
+
+    # Remove the lighter area around the leaf
+    erosion_size = paper_roi.horiz.length // 10
+    paper = cv2.erode(paper, np.ones((erosion_size, erosion_size)))
+    leaf = cv2.dilate(leaf, np.ones((erosion_size, erosion_size)))
+
+    # Remove the leaf from the saturation channel
+    sat = img[:, :, 1]
+    masked_sat = cv2.bitwise_and(sat, paper)
+
+    # Remove the leaf from the value channel
+    val = img[:, :, 2]
+    masked_val = cv2.bitwise_or(val, leaf)
+    # cv2.imwrite("./test/valmask.jpg", masked_val)
+
+    # Return the max saturation
+    return (int(masked_sat.max()), int(masked_val.min()))
+
+
+def __is_leaf_in_line(img: MatLike, horiz_segment: Segment, y_coord: int) -> bool:
+    """
+    Checks if a line of pixels contains the leaf
+    ---------------------------------------------------------------------
+
+    Parameters
+    ----------
+    - img: the image to consider, in HSV
+    - horiz_segment: the horizontal ROI where to look for
+    - y_coord: the line of pixels to be analyzed
+
+    ---------------------------------------------------------------------
+    Returns
+    -------
+    Whether the chosen line includes parts of the leaf or not
+    """
+
+    for x in range(horiz_segment.corner, horiz_segment.other_corner()):
+        if is_px_leaf(img[y_coord, x]):
+            return True
+
+    return False
+
+
+def __find_leaf_extreme_recurs(
+    img: MatLike, region: Rectangle, top_border: bool
+) -> int:
+    """
+    Recursively finds the highest or lowest y level where there is the
+    leaf, in a binary way
+    ---------------------------------------------------------------------
+
+    Parameters
+    ----------
+    - img: the image to consider, in HSV
+    - region: the paper region, where to search
+    - top_border: whether to look for the topmost (True) or bottommost
+        (False) point of the leaf
+
+    ---------------------------------------------------------------------
+    Returns
+    -------
+    The y coordinate of the requested point
+    """
+
+    middle = region.vert.middle()
+    leaf_present_in_middle = __is_leaf_in_line(img, region.get_horiz(), middle)
+
+    # If the region to search is 1-tall, it's the end of the search
+    if region.vert.length == 1:
+        offset = 1 if top_border else -1
+        return middle if leaf_present_in_middle else middle + offset
+
+    if (leaf_present_in_middle and top_border) or (
+        not leaf_present_in_middle and not top_border
+    ):
+        vert = region.vert.first_half()
+    else:
+        vert = region.vert.second_half()
+
+    res = __find_leaf_extreme_recurs(
+        img, Rectangle(region.get_horiz(), vert), top_border
+    )
+
+    if (region.get_vert().length < 0.05 * img.shape[0]) or __is_leaf_in_line(
+        img, region.get_horiz(), res
+    ):
+        return res
+
+    vert = region.get_vert().other_half(vert)
+
+    return __find_leaf_extreme_recurs(
+        img, Rectangle(region.get_horiz(), vert), top_border
+    )
+
+
+def find_leaf_height(img: MatLike, region: Rectangle) -> Segment:
+    """
+    Performs a binary search along the height of the image to find the y
+    coordinates of the first and last px that includes the leaf.
+
+    ---------------------------------------------------------------------
+    Parameters
+    ----------
+    - img: the image to consider, in BGR
+    - region: the paper region, where to search
+
+    ---------------------------------------------------------------------
+    Returns
+    -------
+    The vertical segment where the leaf is present (with coordinates
+    relative to the full image)
+    """
+
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    top = __find_leaf_extreme_recurs(img, region, True)
+    bottom = __find_leaf_extreme_recurs(img, region, False)
+
+    return Segment(top, bottom - top)
+
+
+def __get_leaf_at_px(img: MatLike, paper_roi: Rectangle, row: int) -> Segment:
+    """
+    Returns the segment that contains the leaf at a given px height of
+    the image
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image to be analyzed, in HSV
+    - paper_roi: the region where there are only paper and leaf
+    - row: the image row that should be considered
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The segment that includes the leaf
+    """
+
+    mincol = paper_roi.get_horiz().corner
+    maxcol = paper_roi.get_horiz().other_corner()
+
+    for col in range(mincol, maxcol):
+        if is_px_leaf(img[row, col]):
+            corner = col
+            break
+
+    for col in range(maxcol - 1, mincol, -1):
+        if is_px_leaf(img[row, col]):
+            other_corner = col
+            break
+
+    return Segment(corner, other_corner - corner)
+
+
+def get_leaf_widths(
+    img: MatLike, paper_roi: Rectangle, leaf_height: Segment | None = None
+) -> tuple_of_11[Segment]:
+    """
+    Measures the width of the leaf every 10% of height (including 0% and
+    100%)
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image to be analyzed, in BGR
+    - paper_roi: the region where there are only paper and leaf
+    - leaf_height: if available, the segment that describes the leaf
+        height. If it is not given, it is computed from scratch (a waste,
+        if it was already available)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A tuple of 11 segments, where the i-th element is the segment that
+    represents the width and position of the leaf at 10*i% the height
+    """
+
+    segments = []
+
+    leaf_height_certain = (
+        find_leaf_height(img, paper_roi) if leaf_height is None else leaf_height
+    )
+
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    # for index in range(0, 1):
+    for index in range(0, 11):
+        fraction = index * 1.0 / 10
+        row = int(leaf_height_certain.corner + fraction * leaf_height_certain.length)
+        segments.append(__get_leaf_at_px(img, paper_roi, row))
+
+    return to_tuple_of_11(segments)
+
+
+def get_leaf_roi(
+    img: MatLike,
+    paper_roi: Rectangle,
+    widths: tuple_of_11[Segment],
+    leaf_height: Segment,
+) -> Rectangle:
+    """
+    Returns the smallest rectangular region that includes the whole leaf
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - paper_roi: a region where there are only paper and leaf
+    - widths: the width measurements of every 10% of leaf height
+    - leaf_height: the segment that identifies the vetical region where
+        the leaf is
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The smallest rectangle that fully includes the leaf
+    """
+
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    # Find the leftmost point of the leaf
+
+    # First, find the leftmost point within the already measured rows
+    corner = widths[0].corner
+
+    for w in widths:
+        if w.corner < corner:
+            corner = w.corner
+
+    # Then, linearly check if there are some more to the left
+    row = leaf_height.corner
+    while (row < leaf_height.other_corner()) and (
+        corner != paper_roi.get_horiz().corner
+    ):
+        while is_px_leaf(img[row, corner - 1]):
+            corner -= 1
+            if corner == paper_roi.get_horiz().corner:
+                # Whenever you reach the ROI border, there's nothing more to search
+                break
+
+            while is_px_leaf(img[row - 1, corner]):
+                row -= 1
+
+        row += 1
+
+    # Same algorithm, but for the right
+    other_corner = widths[0].other_corner()
+
+    for w in widths:
+        if w.other_corner() > other_corner:
+            other_corner = w.other_corner()
+
+    row = leaf_height.corner
+    while (row < leaf_height.other_corner()) and (
+        other_corner != paper_roi.get_horiz().other_corner()
+    ):
+        while is_px_leaf(img[row, other_corner + 1]):
+            other_corner += 1
+            if other_corner == paper_roi.get_horiz().other_corner():
+                break
+
+            while is_px_leaf(img[row - 1, other_corner]):
+                row -= 1
+
+        row += 1
+
+    return Rectangle(Segment(corner, other_corner - corner), leaf_height)
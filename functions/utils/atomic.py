@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from typing import IO, Any, Iterator, Optional
+
+from contextlib import contextmanager
+
+import os
+import tempfile
+
+
+@contextmanager
+def atomic_write(
+    path: str, mode: str = "w", permissions: Optional[int] = None
+) -> Iterator[IO[Any]]:
+    """
+    Opens a file to be written atomically: the content is written to a
+    temporary file in the same folder, which replaces the destination only
+    when the block ends without errors, so that a reader (or a process
+    killed while writing) never sees it half-written. If the block raises,
+    the temporary file is removed and the destination is left untouched
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the file
+    - mode: the mode the file is opened with ("w" or "wb")
+    - permissions: if given, the permissions of the file, such as 0o644
+        (otherwise it is readable only by its owner, as created by mkstemp)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The temporary file, open for writing
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        if permissions is not None:
+            os.chmod(tmp_path, permissions)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import json
+import os
+import threading
+
+from functions.utils.atomic import atomic_write
+
+# Journal of the update in progress, removed when the update completes
+CHECKPOINT_PATH = "./dataset/update_checkpoint.jsonl"
+
+# Images that failed, which are not analysed again until they change
+QUARANTINE_PATH = "./dataset/quarantine.json"
+
+# Number of times the update can stop while an image is being analysed
+# (for example, killed because it ran out of memory) before that image is
+# quarantined
+MAX_UNFINISHED_ATTEMPTS = 2
+
+
+class UpdateCheckpoint:
+    """
+    The journal of a dataset update: which images were started, completed
+    or failed, and which plants were completed, so that an update that
+    stopped can be resumed where it was.
+
+    The journal is a file with one json object per line, appended (and
+    flushed to disk) as soon as each event happens: if the process is
+    killed, at most the last line is lost or truncated, and it is ignored.
+    The first line records the options of the update, which must be the
+    same when it is resumed.
+
+    Images that raise an error are put in quarantine (a json file that
+    survives the update), together with the error, the modification time
+    of the image and the options of the update: they are skipped by the
+    next updates with the same options, until the image is modified or
+    removed from the quarantine file.
+    The methods can be called by many threads at once.
+    """
+
+    def __init__(
+        self,
+        options: dict[str, Any],
+        path: Optional[str] = None,
+        quarantine_path: Optional[str] = None,
+    ) -> None:
+        """
+        Creates a new, empty journal. Use start or resume to open the file
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - options: the options of the update that affect the features
+        - path: the path of the journal (None for CHECKPOINT_PATH)
+        - quarantine_path: the path of the quarantine file (None for
+            QUARANTINE_PATH)
+        """
+
+        # As read back from the journal (tuples become lists)
+        self.options = json.loads(json.dumps(options))
+        self.path = CHECKPOINT_PATH if path is None else path
+        self.quarantine_path = (
+            QUARANTINE_PATH if quarantine_path is None else quarantine_path
+        )
+
+        self.done_images: set[str] = set()
+        self.done_plants: set[str] = set()
+        self.attempts: dict[str, int] = {}
+        self.quarantine: dict[str, dict[str, Any]] = {}
+
+        self.__lock = threading.Lock()
+
+        try:
+            with open(self.quarantine_path, "r") as f:
+                self.quarantine = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def start(
+        cls,
+        options: dict[str, Any],
+        path: Optional[str] = None,
+        quarantine_path: Optional[str] = None,
+    ) -> UpdateCheckpoint:
+        """
+        Starts the journal of a new update, discarding the previous one
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - options: the options of the update that affect the features
+        - path: the path of the journal (None for CHECKPOINT_PATH)
+        - quarantine_path: the path of the quarantine file (None for
+            QUARANTINE_PATH)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The journal
+        """
+
+        res = cls(options, path, quarantine_path)
+        with open(res.path, "w") as f:
+            f.write(json.dumps({"options": res.options}) + "\n")
+        return res
+
+    @classmethod
+    def resume(
+        cls,
+        options: dict[str, Any],
+        path: Optional[str] = None,
+        quarantine_path: Optional[str] = None,
+    ) -> UpdateCheckpoint:
+        """
+        Reopens the journal of an update that stopped, to continue it.
+        The images whose analysis was interrupted MAX_UNFINISHED_ATTEMPTS
+        times are put in quarantine.
+        If there is no journal, a new update is started
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - options: the options of the update that affect the features,
+            that must be the same of the update that stopped
+        - path: the path of the journal (None for CHECKPOINT_PATH)
+        - quarantine_path: the path of the quarantine file (None for
+            QUARANTINE_PATH)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The journal
+        """
+
+        res = cls(options, path, quarantine_path)
+
+        try:
+            with open(res.path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            print("No update to resume: starting a new one")
+            return cls.start(options, path, quarantine_path)
+
+        events: list[dict[str, Any]] = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # Truncated by a crash
+                continue
+
+        if len(events) == 0 or events[0].get("options", None) != res.options:
+            raise Exception(
+                "The update to resume used other options: run it again with "
+                "the same options, or start a new update without --resume"
+            )
+
+        # The journal is written again without the truncated line, so that
+        # the next events do not end up on the same line
+        with atomic_write(res.path) as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+
+        failed: set[str] = set()
+        for event in events[1:]:
+            if "started" in event:
+                res.attempts[event["started"]] = (
+                    res.attempts.get(event["started"], 0) + 1
+                )
+            elif "done" in event:
+                res.done_images.add(event["done"])
+            elif "failed" in event:
+                failed.add(event["failed"])
+            elif "plant_done" in event:
+                res.done_plants.add(event["plant_done"])
+
+        # The images being analysed when the update stopped (too many times)
+        # are probably what made it stop
+        for image, attempts in res.attempts.items():
+            if (
+                image not in res.done_images
+                and image not in failed
+                and attempts >= MAX_UNFINISHED_ATTEMPTS
+            ):
+                res.failed(
+                    image,
+                    f"./dataset/images/{image}",
+                    f"The update stopped {attempts} times while analysing it",
+                )
+
+        return res
+
+    def is_quarantined(self, image: str, img_path: str) -> bool:
+        """
+        Tells if an image is in quarantine, for the options of this update,
+        and was not modified since it was put there
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - image: the name of the image, as "plant/file name"
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the image must be skipped
+        """
+
+        with self.__lock:
+            entry = self.quarantine.get(image, None)
+        if entry is None or entry.get("options", None) != self.options:
+            # An image that failed with other options (for example, another
+            # density) may work with these ones
+            return False
+
+        try:
+            return os.stat(img_path).st_mtime_ns == entry["mtime_ns"]
+        except FileNotFoundError:
+            return True
+
+    def started(self, image: str) -> None:
+        """
+        Records that the analysis of an image started
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - image: the name of the image, as "plant/file name"
+        """
+        self.__append({"started": image})
+
+    def done(self, image: str) -> None:
+        """
+        Records that an image was analysed, and its description stored.
+        If the image was in quarantine, it is removed from there
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - image: the name of the image, as "plant/file name"
+        """
+
+        self.__append({"done": image})
+        with self.__lock:
+            self.done_images.add(image)
+            if self.quarantine.pop(image, None) is not None:
+                self.__store_quarantine()
+
+    def failed(self, image: str, img_path: str, error: str) -> None:
+        """
+        Records that the analysis of an image failed, and puts it in
+        quarantine
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - image: the name of the image, as "plant/file name"
+        - img_path: the path of the image
+        - error: the description of the error
+        """
+
+        self.__append({"failed": image, "error": error})
+
+        try:
+            mtime_ns = os.stat(img_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        with self.__lock:
+            self.quarantine[image] = {
+                "error": error,
+                "mtime_ns": mtime_ns,
+                "options": self.options,
+            }
+            self.__store_quarantine()
+
+    def quarantined_images(self, plant: str) -> list[str]:
+        """
+        Returns the images of a plant that are skipped because they are in
+        quarantine
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plant: the name of the plant
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The names of the images, as "plant/file name"
+        """
+
+        with self.__lock:
+            images = [
+                image for image in self.quarantine if image.startswith(f"{plant}/")
+            ]
+        return sorted(
+            image
+            for image in images
+            if self.is_quarantined(image, f"./dataset/images/{image}")
+        )
+
+    def plant_done(self, plant: str) -> None:
+        """
+        Records that all the images of a plant were analysed, and its recap
+        stored
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - plant: the name of the plant
+        """
+
+        self.__append({"plant_done": plant})
+        with self.__lock:
+            self.done_plants.add(plant)
+
+    def complete(self) -> None:
+        """
+        Removes the journal, once the update is complete
+        """
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __append(self, event: dict[str, Any]) -> None:
+        """
+        Appends an event to the journal, and waits for it to be on disk
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - event: the event, as a JSON object
+        """
+
+        with self.__lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __store_quarantine(self) -> None:
+        """
+        Writes the quarantine file atomically. It must be called holding
+        the lock
+        """
+
+        with atomic_write(self.quarantine_path) as f:
+            json.dump(self.quarantine, f, indent=4)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from functions.utils.atomic import atomic_write
+from functions.utils.lru_folder import LRUFolder
+
+DECODED_CACHE_PATH = "./decoded_cache"
+DEFAULT_DECODED_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class DecodedImageCache:
+    """
+    An on-disk cache of decoded images, stored as .npy files, so that the
+    features of the same images can be extracted again (for example while
+    tuning the thresholds of the algorithms) without decoding them every
+    time: the cached images are memory-mapped, and their pixels are read
+    from disk only when used.
+
+    The entries are keyed by the content of the image file (and by the
+    size they were reduced to), so a modified image is never confused
+    with its old version. As in ClassificationCache, the files are written
+    atomically, the last access time of an entry is its modification
+    time, and the least recently used entries are removed when the folder
+    grows over max_size bytes (see LRUFolder: the folder is not scanned
+    at every store).
+    """
+
+    def __init__(
+        self,
+        folder: str = DECODED_CACHE_PATH,
+        max_size: int = DEFAULT_DECODED_CACHE_SIZE,
+        max_side: Optional[int] = None,
+    ) -> None:
+        """
+        Opens (creating it if needed) a cache of decoded images
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - folder: the folder where the cache is stored
+        - max_size: the maximum size of the cache, in bytes
+        - max_side: if given, the images are reduced so that their longest
+            side is at most max_side pixels before being stored. The
+            features of a reduced image are not the same as those of the
+            original, so the model must not be trained with them: their
+            descriptions record max_side (see ImageFeatures), and
+            update_dataset does not retrain the model
+        """
+
+        self.__folder = folder
+        self.max_side = max_side
+
+        os.makedirs(folder, exist_ok=True)
+        self.__lru = LRUFolder([folder], max_size, ".npy")
+
+    def load(self, img_path: str) -> Optional[np.ndarray]:
+        """
+        Returns a decoded image, from the cache if present, otherwise
+        decoding it and storing it in the cache
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The image, in BGR (read-only, if it comes from the cache), or None
+        if the file cannot be decoded
+        """
+
+        with open(img_path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        size = "full" if self.max_side is None else str(self.max_side)
+        entry_path = f"{self.__folder}/{digest}.{size}.npy"
+
+        try:
+            res = np.load(entry_path, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+        else:
+            # Mark the entry as recently used
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+            return res
+
+        img = cv2.imread(img_path)
+        if img is None:
+            return None
+
+        if self.max_side is not None and max(img.shape[:2]) > self.max_side:
+            scale = self.max_side / max(img.shape[:2])
+            img = cv2.resize(
+                img,
+                (round(img.shape[1] * scale), round(img.shape[0] * scale)),
+                interpolation=cv2.INTER_AREA,
+            )
+
+        with atomic_write(entry_path, "wb") as f:
+            np.save(f, img)
+            size = f.tell()
+
+        self.__lru.add(size)
+        self.__lru.evict_if_needed()
+        return img
+
+    def evict(self) -> None:
+        """
+        Scans the cache and, if its size is over max_size, removes the
+        least recently used entries (see LRUFolder.evict)
+        """
+        self.__lru.evict()
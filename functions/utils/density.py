@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import cv2
+
+from cv2.typing import MatLike
+
+from functions.utils.image import crop_image
+from functions.utils.rectangle import Rectangle
+
+# Pixel density of the photos of the dataset (the median of their pixel
+# sizes is 0.042 mm), in pixels per mm: the sizes in pixels of the kernels
+# of the analysis were tuned on them, and are converted to mm with it
+DATASET_PX_PER_MM = 24
+
+
+def kernel_size(size_mm: float, density: Optional[float] = None) -> int:
+    """
+    Converts the size of a kernel from mm to pixels
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - size_mm: the size of the kernel, in mm
+    - density: the pixel density of the image the kernel is applied to,
+        in pixels per mm. None for an image at its native resolution,
+        where the kernel keeps the size in pixels it was tuned with (as if
+        the density were DATASET_PX_PER_MM)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The size of the kernel, in pixels (at least 1)
+    """
+
+    return max(1, round(size_mm * (DATASET_PX_PER_MM if density is None else density)))
+
+
+def canonical_size(
+    paper_roi: Rectangle, px_width_in_mm: float, px_height_in_mm: float, density: float
+) -> tuple[int, int]:
+    """
+    Computes the size of the paper ROI once resampled to a pixel density
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - paper_roi: the region where there are only paper and leaf
+    - px_width_in_mm: the width of a pixel of the image, in mm
+    - px_height_in_mm: the height of a pixel of the image, in mm
+    - density: the pixel density, in pixels per mm
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The width and the height of the resampled ROI, in pixels
+    """
+
+    return (
+        max(1, round(paper_roi.get_horiz().length * px_width_in_mm * density)),
+        max(1, round(paper_roi.get_vert().length * px_height_in_mm * density)),
+    )
+
+
+def resample_roi(
+    img: MatLike,
+    paper_roi: Rectangle,
+    px_width_in_mm: float,
+    px_height_in_mm: float,
+    density: float,
+) -> MatLike:
+    """
+    Resamples the paper ROI of an image to a pixel density, the same along
+    both axes, so that the analysis of the leaf costs the same for any
+    resolution of the camera, and its kernels cover the same mm
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - paper_roi: the region where there are only paper and leaf
+    - px_width_in_mm: the width of a pixel of the image, in mm
+    - px_height_in_mm: the height of a pixel of the image, in mm
+    - density: the pixel density, in pixels per mm
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The paper ROI, in BGR, where each pixel is 1 / density mm wide and
+    high
+    """
+
+    return cv2.resize(
+        crop_image(img, paper_roi),
+        canonical_size(paper_roi, px_width_in_mm, px_height_in_mm, density),
+        interpolation=cv2.INTER_AREA,
+    )
@@ -1,13 +1,29 @@
+from typing import Optional
+
 from cv2.typing import MatLike
 import cv2
 import numpy as np
 
+from functions.utils.density import DATASET_PX_PER_MM, kernel_size
+
 
 MIN_LEAF_HUE = 0
 MAX_LEAF_HUE = 80
 MIN_LEAF_SAT = 100
 MAX_LEAF_VAL = 150
 
+# Number of rows converted from BGR to HSV at a time, so that the HSV
+# version of the image is never stored in full
+MASK_STRIP_ROWS = 64
+
+# Size of the closing of get_leaf_mask, in mm (21 pixels on the photos of
+# the dataset)
+LEAF_MASK_CLOSING_MM = 21 / DATASET_PX_PER_MM
+
+# Bounds of get_leaf_mask, for inRange (which includes both)
+__LEAF_MASK_LOWER = np.array([MIN_LEAF_HUE + 1, MIN_LEAF_SAT + 1, 0])
+__LEAF_MASK_UPPER = np.array([MAX_LEAF_HUE, 255, MAX_LEAF_VAL])
+
 
 def is_px_leaf(px: tuple[int, int, int]) -> bool:
     """
@@ -37,17 +53,73 @@ def is_px_leaf(px: tuple[int, int, int]) -> bool:
     return False
 
 
-def get_leaf_mask(img: MatLike) -> MatLike:
+def get_leaf_px_mask_from_bgr(img: MatLike) -> MatLike:
+    """
+    Vectorized version of is_px_leaf: tells, for each pixel of an image,
+    if it can be part of a leaf or not (without any noise removal), starting
+    from the image in BGR
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A mask with 255 where the pixel can belong to a leaf, 0 elsewhere
+    """
+
+    return __in_range_from_bgr(
+        img,
+        np.array([MIN_LEAF_HUE, MIN_LEAF_SAT, 0]),
+        np.array([MAX_LEAF_HUE, 255, MAX_LEAF_VAL]),
+    )
+
+
+def __in_range_from_bgr(
+    img: MatLike, lower: np.ndarray, upper: np.ndarray
+) -> MatLike:
+    """
+    Computes cv2.inRange on the HSV version of a BGR image, converting
+    MASK_STRIP_ROWS rows at a time, so that the conversion and the
+    thresholding happen in a single pass over the image
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - lower: the lower bounds (inclusive) of H, S and V
+    - upper: the upper bounds (inclusive) of H, S and V
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    A mask with 255 where the pixel is within the bounds, 0 elsewhere
+    """
+
+    res = np.empty(img.shape[:2], np.uint8)
+
+    for row in range(0, img.shape[0], MASK_STRIP_ROWS):
+        strip = cv2.cvtColor(img[row : row + MASK_STRIP_ROWS], cv2.COLOR_BGR2HSV)
+        cv2.inRange(strip, lower, upper, dst=res[row : row + MASK_STRIP_ROWS])
+
+    return res
+
+
+def get_leaf_mask(img: MatLike, density: Optional[float] = None) -> MatLike:
     """
     Returns a mask to identify the exact region where the leaf is.
-    It is done by first applying thresholds on the 3 channels, then the
-    masks are and-ed, and finally a closing operation is executed to
-    remove some noise inside the leaf
+    It is done by first applying thresholds on the 3 channels (with a
+    single inRange), and then a closing operation is executed to remove
+    some noise inside the leaf
 
     ---------------------------------------------------------------------
     PARAMETERS
     ----------
     - img: the image, in HSV
+    - density: the pixel density of the image, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
 
     ---------------------------------------------------------------------
     OUTPUT
@@ -55,20 +127,33 @@ def get_leaf_mask(img: MatLike) -> MatLike:
     The mask that represents the leaf
     """
 
-    min_hue_mask = cv2.threshold(img[:, :, 0], MIN_LEAF_HUE, 255, cv2.THRESH_BINARY)[1]
-    res = min_hue_mask
+    # Hue and saturation must be strictly greater than their minimum
+    res = cv2.inRange(img, __LEAF_MASK_LOWER, __LEAF_MASK_UPPER)
+
+    size = kernel_size(LEAF_MASK_CLOSING_MM, density)
+    return cv2.morphologyEx(res, cv2.MORPH_CLOSE, np.ones((size, size)), dst=res)
 
-    max_hue_mask = cv2.threshold(
-        img[:, :, 0], MAX_LEAF_HUE, 255, cv2.THRESH_BINARY_INV
-    )[1]
-    res = cv2.bitwise_and(res, max_hue_mask)
 
-    min_sat_mask = cv2.threshold(img[:, :, 1], MIN_LEAF_SAT, 255, cv2.THRESH_BINARY)[1]
-    res = cv2.bitwise_and(res, min_sat_mask)
+def get_leaf_mask_from_bgr(img: MatLike, density: Optional[float] = None) -> MatLike:
+    """
+    Same as get_leaf_mask, but starting from the image in BGR, without
+    storing its full HSV version.
+    To restrict the computation to a region, pass a slice of the image
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - density: the pixel density of the image, in pixels per mm, if it was
+        resampled (None at the native resolution, see kernel_size)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The mask that represents the leaf
+    """
 
-    max_val_mask = cv2.threshold(
-        img[:, :, 2], MAX_LEAF_VAL, 255, cv2.THRESH_BINARY_INV
-    )[1]
-    res = cv2.bitwise_and(res, max_val_mask)
+    res = __in_range_from_bgr(img, __LEAF_MASK_LOWER, __LEAF_MASK_UPPER)
 
-    return cv2.morphologyEx(res, cv2.MORPH_CLOSE, np.ones((21,21)))
+    size = kernel_size(LEAF_MASK_CLOSING_MM, density)
+    return cv2.morphologyEx(res, cv2.MORPH_CLOSE, np.ones((size, size)), dst=res)
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import json
+import os
+import socket
+import time
+import uuid
+
+# Duration of a lease, in seconds, if not specified. It must be much
+# longer than the time needed to process an image
+DEFAULT_LEASE_DURATION = 600
+
+# Time, in seconds, after which a lock file that cannot be read is
+# considered abandoned (its owner crashed while writing it)
+UNREADABLE_LOCK_GRACE = 60
+
+
+def worker_id() -> str:
+    """
+    Returns a string that identifies this process among all the processes
+    of all the machines that share a folder
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The host name and the pid of the process
+    """
+    return f"{socket.gethostname()}.{os.getpid()}"
+
+
+class FileLease:
+    """
+    An exclusive claim on a resource shared by many processes, possibly on
+    different machines through a network filesystem (such as NFS), held by
+    a lock file that records its owner and its expiry time.
+
+    The lock file is created with O_EXCL, so only one process can create
+    it. An expired lock file is first renamed to a name unique to the
+    process that breaks it (only one rename can succeed), so that two
+    processes never both take over the same stale lease.
+    The expiry is an absolute time: the clocks of the machines must be
+    roughly in sync, with an error much smaller than the duration.
+    """
+
+    def __init__(self, path: str, owner: str, expires: float) -> None:
+        """
+        Creates the description of a lease held by this process. Use
+        try_acquire to actually acquire it
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the lock file
+        - owner: the identifier of the process that holds the lease
+        - expires: when the lease expires, in seconds since the epoch
+        """
+        self.path = path
+        self.owner = owner
+        self.expires = expires
+
+    @classmethod
+    def try_acquire(
+        cls, path: str, duration: Optional[float] = None
+    ) -> Optional[FileLease]:
+        """
+        Tries to acquire a lease, taking it over if it expired
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the lock file
+        - duration: the duration of the lease, in seconds (None for
+            DEFAULT_LEASE_DURATION)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The lease, or None if another process holds it
+        """
+
+        duration = DEFAULT_LEASE_DURATION if duration is None else duration
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        lease = cls.__create(path, duration)
+        if lease is not None:
+            return lease
+
+        current = cls.read(path)
+        if current is None:
+            # The lock file is being written, or its owner crashed while
+            # writing it
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except FileNotFoundError:
+                return cls.__create(path, duration)
+            if age < UNREADABLE_LOCK_GRACE:
+                return None
+        elif current.expires > time.time():
+            return None
+
+        # The lease expired: only the process whose rename succeeds can
+        # break it
+        stale_path = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            # Another process broke it first, or its owner released it
+            return cls.__create(path, duration)
+
+        renamed = cls.read(stale_path)
+        if renamed is not None and renamed.expires > time.time():
+            # Another process broke the lease and acquired it between the
+            # check and the rename: its lock file is put back (with link,
+            # which, unlike rename, fails if the path exists)
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return None
+
+        os.remove(stale_path)
+        return cls.__create(path, duration)
+
+    @classmethod
+    def read(cls, path: str) -> Optional[FileLease]:
+        """
+        Reads the lease recorded in a lock file
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the lock file
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The lease, or None if the file does not exist or cannot be read
+        """
+
+        try:
+            with open(path, "r") as f:
+                return cls.from_JSON(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any]) -> FileLease:
+        """
+        Creates a new lease from a dictionary representation of it
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as the output of to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The lease, as a FileLease
+        """
+        return cls(details["path"], details["owner"], float(details["expires"]))
+
+    def held(self) -> bool:
+        """
+        Tells if this process still holds the lease: no other process took
+        it over. An expired lease is still held until another process takes
+        it over (which rewrites the lock file), so that the work of a slow
+        owner is not discarded when nobody else did it
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the lease is still held
+        """
+
+        current = FileLease.read(self.path)
+        return current is not None and current.owner == self.owner
+
+    def release(self) -> None:
+        """
+        Releases the lease, if this process still holds it
+        """
+
+        if self.held():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the lease to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The lease as JSON object (a dict)
+        """
+        return {"path": self.path, "owner": self.owner, "expires": self.expires}
+
+    @classmethod
+    def __create(cls, path: str, duration: float) -> Optional[FileLease]:
+        """
+        Creates the lock file, if it does not exist
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the lock file
+        - duration: the duration of the lease, in seconds
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The lease, or None if the lock file already exists
+        """
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+
+        lease = cls(path, worker_id(), time.time() + duration)
+        with os.fdopen(fd, "w") as f:
+            json.dump(lease.to_JSON(), f)
+        return lease
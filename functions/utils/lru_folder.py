@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import os
+import threading
+
+# Fraction of the maximum size a folder is reduced to when it grows over
+# it, so that the folder is scanned again only after many writes
+EVICTION_TARGET = 0.9
+
+
+class LRUFolder:
+    """
+    The size of the files of an on-disk cache, that removes the least
+    recently used files (the oldest modification time) when it grows over
+    a maximum size.
+
+    The size is counted from the files written by this process, and the
+    folders are scanned only when that count goes over the maximum, so
+    that writing a file does not cost a scan of the whole cache (the files
+    written by the other processes are counted at the next scan).
+    The methods can be called by many threads at once.
+    """
+
+    def __init__(
+        self, folders: list[str], max_size: int, suffix: Optional[str] = None
+    ) -> None:
+        """
+        Creates the counter of the size of some folders. Nothing is scanned
+        until the first call to evict_if_needed
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - folders: the folders of the cache
+        - max_size: the maximum size of the files, in bytes
+        - suffix: if given, only the files whose name ends with it are
+            counted and removed
+        """
+
+        self.__folders = folders
+        self.__max_size = max_size
+        self.__suffix = suffix
+
+        # The size of the folders at the last scan plus the bytes written
+        # since (None until the first scan)
+        self.__size: Optional[int] = None
+        self.__lock = threading.Lock()
+
+    def add(self, size: int) -> None:
+        """
+        Counts the bytes of a file written to the cache in its size
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - size: the size of the file, in bytes
+        """
+
+        with self.__lock:
+            if self.__size is not None:
+                self.__size += size
+
+    def evict_if_needed(self) -> None:
+        """
+        Calls evict if the size is not known yet, or is over max_size
+        """
+
+        with self.__lock:
+            scan = self.__size is None or self.__size > self.__max_size
+        if scan:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Scans the folders and, if their size is over max_size, removes the
+        least recently used files until it is within EVICTION_TARGET of
+        max_size
+        """
+
+        files: list[tuple[float, int, str]] = []
+        for folder in self.__folders:
+            with os.scandir(folder) as it:
+                for file in it:
+                    if self.__suffix is not None and not file.name.endswith(
+                        self.__suffix
+                    ):
+                        continue
+                    try:
+                        stat = file.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, file.path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.__max_size:
+            target = self.__max_size * EVICTION_TARGET
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already removed by another process
+                    pass
+                total -= size
+
+        with self.__lock:
+            self.__size = total
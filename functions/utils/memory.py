@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+from typing import Any, Iterator, Optional
+
+from contextlib import contextmanager
+
+import threading
+import tracemalloc
+
+from functions.utils.process_records import ProcessRecords
+
+# Environment variable with the path of the memory profile being recorded.
+# Being in the environment, it is inherited by the worker processes
+MEMORY_PROFILE_ENV = "LEAF_MEMORY_PROFILE"
+
+# Number of images with the highest peak listed in the memory profile
+TOP_IMAGES = 10
+
+# Estimate of the memory needed to analyse an image, in bytes per pixel:
+# the memory profile measures a peak of 10 bytes per pixel on the photos of
+# the dataset (the decoded frame, its HSV version and the masks, in both
+# modes), plus a margin for the buffers internal to OpenCV, that
+# tracemalloc does not see
+IMAGE_BYTES_PER_PIXEL = 12
+
+# The records of the stages measured, by all the processes
+__records = ProcessRecords(MEMORY_PROFILE_ENV)
+
+# The stages being measured by each thread, innermost last, each as
+# [allocated bytes at the start, highest allocated bytes so far]
+__stages = threading.local()
+
+
+def start_memory_profile(path: str) -> None:
+    """
+    Starts measuring the memory allocated by each stage of the analysis,
+    in this process and in the worker processes it will start, with
+    tracemalloc.
+    The peak of a stage is the highest amount of memory allocated while it
+    ran, minus the memory allocated when it started; the retained memory
+    is what it left allocated at its end (for example, the masks kept by
+    ImageFeatures).
+    tracemalloc sees the arrays allocated by numpy and returned by OpenCV,
+    but not the temporary buffers internal to OpenCV. The analysis is also
+    a few times slower while the memory is measured.
+    Stages run at the same time by other threads of the same process are
+    included in the peak, and reset it: the images must be analysed one at
+    a time (update_dataset enforces it while the memory is measured)
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the profile (a json file), written by
+        stop_memory_profile
+    """
+
+    __records.start(path)
+    tracemalloc.start()
+
+
+def stop_memory_profile() -> Optional[dict[str, Any]]:
+    """
+    Stops measuring the memory, and writes the profile, that summarizes
+    the records of all the processes. It must be called after the worker
+    processes ended
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The profile, or None if the memory was not being measured. For each
+    stage, the number of times it ran, the highest and the mean peak and
+    the mean retained memory (in bytes); then the TOP_IMAGES images with
+    the highest peak
+    """
+
+    if not memory_profiling_enabled():
+        return None
+    tracemalloc.stop()
+
+    res = __records.stop(__summarize, indent=4)
+    return None if res is None else res[1]
+
+
+def print_memory_profile(profile: dict[str, Any]) -> None:
+    """
+    Prints the memory used by each stage, from the most expensive
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - profile: the profile, as returned by stop_memory_profile
+    """
+
+    mb = 1024 * 1024
+    print(
+        f"{'stage':<20} {'calls':>7} {'max peak':>10} {'mean peak':>10} {'retained':>10}"
+    )
+    for name, stage in profile["stages"].items():
+        print(
+            f"{name:<20} {stage['calls']:>7} "
+            f"{stage['max_peak'] / mb:>7.1f} MB {stage['mean_peak'] / mb:>7.1f} MB "
+            f"{stage['mean_retained'] / mb:>7.1f} MB"
+        )
+
+
+def memory_profiling_enabled() -> bool:
+    """
+    Tells if the memory used by the stages is being measured
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Whether start_memory_profile was called, by this process or by its
+    parent
+    """
+    return __records.enabled()
+
+
+@contextmanager
+def memory_stage(name: str, image: Optional[str] = None) -> Iterator[None]:
+    """
+    Measures the memory allocated by a block of code, if the memory
+    profile is enabled (otherwise it does nothing). Stages can be nested:
+    the peak of a stage includes those of the stages it contains
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - name: the name of the stage
+    - image: the path of the image the stage works on, if any
+    """
+
+    if not memory_profiling_enabled():
+        yield
+        return
+
+    if not tracemalloc.is_tracing():
+        # A worker process started without the state of its parent
+        tracemalloc.start()
+
+    stack: list[list[int]] = getattr(__stages, "stack", None) or []
+    __stages.stack = stack
+
+    current, peak = tracemalloc.get_traced_memory()
+    if len(stack) > 0:
+        # The peak is reset for the new stage: keep the one of the outer
+        # stage so far
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    stack.append([current, current])
+
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        start, highest = stack.pop()
+        highest = max(highest, peak)
+        if len(stack) > 0:
+            stack[-1][1] = max(stack[-1][1], highest)
+
+        __records.append(
+            [
+                {
+                    "stage": name,
+                    "image": image,
+                    "peak": highest - start,
+                    "retained": current - start,
+                }
+            ]
+        )
+
+
+class MemoryBudget:
+    """
+    Limits the images analysed at the same time by many threads: at most
+    max_images, and only as many as their estimated memory fits in
+    max_bytes. An image is always admitted when no other one is being
+    analysed, even if it does not fit, so that it cannot wait forever
+    """
+
+    def __init__(
+        self,
+        max_images: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        bytes_per_pixel: float = IMAGE_BYTES_PER_PIXEL,
+    ) -> None:
+        """
+        Creates a budget with no image admitted yet
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - max_images: the maximum number of images analysed at the same
+            time (None for no limit)
+        - max_bytes: the memory available for the analysis, in bytes
+            (None for no limit)
+        - bytes_per_pixel: the memory needed to analyse an image, in bytes
+            per pixel
+        """
+
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.bytes_per_pixel = bytes_per_pixel
+
+        self.images = 0
+        self.bytes = 0
+
+        self.__condition = threading.Condition()
+
+    @contextmanager
+    def admit(self, img_path: str) -> Iterator[None]:
+        """
+        Waits until an image fits in the budget, and keeps its memory
+        reserved while it is analysed, as:
+
+            with budget.admit(img_path):
+                ...
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+        """
+
+        needed = self.estimate(img_path)
+
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.images == 0
+                or (
+                    (self.max_images is None or self.images < self.max_images)
+                    and (
+                        self.max_bytes is None or self.bytes + needed <= self.max_bytes
+                    )
+                )
+            )
+            self.images += 1
+            self.bytes += needed
+
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.images -= 1
+                self.bytes -= needed
+                self.__condition.notify_all()
+
+    def estimate(self, img_path: str) -> int:
+        """
+        Estimates the memory needed to analyse an image, from its size,
+        reading only its header
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - img_path: the path of the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The estimate, in bytes (0 if the size of the image is unknown: the
+        analysis will fail anyway)
+        """
+
+        if self.max_bytes is None:
+            return 0
+
+        from PIL import Image
+
+        try:
+            with Image.open(img_path) as img:
+                width, height = img.size
+        except (OSError, ValueError):
+            return 0
+        return round(width * height * self.bytes_per_pixel)
+
+
+def __summarize(records: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Summarizes the records of the stages measured by all the processes
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - records: the stage, the image, the peak and the retained memory of
+        each stage that ran
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The profile (see stop_memory_profile)
+    """
+
+    stages: dict[str, dict[str, Any]] = {}
+    images: dict[str, int] = {}
+    for record in records:
+        stage = stages.setdefault(
+            record["stage"],
+            {"calls": 0, "max_peak": 0, "mean_peak": 0, "mean_retained": 0},
+        )
+        stage["calls"] += 1
+        stage["max_peak"] = max(stage["max_peak"], record["peak"])
+        # Sums, until divided below
+        stage["mean_peak"] += record["peak"]
+        stage["mean_retained"] += record["retained"]
+
+        if record["image"] is not None:
+            images[record["image"]] = max(
+                images.get(record["image"], 0), record["peak"]
+            )
+
+    for stage in stages.values():
+        stage["mean_peak"] /= stage["calls"]
+        stage["mean_retained"] /= stage["calls"]
+
+    return {
+        "stages": dict(
+            sorted(stages.items(), key=lambda item: item[1]["max_peak"], reverse=True)
+        ),
+        "top_images": dict(
+            sorted(images.items(), key=lambda item: item[1], reverse=True)[:TOP_IMAGES]
+        ),
+    }
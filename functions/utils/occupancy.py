@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from cv2.typing import MatLike
+import numpy as np
+
+from functions.utils.rectangle import Rectangle
+from functions.utils.segment import Segment
+from functions.utils.leaf import get_leaf_px_mask_from_bgr
+
+
+class LeafOccupancy:
+    """
+    An index of where the leaf pixels (as defined by is_px_leaf) are in
+    an image, computed once with vectorized operations, that answers in
+    O(1):
+    - whether a pixel is part of the leaf
+    - the first and last leaf column of each row, within the paper ROI
+        columns
+    get_leaf_roi still follows the border of the leaf pixel by pixel: its
+    result depends on which pixels are connected to the widths, not only
+    on the extent of each row
+    """
+
+    def __init__(self, mask: np.ndarray, paper_roi: Rectangle) -> None:
+        """
+        Creates the index from a mask of the leaf pixels
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - mask: a boolean matrix, as big as the image, True where the pixel
+            is part of the leaf
+        - paper_roi: the region where there are only paper and leaf
+        """
+
+        self.mask = mask
+
+        left, right = paper_roi.get_horiz().corner, paper_roi.get_horiz().other_corner()
+
+        # Rows, considering only the paper ROI columns
+        roi_cols = mask[:, left:right]
+        occupied = roi_cols.any(axis=1)
+        self.row_first = np.where(occupied, left + roi_cols.argmax(axis=1), -1)
+        self.row_last = np.where(
+            occupied, right - 1 - roi_cols[:, ::-1].argmax(axis=1), -1
+        )
+
+    def is_leaf(self, row: int, col: int) -> bool:
+        """
+        Tells if a pixel is part of the leaf
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - row: the row of the pixel
+        - col: the column of the pixel
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the pixel is part of the leaf
+        """
+        return bool(self.mask[row, col])
+
+    def is_row_occupied(self, row: int) -> bool:
+        """
+        Tells if a row contains the leaf, within the paper ROI columns
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - row: the row to be checked
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether the row contains parts of the leaf
+        """
+        return bool(self.row_first[row] >= 0)
+
+    def row_extent(self, row: int) -> Segment:
+        """
+        Returns the horizontal segment from the first to the last leaf pixel
+        of a row, within the paper ROI columns
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - row: the row to be considered
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The segment that includes the leaf in that row
+        """
+
+        if self.row_first[row] < 0:
+            raise ValueError(f"Row {row} does not contain the leaf")
+
+        first = int(self.row_first[row])
+        return Segment(first, int(self.row_last[row]) - first)
+
+
+def get_leaf_occupancy(img: MatLike, paper_roi: Rectangle) -> LeafOccupancy:
+    """
+    Computes the leaf occupancy index of an image
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the image, in BGR
+    - paper_roi: the region where there are only paper and leaf
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The index of the leaf pixels
+    """
+
+    mask = get_leaf_px_mask_from_bgr(img)
+
+    # From 0/255 to 0/1, in place, to reuse the mask as a boolean one
+    np.minimum(mask, 1, out=mask)
+    return LeafOccupancy(mask.view(np.bool_), paper_roi)
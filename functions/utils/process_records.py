@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Optional, TextIO
+
+import glob
+import json
+import os
+import threading
+
+
+class ProcessRecords:
+    """
+    Records (json objects) written by a process and by the worker
+    processes it starts, such as the events of a trace, merged into one
+    file at the end.
+
+    The path of the file is stored in an environment variable, so that it
+    is inherited by the workers. Each process appends its records to its
+    own file next to it (path.pid.part), flushed after each record, so
+    that the records of workers that are killed or never exit normally
+    are not lost.
+    The methods can be called by many threads at once.
+    """
+
+    def __init__(self, env: str) -> None:
+        """
+        Creates the records of a kind, not being written
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - env: the environment variable with the path of the file
+        """
+
+        self.env = env
+
+        # The file where this process writes its records, with the pid it
+        # was opened by (a forked worker must open its own)
+        self.__part: Optional[tuple[int, TextIO]] = None
+        self.__lock = threading.Lock()
+
+    def start(self, path: str) -> None:
+        """
+        Starts writing the records of this process, and of the worker
+        processes it will start
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file (a json file), written by stop
+        """
+
+        path = os.path.abspath(path)
+        for part in glob.glob(f"{glob.escape(path)}.*.part"):
+            # Left by a run that did not complete
+            os.remove(part)
+        os.environ[self.env] = path
+
+    def enabled(self) -> bool:
+        """
+        Tells if the records are being written
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        Whether start was called, by this process or by its parent
+        """
+        return self.env in os.environ
+
+    def append(
+        self,
+        records: list[dict[str, Any]],
+        first: Optional[list[dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Appends some records to the file of this process
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - records: the records
+        - first: if given, the records written before them when they are
+            the first ones of this process (for example, its name)
+        """
+
+        pid = os.getpid()
+        with self.__lock:
+            if self.__part is None or self.__part[0] != pid:
+                # First records of this process (or of a worker forked after
+                # the file of its parent was opened)
+                self.__part = (pid, open(f"{os.environ[self.env]}.{pid}.part", "a"))
+                if first is not None:
+                    records = first + records
+
+            self.__part[1].write(
+                "".join(json.dumps(record) + "\n" for record in records)
+            )
+            self.__part[1].flush()
+
+    def stop(
+        self,
+        merge: Callable[[list[dict[str, Any]]], Any],
+        indent: Optional[int] = None,
+    ) -> Optional[tuple[str, Any]]:
+        """
+        Stops writing, and merges the records of all the processes into the
+        file. It must be called after the worker processes ended
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - merge: computes the content of the file (a json value) from the
+            records of all the processes
+        - indent: the indentation of the json file
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The path of the file and its content, or None if the records were
+        not being written
+        """
+
+        path = os.environ.pop(self.env, None)
+        if path is None:
+            return None
+
+        with self.__lock:
+            if self.__part is not None:
+                self.__part[1].close()
+                self.__part = None
+
+        records: list[dict[str, Any]] = []
+        parts = glob.glob(f"{glob.escape(path)}.*.part")
+        for part in parts:
+            with open(part, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Truncated: the process was killed while writing it
+                        continue
+
+        res = merge(records)
+        with open(path, "w") as f:
+            json.dump(res, f, indent=indent)
+        for part in parts:
+            os.remove(part)
+
+        return path, res
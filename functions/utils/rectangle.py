@@ -1,8 +1,21 @@
 from __future__ import annotations
+
+from typing import Any
+
 from functions.utils.segment import Segment
 
 
 class Rectangle:
+    """
+    A rectangle, described by its horizontal and vertical segments.
+    Rectangles are immutable
+    """
+
+    __slots__ = ("horiz", "vert")
+
+    horiz: Segment
+    vert: Segment
+
     def __init__(self, horiz: Segment, vert: Segment) -> None:
         """
         Creates a new rectangle, given the segments that represent its
@@ -14,8 +27,27 @@ class Rectangle:
         - horiz: the horizontal size
         - vert: the vertical size
         """
-        self.horiz = horiz
-        self.vert = vert
+        object.__setattr__(self, "horiz", horiz)
+        object.__setattr__(self, "vert", vert)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Rectangle is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Rectangle is immutable")
+
+    def __reduce__(self) -> tuple[type[Rectangle], tuple[Any, ...]]:
+        # Rebuilt through __init__, since __setattr__ refuses the default
+        # restore used by pickle and copy
+        return Rectangle, (self.horiz, self.vert)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Rectangle):
+            return NotImplemented
+        return (self.horiz == other.horiz) and (self.vert == other.vert)
+
+    def __hash__(self) -> int:
+        return hash((self.horiz, self.vert))
 
     @classmethod
     def from_values(
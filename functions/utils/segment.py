@@ -1,7 +1,22 @@
 from __future__ import annotations
 
+from typing import Any, Iterator, Sequence, cast
+
+import numpy as np
+import numpy.typing as npt
+
 
 class Segment:
+    """
+    A monodirectional segment. Segments are immutable: the operations on
+    them return new segments
+    """
+
+    __slots__ = ("corner", "length")
+
+    corner: int
+    length: int
+
     def __init__(self, corner: int, length: int) -> None:
         """
         Creates a new monodirectional segment, given its starting point and
@@ -13,14 +28,28 @@ class Segment:
         - corner: the starting point of the segment
         - length: the length of the segment
         """
-        self.corner = corner
-        self.length = length
+        object.__setattr__(self, "corner", corner)
+        object.__setattr__(self, "length", length)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Segment is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Segment is immutable")
+
+    def __reduce__(self) -> tuple[type[Segment], tuple[Any, ...]]:
+        # Rebuilt through __init__, since __setattr__ refuses the default
+        # restore used by pickle and copy
+        return Segment, (self.corner, self.length)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Segment):
             return NotImplemented
         return (self.corner == other.corner) and (self.length == other.length)
 
+    def __hash__(self) -> int:
+        return hash((self.corner, self.length))
+
     @classmethod
     def from_JSON(cls, details: dict[str, int]) -> Segment:
         """
@@ -131,9 +160,16 @@ class Segment:
         ------
         The other half of this segment
         """
-        if half == self.first_half():
+
+        # Compare with the halves without building them
+        half_length = int(self.length / 2)
+
+        if half.corner == self.corner and half.length == half_length:
             return self.second_half()
-        elif half == self.second_half():
+        elif (
+            half.corner == self.corner + half_length
+            and half.length == self.length - half_length
+        ):
             return self.first_half()
         else:
             raise Exception(f"{half} is not the first or second half of {self}")
@@ -148,3 +184,198 @@ class Segment:
         The segment as JSON object (a dict)
         """
         return {"corner": int(self.corner), "length": int(self.length)}
+
+
+class SegmentArray:
+    """
+    A batch of monodirectional segments, stored as two int32 arrays (the
+    corners and the lengths), with vectorized operations.
+    Like Segment, it is immutable
+    """
+
+    __slots__ = ("corners", "lengths")
+
+    corners: npt.NDArray[np.int32]
+    lengths: npt.NDArray[np.int32]
+
+    def __init__(
+        self,
+        corners: Sequence[int] | npt.NDArray[np.integer[Any]],
+        lengths: Sequence[int] | npt.NDArray[np.integer[Any]],
+    ) -> None:
+        """
+        Creates a new batch of segments, given their starting points and
+        lengths
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - corners: the starting points of the segments
+        - lengths: the lengths of the segments, in the same order
+        """
+
+        corners_array = np.array(corners, dtype=np.int32)
+        lengths_array = np.array(lengths, dtype=np.int32)
+
+        if corners_array.shape != lengths_array.shape or corners_array.ndim != 1:
+            raise ValueError("Corners and lengths must be 1D and of the same size")
+
+        corners_array.flags.writeable = False
+        lengths_array.flags.writeable = False
+
+        object.__setattr__(self, "corners", corners_array)
+        object.__setattr__(self, "lengths", lengths_array)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("SegmentArray is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("SegmentArray is immutable")
+
+    def __reduce__(self) -> tuple[type[SegmentArray], tuple[Any, ...]]:
+        # Rebuilt through __init__, since __setattr__ refuses the default
+        # restore used by pickle and copy
+        return SegmentArray, (self.corners, self.lengths)
+
+    @classmethod
+    def from_segments(cls, segments: Sequence[Segment]) -> SegmentArray:
+        """
+        Creates a new batch from a list of segments
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - segments: the segments to be stored
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The segments, as a SegmentArray
+        """
+        return cls([s.corner for s in segments], [s.length for s in segments])
+
+    @classmethod
+    def from_JSON(cls, details: dict[str, Any] | list[dict[str, Any]]) -> SegmentArray:
+        """
+        Creates a new batch from its JSON representation. The representation
+        of old versions (a list of segments, each as a dict) is accepted too
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - details: a dictionary formatted as {corners: [...], lengths: [...]},
+            or a list of segments in the format of Segment.to_JSON
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The segments, as a SegmentArray
+        """
+
+        if isinstance(details, list):
+            return cls.from_segments([Segment.from_JSON(d) for d in details])
+
+        if ("corners" not in details) or ("lengths" not in details):
+            raise Exception("Invalid JSON format")
+
+        return cls(details["corners"], details["lengths"])
+
+    def __len__(self) -> int:
+        return len(self.corners)
+
+    def __getitem__(self, index: int) -> Segment:
+        return Segment(int(self.corners[index]), int(self.lengths[index]))
+
+    def __iter__(self) -> Iterator[Segment]:
+        # tolist converts all the values at once, to python ints
+        corners = cast(list[int], self.corners.tolist())
+        lengths = cast(list[int], self.lengths.tolist())
+        for corner, length in zip(corners, lengths):
+            yield Segment(corner, length)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SegmentArray):
+            return NotImplemented
+        return bool(
+            np.array_equal(self.corners, other.corners)
+            and np.array_equal(self.lengths, other.lengths)
+        )
+
+    def __repr__(self) -> str:
+        """
+        Describes the segments as "SegmentArray[_segment_, _segment_, ...]"
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The string describing the segments
+        """
+        return f"SegmentArray[{', '.join(repr(s) for s in self)}]"
+
+    def other_corners(self) -> npt.NDArray[np.int32]:
+        """
+        Returns the coordinates of the end points of the segments
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The coordinates of the end points, as an int array
+        """
+        return self.corners + self.lengths
+
+    def intersect(self, other: Segment | SegmentArray) -> SegmentArray:
+        """
+        Returns the intersections between each of these segments and
+        another segment (or the corresponding segment of another batch)
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - other: the other segment(s) to intersect with
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The intersections
+        """
+
+        other_corners: np.int32 | npt.NDArray[np.int32]
+        other_ends: np.int32 | npt.NDArray[np.int32]
+        if isinstance(other, Segment):
+            other_corners = np.int32(other.corner)
+            other_ends = np.int32(other.other_corner())
+        else:
+            other_corners = other.corners
+            other_ends = other.other_corners()
+
+        corners = np.maximum(self.corners, other_corners)
+        ends = np.minimum(self.other_corners(), other_ends)
+        return SegmentArray(corners, ends - corners)
+
+    def middles(self) -> npt.NDArray[np.int32]:
+        """
+        Computes the middle points of the segments, eventually rounding them
+        down as Segment.middle does
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The coordinates of the midpoints, as an int array
+        """
+        # int(length / 2) truncates towards zero also for negative lengths
+        res: npt.NDArray[np.int32] = self.corners + np.sign(self.lengths) * (
+            np.abs(self.lengths) // 2
+        )
+        return res
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the segments to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The segments as JSON object, in the format
+        {corners: [...], lengths: [...]}
+        """
+        return {"corners": self.corners.tolist(), "lengths": self.lengths.tolist()}
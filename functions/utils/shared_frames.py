@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import os
+
+import cv2
+import numpy as np
+
+from functions.utils.tracing import trace_span
+
+R = TypeVar("R")
+
+# Number of frames per worker that can be decoded in advance
+FRAMES_PER_WORKER = 2
+
+
+class SharedFrame:
+    """
+    The description of a decoded image placed in a shared memory block:
+    everything a worker needs to rebuild it without copying it
+    """
+
+    # The shared memory block that this process is attached to, for each
+    # slot of the ring: only the current block of a slot is kept, since the
+    # parent unlinks the previous one when it enlarges the slot
+    __attached: dict[int, shared_memory.SharedMemory] = {}
+
+    def __init__(
+        self, slot: int, block: str, shape: tuple[int, ...], dtype: str
+    ) -> None:
+        """
+        Creates the description of a frame
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - slot: the index of the block in the ring
+        - block: the name of the shared memory block
+        - shape: the shape of the image
+        - dtype: the type of the pixel values of the image
+        """
+        self.slot = slot
+        self.block = block
+        self.shape = shape
+        self.dtype = dtype
+
+    def view(self) -> np.ndarray:
+        """
+        Attaches to the shared memory block (once per process, detaching
+        from the previous block of the same slot) and returns the image,
+        as a read-only array that uses the block as its memory
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The image
+        """
+
+        attached = SharedFrame.__attached.get(self.slot, None)
+        if attached is None or attached.name != self.block:
+            if attached is not None:
+                try:
+                    attached.close()
+                except BufferError:
+                    # An image of the old block is still referenced: the
+                    # mapping is closed when it is garbage collected
+                    pass
+            attached = shared_memory.SharedMemory(self.block)
+            SharedFrame.__attached[self.slot] = attached
+
+        res = np.ndarray(self.shape, self.dtype, attached.buf)
+        # The block is reused for the next frames: it must not be modified
+        res.flags.writeable = False
+        return res
+
+    def apply(self, worker: Callable[..., R], args: tuple[Any, ...]) -> R:
+        """
+        Runs, in a worker process, a function on the image
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - worker: the function to be run, that receives the image followed
+            by args
+        - args: the other arguments of the function
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The result of the function
+        """
+        return worker(self.view(), *args)
+
+
+class SharedFramePool(Generic[R]):
+    """
+    A pool of worker processes that run a function on decoded images.
+    The images are decoded by the parent process and copied once into a
+    ring of shared memory blocks, and the workers access them by name, so
+    that multi-megabyte images are never pickled.
+    (Decoding directly into the blocks is not possible in general, since
+    the EXIF orientation can change the shape of the image after decoding)
+
+    The ring has a fixed number of blocks, which bounds the memory used:
+    when all of them are in use, the parent waits for the oldest image to
+    be processed before decoding the next one.
+    A block is enlarged only when an image does not fit in it.
+    """
+
+    def __init__(
+        self,
+        worker: Callable[..., R],
+        workers: Optional[int] = None,
+        ring_size: Optional[int] = None,
+    ) -> None:
+        """
+        Starts the worker processes
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - worker: the function run on each image. It must be a module-level
+            function, that receives the image (a read-only array, valid
+            only until the function returns) followed by the arguments
+            given to map. Its result must be picklable
+        - workers: the number of worker processes (None for one per CPU)
+        - ring_size: the number of shared memory blocks (None for
+            FRAMES_PER_WORKER per worker)
+        """
+
+        self.__worker = worker
+        self.__workers = (os.cpu_count() or 1) if workers is None else workers
+        self.__ring_size = (
+            FRAMES_PER_WORKER * self.__workers if ring_size is None else ring_size
+        )
+
+        self.__blocks: list[Optional[shared_memory.SharedMemory]] = [
+            None
+        ] * self.__ring_size
+        self.__free = deque(range(self.__ring_size))
+
+        self.__executor = ProcessPoolExecutor(self.__workers)
+
+    def __enter__(self) -> SharedFramePool[R]:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    def map(
+        self, items: Iterable[tuple[str, tuple[Any, ...]]]
+    ) -> Iterator[tuple[str, Optional[R]]]:
+        """
+        Runs the worker on some images, decoding the next ones while the
+        workers process the previous ones
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - items: for each image, its path and the other arguments of the
+            worker
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        For each image, in the same order, its path and the result of the
+        worker (None if the image could not be decoded).
+        Errors raised by the worker are raised again here
+        """
+
+        pending: deque[tuple[str, int, Future[R]]] = deque()
+
+        for path, args in items:
+            if len(self.__free) == 0:
+                yield self.__collect(pending)
+
+            with trace_span("decode", image=path):
+                img = cv2.imread(path)
+            if img is None:
+                # Keep the order of the results
+                while len(pending) > 0:
+                    yield self.__collect(pending)
+                yield path, None
+                continue
+
+            slot = self.__free.popleft()
+            with trace_span("share", image=path):
+                frame = self.__store(slot, img)
+            pending.append(
+                (
+                    path,
+                    slot,
+                    self.__executor.submit(frame.apply, self.__worker, args),
+                )
+            )
+
+        while len(pending) > 0:
+            yield self.__collect(pending)
+
+    def close(self) -> None:
+        """
+        Stops the workers and releases the shared memory blocks
+        """
+
+        self.__executor.shutdown()
+
+        for block in self.__blocks:
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.__blocks = [None] * self.__ring_size
+
+    def __collect(
+        self, pending: deque[tuple[str, int, Future[R]]]
+    ) -> tuple[str, Optional[R]]:
+        """
+        Waits for the oldest pending image, and frees its block
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - pending: the images sent to the workers, in order
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The path of the image and the result of the worker
+        """
+
+        path, slot, future = pending.popleft()
+        try:
+            return path, future.result()
+        finally:
+            self.__free.append(slot)
+
+    def __store(self, slot: int, img: np.ndarray) -> SharedFrame:
+        """
+        Copies an image into a block of the ring, enlarging the block if it
+        is too small
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - slot: the index of the block in the ring
+        - img: the image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The description of the frame, to be sent to the workers
+        """
+
+        block = self.__blocks[slot]
+        if block is None or block.size < img.nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=img.nbytes)
+            self.__blocks[slot] = block
+
+        np.copyto(np.ndarray(img.shape, img.dtype, block.buf), img)
+        return SharedFrame(slot, block.name, img.shape, img.dtype.str)
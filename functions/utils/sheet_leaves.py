@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+import math
+
+import cv2
+import numpy as np
+
+from cv2.typing import MatLike
+
+from functions.utils.rectangle import Rectangle
+from functions.utils.leaf import get_leaf_mask_from_bgr
+from functions.utils.density import kernel_size
+from functions.lengths.calibration import PaperCalibration
+from functions.lengths.leaf_contour import CONTOUR_CLOSING_MM
+
+# Minimum area of a leaf, as a fraction of the area of the paper ROI:
+# smaller connected components are considered noise
+MIN_LEAF_AREA_FRACTION = 0.001
+
+# Paper kept around each leaf when it is cut out of the sheet, beyond the
+# radius of the closing in find_leaf_contour (the largest kernel of the
+# analysis of the leaf), in pixels: with less paper, the closing would
+# reach the border of the cut out and change the contour of the leaf.
+# At the native resolution of the photos of the dataset, the margin is
+# 64 pixels
+LEAF_MARGIN_PADDING = 12
+
+# White, the color given to everything that is not the leaf in a cut out
+__PAPER_COLOR = (255, 255, 255)
+
+
+class SheetLeaf:
+    """
+    One of the leaves placed on a sheet, cut out of the picture together
+    with some paper around it, so that it can be analysed by an
+    ImageFeatures as if it were the only leaf on a (smaller) sheet
+    """
+
+    def __init__(
+        self, bounding_box: Rectangle, img: MatLike, calibration: PaperCalibration
+    ) -> None:
+        """
+        Creates a new leaf of the sheet
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - bounding_box: the bounding box of the leaf, in the coordinates of
+            the whole picture
+        - img: the cut out, in BGR, where everything but the leaf is white
+        - calibration: the calibration of the cut out: its paper ROI is the
+            whole cut out, the pixel size is the one of the sheet
+        """
+        self.bounding_box = bounding_box
+        self.img = img
+        self.calibration = calibration
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the leaf to a JSON object (without the cut out)
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The leaf as JSON object (a dict)
+        """
+        return {
+            "bounding_box": self.bounding_box.to_JSON(),
+            "calibration": self.calibration.to_JSON(),
+        }
+
+
+def leaf_margin(calibration: PaperCalibration, density: Optional[float] = None) -> int:
+    """
+    Computes the paper kept around each leaf when it is cut out of the
+    sheet, so that the closing of find_leaf_contour fits in the cut out
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - calibration: the calibration of the sheet
+    - density: the pixel density the leaves are analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The margin, in pixels of the picture
+    """
+
+    if density is None:
+        # The kernel keeps its size in pixels
+        closing = kernel_size(CONTOUR_CLOSING_MM)
+    else:
+        # The kernel covers the same mm at any resolution
+        closing = CONTOUR_CLOSING_MM / min(
+            calibration.px_width_in_mm, calibration.px_height_in_mm
+        )
+    return math.ceil(closing / 2) + LEAF_MARGIN_PADDING
+
+
+def find_sheet_leaves(
+    img: MatLike, calibration: PaperCalibration, density: Optional[float] = None
+) -> list[SheetLeaf]:
+    """
+    Finds all the leaves placed on a sheet, as the connected components of
+    the leaf mask of the paper ROI, and cuts each of them out.
+    The paper ROI and the pixel size are computed once for the whole
+    sheet, and shared by all the leaves
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img: the picture, in BGR
+    - calibration: the position of the paper in the picture and the size
+        of its pixels
+    - density: the pixel density the leaves are analysed at, if any (see
+        ImageFeatures): it sets the paper kept around each leaf
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The leaves, sorted from top to bottom and then from left to right
+    """
+
+    l, r, t, b = calibration.roi_boundaries
+    mask = get_leaf_mask_from_bgr(img[t:b, l:r])
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    min_area = MIN_LEAF_AREA_FRACTION * (r - l) * (b - t)
+    margin = leaf_margin(calibration, density)
+
+    # The kernel grows the leaf a bit, so that its border pixels (removed
+    # by the closing) are not painted white
+    kernel = np.ones((margin, margin), np.uint8)
+
+    res: list[SheetLeaf] = []
+    # Label 0 is the paper
+    for label in range(1, count):
+        x, y, w, h, area = stats[label]
+        if area < min_area:
+            continue
+
+        # Cut out, in the coordinates of the paper ROI
+        x0, x1 = max(0, x - margin), min(r - l, x + w + margin)
+        y0, y1 = max(0, y - margin), min(b - t, y + h + margin)
+
+        keep = cv2.dilate((labels[y0:y1, x0:x1] == label).astype(np.uint8), kernel)
+        cut_out = img[t + y0 : t + y1, l + x0 : l + x1].copy()
+        cut_out[keep == 0] = __PAPER_COLOR
+
+        res.append(
+            SheetLeaf(
+                Rectangle.from_values(t + y, l + x, w, h),
+                cut_out,
+                PaperCalibration(
+                    (0, x1 - x0, 0, y1 - y0),
+                    calibration.px_width_in_mm,
+                    calibration.px_height_in_mm,
+                ),
+            )
+        )
+
+    res.sort(
+        key=lambda leaf: (leaf.bounding_box.vert.corner, leaf.bounding_box.horiz.corner)
+    )
+    return res
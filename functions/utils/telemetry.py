@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Iterator, Optional, TypeVar
+
+from contextlib import contextmanager
+
+import json
+import threading
+import time
+
+from functions.utils.atomic import atomic_write
+from functions.utils.tracing import trace_span
+from functions.utils.memory import memory_stage
+
+T = TypeVar("T")
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Seconds between two progress lines (and two writes of the metrics file)
+PROGRESS_INTERVAL = 5.0
+
+# Prefix of the names of the exported metrics
+METRICS_PREFIX = "leaf_batch"
+
+
+class StageTimings:
+    """
+    The time spent in each stage of the analysis of one image. It can be
+    filled in a worker process and sent back with the result.
+    If tracing is enabled, each stage is also recorded as a span of the
+    trace, and if the memory profile is enabled, its memory is measured
+    """
+
+    def __init__(self, image: Optional[str] = None) -> None:
+        """
+        Creates new, empty timings
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - image: the path of the image, used to tag the spans of the trace
+        """
+        self.image = image
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measures the time spent in a block of code, as:
+
+            with timings.stage("extract"):
+                ...
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - name: the name of the stage (the time of stages with the same
+            name is summed)
+        """
+
+        start = time.perf_counter()
+        try:
+            with trace_span(name, image=self.image), memory_stage(name, self.image):
+                yield
+        finally:
+            self.durations[name] = (
+                self.durations.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def total(self) -> float:
+        """
+        Returns the time spent in all the stages
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The total time, in seconds
+        """
+        return sum(self.durations.values())
+
+
+class LatencyHistogram:
+    """
+    The distribution of the durations of a stage, as counts of durations
+    lower than or equal to each bucket bound (as in Prometheus)
+    """
+
+    def __init__(self, bounds: Optional[list[float]] = None) -> None:
+        """
+        Creates a new, empty histogram
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - bounds: the upper bounds of the buckets, in seconds (None for
+            LATENCY_BUCKETS)
+        """
+        self.bounds = LATENCY_BUCKETS if bounds is None else bounds
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Adds a duration to the histogram
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - seconds: the duration
+        """
+
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def to_JSON(self) -> dict[str, Any]:
+        """
+        Converts the histogram to a JSON object
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The histogram as JSON object (a dict)
+        """
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "max": self.max,
+            "buckets": {str(bound): n for bound, n in zip(self.bounds, self.counts)},
+        }
+
+
+class BatchTelemetry:
+    """
+    The progress and the throughput of a batch job (update, classify
+    --dir): how many images were analysed, how fast, how many are waiting,
+    how busy the workers are and how long each stage takes.
+
+    A progress line is printed at most every PROGRESS_INTERVAL seconds, and
+    the metrics can be written, at the same time, to a file in the
+    Prometheus text format, to be exported by the textfile collector of a
+    node exporter (no network service is involved). At the end, a summary
+    can be written as json.
+    The methods can be called by many threads at once.
+    """
+
+    def __init__(
+        self,
+        job: str,
+        total: int,
+        workers: int = 1,
+        metrics_path: Optional[str] = None,
+        interval: float = PROGRESS_INTERVAL,
+    ) -> None:
+        """
+        Starts measuring a batch job
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - job: the name of the job, used as label of the metrics
+        - total: the number of images to be analysed
+        - workers: the number of threads or processes that analyse them
+        - metrics_path: if given, the file where the metrics are written,
+            in the Prometheus text format (a node exporter reads only the
+            files ending in .prom)
+        - interval: the seconds between two progress lines
+        """
+
+        self.job = job
+        self.total = total
+        self.workers = workers
+        self.metrics_path = metrics_path
+        self.interval = interval
+
+        self.started = 0
+        self.finished: dict[str, int] = {"done": 0, "failed": 0, "skipped": 0}
+        self.busy = 0.0
+        self.stages: dict[str, LatencyHistogram] = {}
+
+        self.__start = time.perf_counter()
+        self.__last_report = self.__start
+        self.__lock = threading.Lock()
+
+    def image_started(self) -> None:
+        """
+        Records that the analysis of an image started
+        """
+
+        with self.__lock:
+            self.started += 1
+
+    def track(self, items: Iterable[T]) -> Iterator[T]:
+        """
+        Records an image as started whenever it is taken from an iterable
+        (for example, by a pool that decodes and submits it)
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - items: the items, one per image
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The same items
+        """
+
+        for item in items:
+            self.image_started()
+            yield item
+
+    def image_finished(
+        self, timings: Optional[StageTimings] = None, status: str = "done"
+    ) -> None:
+        """
+        Records that the analysis of an image ended, and reports the
+        progress if enough time passed since the last report
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - timings: the time spent in each stage of the analysis, if
+            measured
+        - status: "done", "failed" or "skipped" (for example, if the result
+            was in the cache)
+        """
+
+        with self.__lock:
+            self.finished[status] += 1
+            if timings is not None:
+                self.busy += timings.total()
+                for stage, seconds in timings.durations.items():
+                    self.stages.setdefault(stage, LatencyHistogram()).observe(seconds)
+
+            now = time.perf_counter()
+            if now - self.__last_report < self.interval:
+                return
+            self.__last_report = now
+
+        self.report()
+
+    def report(self) -> None:
+        """
+        Prints the progress line, and writes the metrics file
+        """
+
+        summary = self.summary()
+        eta = summary["eta_seconds"]
+        print(
+            f"[{self.job}] {summary['finished']}/{self.total} images "
+            f"({summary['failed']} failed), "
+            f"{summary['images_per_second']:.2f} images/s, "
+            f"ETA {'?' if eta is None else self.__format_seconds(eta)}, "
+            f"queue {summary['queue_depth']}, "
+            f"in progress {summary['in_progress']}, "
+            f"workers busy {summary['worker_utilization']:.0%}"
+        )
+
+        if self.metrics_path is not None:
+            self.__write_atomically(self.metrics_path, self.to_prometheus())
+
+    def finish(self, summary_path: Optional[str] = None) -> dict[str, Any]:
+        """
+        Prints the final throughput, writes the metrics file for the last
+        time, and writes the summary of the job
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - summary_path: if given, the json file where the summary is
+            written
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The summary (see summary)
+        """
+
+        res = self.summary()
+        print(
+            f"[{self.job}] {res['finished']} images in "
+            f"{self.__format_seconds(res['elapsed_seconds'])} "
+            f"({res['done']} done, {res['failed']} failed, "
+            f"{res['skipped']} skipped), "
+            f"{res['images_per_second']:.2f} images/s, "
+            f"workers busy {res['worker_utilization']:.0%}"
+        )
+
+        if self.metrics_path is not None:
+            self.__write_atomically(self.metrics_path, self.to_prometheus())
+        if summary_path is not None:
+            self.__write_atomically(summary_path, json.dumps(res, indent=4))
+        return res
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Computes the current state of the job
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        A dict with the counts of images, the elapsed time, the throughput,
+        the estimated time to the end, the queue depth, the utilization of
+        the workers and the histogram of each stage
+        """
+
+        with self.__lock:
+            elapsed = time.perf_counter() - self.__start
+            finished = sum(self.finished.values())
+            rate = finished / elapsed if elapsed > 0 else 0.0
+
+            return {
+                "job": self.job,
+                "total": self.total,
+                "finished": finished,
+                "done": self.finished["done"],
+                "failed": self.finished["failed"],
+                "skipped": self.finished["skipped"],
+                "queue_depth": self.total - self.started,
+                "in_progress": self.started - finished,
+                "elapsed_seconds": elapsed,
+                "images_per_second": rate,
+                "eta_seconds": (self.total - finished) / rate if rate > 0 else None,
+                "workers": self.workers,
+                "worker_utilization": (
+                    min(1.0, self.busy / (self.workers * elapsed))
+                    if elapsed > 0 and self.workers > 0
+                    else 0.0
+                ),
+                "stages": {
+                    stage: histogram.to_JSON()
+                    for stage, histogram in self.stages.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Formats the current state of the job in the Prometheus text format
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The metrics, one per line
+        """
+
+        summary = self.summary()
+        job = f'job="{self.job}"'
+        p = METRICS_PREFIX
+
+        lines = [
+            f"# HELP {p}_images Images of the job, by status",
+            f"# TYPE {p}_images gauge",
+            f'{p}_images{{{job},status="planned"}} {self.total}',
+        ]
+        for status in ["done", "failed", "skipped"]:
+            lines.append(f'{p}_images{{{job},status="{status}"}} {summary[status]}')
+
+        gauges = [
+            ("queue_depth", "Images not started yet", summary["queue_depth"]),
+            ("in_progress", "Images being analysed", summary["in_progress"]),
+            (
+                "elapsed_seconds",
+                "Time since the job started",
+                summary["elapsed_seconds"],
+            ),
+            ("images_per_second", "Average throughput", summary["images_per_second"]),
+            ("eta_seconds", "Estimated time to the end", summary["eta_seconds"]),
+            ("workers", "Threads or processes of the job", summary["workers"]),
+            (
+                "worker_utilization",
+                "Fraction of the time the workers were busy",
+                summary["worker_utilization"],
+            ),
+            ("last_update_timestamp_seconds", "When the file was written", time.time()),
+        ]
+        for name, description, value in gauges:
+            if value is None:
+                continue
+            lines += [
+                f"# HELP {p}_{name} {description}",
+                f"# TYPE {p}_{name} gauge",
+                f"{p}_{name}{{{job}}} {value}",
+            ]
+
+        lines += [
+            f"# HELP {p}_stage_seconds Time spent in each stage of the analysis of an image",
+            f"# TYPE {p}_stage_seconds histogram",
+        ]
+        for stage, histogram in summary["stages"].items():
+            labels = f'{job},stage="{stage}"'
+            for bound, count in histogram["buckets"].items():
+                lines.append(
+                    f'{p}_stage_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                )
+            lines += [
+                f'{p}_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}',
+                f"{p}_stage_seconds_sum{{{labels}}} {histogram['sum']}",
+                f"{p}_stage_seconds_count{{{labels}}} {histogram['count']}",
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __format_seconds(seconds: float) -> str:
+        """
+        Formats a duration for the progress line
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - seconds: the duration
+
+        ---------------------------------------------------------------------
+        OUTPUT
+        ------
+        The duration, as hours, minutes and seconds
+        """
+
+        minutes, seconds = divmod(round(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours > 0:
+            return f"{hours}h{minutes:02}m{seconds:02}s"
+        return f"{minutes}m{seconds:02}s"
+
+    @staticmethod
+    def __write_atomically(path: str, content: str) -> None:
+        """
+        Writes a file atomically, so that a reader (such as a node
+        exporter) never sees it half-written
+
+        ---------------------------------------------------------------------
+        PARAMETERS
+        ----------
+        - path: the path of the file
+        - content: the content of the file
+        """
+
+        with atomic_write(path, "w", 0o644) as f:
+            f.write(content)
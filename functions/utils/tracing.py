@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from typing import Any, Iterator, Optional
+
+from contextlib import contextmanager
+
+import multiprocessing
+import os
+import threading
+import time
+
+from functions.utils.process_records import ProcessRecords
+
+# Environment variable with the path of the trace being recorded. Being in
+# the environment, it is inherited by the worker processes
+TRACE_ENV = "LEAF_TRACE"
+
+# The events of the trace being recorded, by all the processes
+__events = ProcessRecords(TRACE_ENV)
+
+# Threads whose name was already written to the trace, by process
+__named_threads: set[tuple[int, int]] = set()
+
+
+def start_tracing(path: str) -> None:
+    """
+    Starts recording the spans of this process, and of the worker
+    processes it will start, for a trace in the Chrome trace event format
+    (viewable with chrome://tracing or https://ui.perfetto.dev).
+
+    Each process appends its events to its own file next to the trace
+    (see ProcessRecords), and stop_tracing merges them
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the trace (a json file)
+    """
+
+    __events.start(path)
+
+
+def stop_tracing() -> Optional[str]:
+    """
+    Stops recording, and merges the events of all the processes into the
+    trace. It must be called after the worker processes ended
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The path of the trace, or None if tracing was not started
+    """
+
+    res = __events.stop(lambda events: {"traceEvents": events, "displayTimeUnit": "ms"})
+    return None if res is None else res[0]
+
+
+def tracing_enabled() -> bool:
+    """
+    Tells if the spans are being recorded
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Whether start_tracing was called, by this process or by its parent
+    """
+    return __events.enabled()
+
+
+@contextmanager
+def trace_span(name: str, category: str = "pipeline", **args: Any) -> Iterator[None]:
+    """
+    Records the execution of a block of code as a span of the trace, if
+    tracing is enabled (otherwise it does nothing), as:
+
+        with trace_span("decode", image=path):
+            ...
+
+    The span is tagged with the process and the thread that ran it, so
+    that each worker gets its own line in the trace viewer
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - name: the name of the span
+    - category: the category of the span
+    - args: other tags of the span (for example, the path of the image)
+    """
+
+    if not tracing_enabled():
+        yield
+        return
+
+    start = time.time_ns()
+    try:
+        yield
+    finally:
+        end = time.time_ns()
+        __write_event(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+
+def __write_event(event: dict[str, Any]) -> None:
+    """
+    Appends an event to the file of this process, preceded by the names of
+    the process and of the thread the first time they appear
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - event: the event, in the Chrome trace event format
+    """
+
+    pid, tid = event["pid"], event["tid"]
+    lines = []
+
+    # Each key is added only by its own thread, so no lock is needed
+    if (pid, tid) not in __named_threads:
+        __named_threads.add((pid, tid))
+        lines.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": threading.current_thread().name},
+            }
+        )
+    lines.append(event)
+
+    __events.append(
+        lines,
+        [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": multiprocessing.current_process().name},
+            }
+        ],
+    )
@@ -1,16 +1,24 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Optional
+
 import argparse
 import sys
 import os
 
-from update_dataset import update_dataset
-from clear_dataset_feature import clear_dataset_feature
-from functions.classifiers.bayes.classifier import BAYES_classify
-from functions.classifiers.bayes.check_correlation import (
-    BAYES_check_correlation,
-    BAYES_check_ABS_correlation,
-)
-from functions.classifiers.result import print_classification_result
-from functions.features import ImageFeatures
+if TYPE_CHECKING:
+    from cv2.typing import MatLike
+    import numpy as np
+
+    from functions.classifiers.bayes.binary_model import BinaryBayesModel
+    from functions.classifiers.cache import ClassificationCache
+    from functions.lengths.calibration import PaperCalibration
+    from functions.utils.rectangle import Rectangle
+    from functions.utils.telemetry import StageTimings
+
+# The modules that implement the commands (and their dependencies, such as
+# OpenCV and NumPy) are imported only by the command that needs them, to
+# keep the startup fast. See benchmarks/startup_time.py
 
 
 def args_def() -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentParser]]:
@@ -20,10 +28,176 @@ def args_def() -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentPars
         dest="command",
     )
 
-    subparsers.add_parser(
+    update = subparsers.add_parser(
         name="update",
         help="update the dataset after adding some images or features",
     )
+    update.add_argument(
+        "--bins",
+        "-b",
+        type=int,
+        nargs="+",
+        action="store",
+        help="the numbers of bins to be tried when discretizing the features (default: 10, 2*log10(n), 1+log2(n), sqrt(n))",
+        metavar="NUM",
+    )
+    update.add_argument(
+        "--strategies",
+        "-s",
+        type=str,
+        nargs="+",
+        choices=["quantile", "uniform", "kmeans"],
+        action="store",
+        help="the discretization strategies to be tried (default: quantile)",
+    )
+    update.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        action="store",
+        help="the number of processes used to train the model (default: one per CPU)",
+    )
+    update.add_argument(
+        "--tip",
+        type=str,
+        choices=["hough", "contour"],
+        default="hough",
+        action="store",
+        help="the algorithm that measures the tip angle (default: hough, the one the model was trained with)",
+    )
+    update.add_argument(
+        "--density",
+        type=float,
+        action="store",
+        help="analyse the leaf on the paper sheet resampled to PX_PER_MM pixels per mm, with kernels sized in mm, so that the cost does not depend on the resolution of the camera (default: the native resolution). The density is recorded in the model, and classify and stream use it",
+        metavar="PX_PER_MM",
+    )
+    update.add_argument(
+        "--profile",
+        "-p",
+        type=str,
+        action="store",
+        help="the calibration profile of the rig (see calibrate): the paper sheet and the pixel size are not detected",
+    )
+    update.add_argument(
+        "--check-profile",
+        action="store_true",
+        help="with --profile, detect the paper sheet anyway in the pictures where it is not where the profile expects",
+    )
+    distributed = update.add_mutually_exclusive_group()
+    distributed.add_argument(
+        "--worker",
+        action="store_true",
+        help="only update the descriptions, together with the other workers sharing the dataset folder (then run --reduce)",
+    )
+    distributed.add_argument(
+        "--reduce",
+        action="store_true",
+        help="after the workers are done, build the plant recaps and retrain the model",
+    )
+    distributed.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last update, that stopped, from where it was (with the same options)",
+    )
+    update.add_argument(
+        "--lease",
+        type=float,
+        default=600,
+        action="store",
+        help="with --worker, the seconds after which an image claimed by a worker that crashed is processed by another (default: 600)",
+        metavar="SECONDS",
+    )
+    update.add_argument(
+        "--decoded-cache",
+        type=str,
+        nargs="?",
+        const="./decoded_cache",
+        action="store",
+        help="keep the decoded images in this folder (default: ./decoded_cache), so that extracting their features again does not decode them",
+        metavar="DIR",
+    )
+    update.add_argument(
+        "--decoded-cache-size",
+        type=int,
+        default=4096,
+        action="store",
+        help="the maximum size of the cache of decoded images, in MB (default: 4096)",
+        metavar="MB",
+    )
+    update.add_argument(
+        "--decoded-max-side",
+        type=int,
+        action="store",
+        help="with --decoded-cache, reduce the images to this longest side, in pixels (the features change: only for experiments, so the descriptions record it and the model is not retrained)",
+        metavar="PX",
+    )
+    update.add_argument(
+        "--metrics",
+        type=str,
+        action="store",
+        help="write the progress to this file in the Prometheus text format, for the textfile collector of a node exporter (name it *.prom)",
+        metavar="PATH",
+    )
+    update.add_argument(
+        "--summary",
+        type=str,
+        action="store",
+        help="write the throughput and the time spent in each stage to this json file at the end",
+        metavar="PATH",
+    )
+    update.add_argument(
+        "--trace",
+        type=str,
+        action="store",
+        help="record when each image is decoded, analysed and stored, by every worker, to this json file in the Chrome trace event format (open it with chrome://tracing or ui.perfetto.dev)",
+        metavar="PATH",
+    )
+    update.add_argument(
+        "--memory-profile",
+        type=str,
+        action="store",
+        help="measure the memory allocated by each stage of the analysis with tracemalloc (slower), and write it to this json file at the end. The images are analysed one at a time, as those analysed at the same time would add up",
+        metavar="PATH",
+    )
+    update.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="release each image and its leaf masks as soon as the values computed from them are known",
+    )
+    update.add_argument(
+        "--max-images",
+        type=int,
+        action="store",
+        help="analyse at most N images at the same time (default: one per plant)",
+        metavar="N",
+    )
+    update.add_argument(
+        "--memory-limit",
+        type=int,
+        action="store",
+        help="analyse at the same time only as many images as their estimated memory fits in MB",
+        metavar="MB",
+    )
+
+    calibrate = subparsers.add_parser(
+        name="calibrate",
+        help="detect the paper sheet and the pixel size in a reference picture, and save them as a profile",
+    )
+    calibrate.add_argument(
+        "--img",
+        "-i",
+        type=str,
+        action="store",
+        help="the path to the reference picture, taken with the rig",
+    )
+    calibrate.add_argument(
+        "--name",
+        "-n",
+        type=str,
+        action="store",
+        help="the name of the profile",
+    )
 
     remove_feature = subparsers.add_parser(
         name="rmfeature",
@@ -69,6 +243,168 @@ def args_def() -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentPars
         action="store_true",
         help="if the classification output should include confidences for all classes",
     )
+    classify.add_argument(
+        "--tip",
+        type=str,
+        choices=["hough", "contour"],
+        default="hough",
+        action="store",
+        help="the algorithm that measures the tip angle (default: hough, the one the model was trained with)",
+    )
+    classify.add_argument(
+        "--density",
+        type=float,
+        action="store",
+        help="analyse the leaf on the paper sheet resampled to PX_PER_MM pixels per mm (see update --density). It must be the density the model was trained with (default: that density)",
+        metavar="PX_PER_MM",
+    )
+    classify.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        action="store",
+        help="with --dir, the number of processes that analyse the images (0 for one per CPU, default: 1)",
+    )
+    classify.add_argument(
+        "--cascade",
+        nargs="?",
+        type=float,
+        const=0.95,
+        default=None,
+        action="store",
+        help="extract the features from the cheapest, and stop as soon as the first class leads the second by MARGIN (default: 0.95)",
+        metavar="MARGIN",
+    )
+    classify.add_argument(
+        "--cache",
+        type=str,
+        default="./classification_cache",
+        action="store",
+        help="the folder of the cache of the classification results (default: ./classification_cache)",
+        metavar="DIR",
+    )
+    classify.add_argument(
+        "--cache-size",
+        type=int,
+        default=64,
+        action="store",
+        help="the maximum size of the cache, in MB (default: 64)",
+        metavar="MB",
+    )
+    classify.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always analyse the images, without reading or writing the cache",
+    )
+    classify.add_argument(
+        "--metrics",
+        type=str,
+        action="store",
+        help="with --dir, write the progress to this file in the Prometheus text format, for the textfile collector of a node exporter (name it *.prom)",
+        metavar="PATH",
+    )
+    classify.add_argument(
+        "--summary",
+        type=str,
+        action="store",
+        help="with --dir, write the throughput and the time spent in each stage to this json file at the end",
+        metavar="PATH",
+    )
+    classify.add_argument(
+        "--trace",
+        type=str,
+        action="store",
+        help="record when each image is decoded, analysed and classified, by every worker, to this json file in the Chrome trace event format (open it with chrome://tracing or ui.perfetto.dev)",
+        metavar="PATH",
+    )
+    classify.add_argument(
+        "--memory-profile",
+        type=str,
+        action="store",
+        help="measure the memory allocated by each stage of the analysis with tracemalloc (slower), and write it to this json file at the end",
+        metavar="PATH",
+    )
+    classify.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="release each image and its leaf masks as soon as the values computed from them are known",
+    )
+    classify.add_argument(
+        "--profile",
+        "-p",
+        type=str,
+        action="store",
+        help="the calibration profile of the rig (see calibrate): the paper sheet and the pixel size are not detected",
+    )
+    classify.add_argument(
+        "--check-profile",
+        action="store_true",
+        help="with --profile, detect the paper sheet anyway in the pictures where it is not where the profile expects",
+    )
+    classify.add_argument(
+        "--multi",
+        "-m",
+        action="store_true",
+        help="classify each of the leaves placed on the sheet, reporting where they are (the results are not cached, and --cascade, --jobs, --low-memory, --cache, --cache-size, --metrics and --summary cannot be used)",
+    )
+
+    stream = subparsers.add_parser(
+        name="stream",
+        help="classify the leaves placed one after the other in front of a fixed camera",
+    )
+    stream.add_argument(
+        "--video",
+        "-V",
+        type=str,
+        action="store",
+        help="the path of a video, or the index of a camera",
+    )
+    stream.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="if the classification output should include confidences for all classes",
+    )
+    stream.add_argument(
+        "--tip",
+        type=str,
+        choices=["hough", "contour"],
+        default="hough",
+        action="store",
+        help="the algorithm that measures the tip angle (default: hough, the one the model was trained with)",
+    )
+    stream.add_argument(
+        "--density",
+        type=float,
+        action="store",
+        help="analyse the leaf on the paper sheet resampled to PX_PER_MM pixels per mm (see update --density). It must be the density the model was trained with (default: that density)",
+        metavar="PX_PER_MM",
+    )
+    stream.add_argument(
+        "--cascade",
+        nargs="?",
+        type=float,
+        const=0.95,
+        default=None,
+        action="store",
+        help="extract the features from the cheapest, and stop as soon as the first class leads the second by MARGIN (default: 0.95)",
+        metavar="MARGIN",
+    )
+    stream.add_argument(
+        "--profile",
+        "-p",
+        type=str,
+        action="store",
+        help="the calibration profile of the rig (see calibrate), instead of detecting the paper sheet in the first frame",
+    )
+    stream.add_argument(
+        "--trace",
+        type=str,
+        action="store",
+        help="record when each frame is read, tracked and classified to this json file in the Chrome trace event format (open it with chrome://tracing or ui.perfetto.dev), written when the stream ends",
+        metavar="PATH",
+    )
 
     correlation = subparsers.add_parser(
         name="correlation",
@@ -79,46 +415,641 @@ def args_def() -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentPars
         action="store_true",
         help="Display the absolute value of the correlation, instead of the positive and negative correlation",
     )
+    correlation.add_argument(
+        "--spearman",
+        action="store_true",
+        help="compute the Spearman (rank) correlation, instead of the Pearson one",
+    )
+    correlation.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        action="store",
+        help="the path of a .csv or .json file where to write the matrix",
+    )
+    correlation.add_argument(
+        "--png",
+        type=str,
+        action="store",
+        help="the path of a png image where to draw the matrix",
+    )
+
+    return (
+        args,
+        {"rm": remove_feature, "c": classify, "s": stream, "cal": calibrate},
+    )
+
+
+def classify_image(
+    path: str,
+    tip: str,
+    model: dict[str, Any] | BinaryBayesModel,
+    cache: Optional[ClassificationCache],
+    margin: Optional[float] = None,
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    timings: Optional[StageTimings] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> tuple[dict[str, float], list[str]]:
+    """
+    Classifies an image, reusing the result stored in the cache if the
+    same image was already classified with the same algorithms and model
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the image
+    - tip: the algorithm that measures the tip angle
+    - model: the Bayesian classifier model
+    - cache: the cache of the classification results, if it is enabled
+    - margin: if given, the image is classified in cascade mode (see
+        BAYES_classify_cascade) with this margin
+    - calibration: the calibration of the rig, if known
+    - check_calibration: whether the calibration must be checked against
+        the image before being used
+    - timings: if given, where the time spent in each stage is recorded
+    - low_memory: whether the image is analysed in low memory mode (see
+        ImageFeatures)
+    - density: the pixel density the leaf is analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - a dictionary that associates each plant to the probability estimated
+        for the image to be that specific plant
+    - the features that were used
+    """
+
+    from functions.utils.telemetry import StageTimings
+
+    timings = StageTimings(path) if timings is None else timings
+
+    if cache is not None:
+        with timings.stage("cache"):
+            cached = cache.get(path)
+        if cached is not None:
+            return cached.posterior, cached.features
+
+    posterior, features, values = extract_and_classify(
+        path,
+        None,
+        tip,
+        model,
+        margin,
+        calibration,
+        check_calibration,
+        timings,
+        low_memory,
+        density,
+    )
+
+    if cache is not None:
+        with timings.stage("cache"):
+            cache.put(path, features, values, posterior)
+
+    return posterior, features
+
+
+def extract_and_classify(
+    path: str,
+    img: Optional[MatLike],
+    tip: str,
+    model: dict[str, Any] | BinaryBayesModel,
+    margin: Optional[float] = None,
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    timings: Optional[StageTimings] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> tuple[dict[str, float], list[str], np.ndarray]:
+    """
+    Extracts the features of an image and classifies it
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the image
+    - img: the image already decoded, if available
+    - tip: the algorithm that measures the tip angle
+    - model: the Bayesian classifier model
+    - margin: if given, the image is classified in cascade mode (see
+        BAYES_classify_cascade) with this margin
+    - calibration: the calibration of the rig, if known
+    - check_calibration: whether the calibration must be checked against
+        the image before being used
+    - timings: if given, where the time spent extracting the features and
+        classifying them is recorded (in cascade mode, the two are
+        interleaved, and recorded as a single stage)
+    - low_memory: whether the image is analysed in low memory mode (see
+        ImageFeatures)
+    - density: the pixel density the leaf is analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    - a dictionary that associates each plant to the probability estimated
+        for the image to be that specific plant
+    - the features that were used
+    - the values of those features
+    """
+
+    from functions.features import ImageFeatures
+    from functions.classifiers.bayes.classifier import (
+        BAYES_model_features,
+        BAYES_classify_vector,
+        BAYES_classify_cascade,
+    )
+    from functions.utils.telemetry import StageTimings
+
+    timings = StageTimings(path) if timings is None else timings
+    img_features = ImageFeatures(
+        path, tip, img, calibration, check_calibration, None, low_memory, density
+    )
+
+    if margin is None:
+        features = BAYES_model_features(model)
+        with timings.stage("extract"):
+            values = img_features.get_feature_vector(features)
+        with timings.stage("classify"):
+            posterior = BAYES_classify_vector(values, model)
+    else:
+        with timings.stage("cascade"):
+            posterior, features = BAYES_classify_cascade(
+                lambda feature: img_features.get_feature_vector([feature])[0],
+                model,
+                margin,
+            )
+            values = img_features.get_feature_vector(features)
+
+    return posterior, features, values
+
+
+def classify_frame(
+    img: MatLike,
+    path: str,
+    tip: str,
+    margin: Optional[float],
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> tuple[dict[str, float], list[str], np.ndarray, StageTimings]:
+    """
+    Same as extract_and_classify, but loads the model by itself, and also
+    returns the time spent in each stage: it is the function run by the
+    workers of classify --jobs
+    """
+
+    from functions.classifiers.bayes.classifier import BAYES_load_model
+    from functions.utils.telemetry import StageTimings
+
+    timings = StageTimings(path)
+
+    # The binary model is shared by all the workers, but cannot be used in
+    # cascade mode
+    with timings.stage("load_model"):
+        model = BAYES_load_model(binary=margin is None)
+    return (
+        *extract_and_classify(
+            path,
+            img,
+            tip,
+            model,
+            margin,
+            calibration,
+            check_calibration,
+            timings,
+            low_memory,
+            density,
+        ),
+        timings,
+    )
+
+
+def classify_sheet(
+    path: str,
+    tip: str,
+    model: dict[str, Any] | BinaryBayesModel,
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    density: Optional[float] = None,
+) -> Optional[list[tuple[Rectangle, dict[str, float]]]]:
+    """
+    Classifies all the leaves placed on the sheet of a picture. The paper
+    sheet and the pixel size are computed once, then each leaf is cut out
+    and analysed on its own, and all the leaves are classified together
 
-    return (args, {"rm": remove_feature, "c": classify})
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - path: the path of the picture
+    - tip: the algorithm that measures the tip angle
+    - model: the Bayesian classifier model
+    - calibration: the calibration of the rig, if known
+    - check_calibration: whether the calibration must be checked against
+        the picture before being used
+    - density: the pixel density the leaves are analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    For each leaf (from top to bottom), its bounding box and a dictionary
+    that associates each plant to the probability estimated for the leaf
+    to be that specific plant.
+    None if the file is not an image
+    """
+
+    import cv2
+    import numpy as np
+
+    from functions.features import ImageFeatures
+    from functions.lengths.calibration import PaperCalibration
+    from functions.utils.sheet_leaves import find_sheet_leaves
+    from functions.classifiers.bayes.classifier import (
+        BAYES_model_features,
+        BAYES_classify_batch,
+    )
+
+    img = cv2.imread(path)
+    if img is None:
+        return None
+
+    if calibration is None or (check_calibration and not calibration.matches(img)):
+        calibration = PaperCalibration.detect(img)
+
+    leaves = find_sheet_leaves(img, calibration, density)
+    if len(leaves) == 0:
+        return []
+
+    features = BAYES_model_features(model)
+    values = np.stack(
+        [
+            ImageFeatures(
+                f"{path}#{i}", tip, leaf.img, leaf.calibration, density=density
+            ).get_feature_vector(features)
+            for i, leaf in enumerate(leaves)
+        ]
+    )
+
+    posteriors = BAYES_classify_batch(values, model)
+    return [
+        (leaf.bounding_box, posterior) for leaf, posterior in zip(leaves, posteriors)
+    ]
 
 
 if __name__ == "__main__":
     args_parser, subparsers = args_def()
     args = args_parser.parse_args(sys.argv[1:])
 
+    if getattr(args, "multi", False):
+        # The leaves of a sheet are classified together, one picture at a
+        # time, and their results are not cached
+        classify_parser = subparsers["c"]
+        incompatible = {
+            "--cascade": args.cascade != None,
+            "--jobs": args.jobs != classify_parser.get_default("jobs"),
+            "--low-memory": args.low_memory,
+            "--cache": args.cache != classify_parser.get_default("cache"),
+            "--cache-size": args.cache_size
+            != classify_parser.get_default("cache_size"),
+            "--metrics": args.metrics != None,
+            "--summary": args.summary != None,
+        }
+        for flag, used in incompatible.items():
+            if used:
+                classify_parser.error(f"{flag} cannot be used with --multi")
+
+    if getattr(args, "trace", None) != None:
+        import atexit
+
+        from functions.utils.tracing import start_tracing, stop_tracing
+
+        start_tracing(args.trace)
+        # The events are merged into the trace at exit, even if the command
+        # is interrupted
+        atexit.register(lambda: print(f"Trace written to {stop_tracing()}"))
+
+    if getattr(args, "memory_profile", None) != None:
+        import atexit
+
+        from functions.utils.memory import (
+            start_memory_profile,
+            stop_memory_profile,
+            print_memory_profile,
+        )
+
+        start_memory_profile(args.memory_profile)
+
+        def report_memory_profile() -> None:
+            profile = stop_memory_profile()
+            if profile is not None:
+                print_memory_profile(profile)
+                print(f"Memory profile written to {args.memory_profile}")
+
+        atexit.register(report_memory_profile)
+
     if args.command == "update":
-        update_dataset()
+        from update_dataset import update_dataset, update_worker, reduce_dataset
+
+        calibration = None
+        if args.profile != None:
+            from functions.lengths.calibration import PaperCalibration
+
+            calibration = PaperCalibration.load_profile(args.profile)
+
+        decoded_cache = None
+        if args.decoded_cache != None:
+            from functions.utils.decoded_cache import DecodedImageCache
+
+            decoded_cache = DecodedImageCache(
+                args.decoded_cache,
+                args.decoded_cache_size * 1024 * 1024,
+                args.decoded_max_side,
+            )
+
+        if args.worker:
+            update_worker(
+                args.tip,
+                calibration,
+                args.check_profile,
+                args.lease,
+                decoded_cache,
+                args.low_memory,
+                args.density,
+            )
+        elif args.reduce:
+            reduce_dataset(
+                args.bins, args.strategies, args.jobs, args.tip, args.density
+            )
+        else:
+            update_dataset(
+                args.bins,
+                args.strategies,
+                args.jobs,
+                args.tip,
+                calibration,
+                args.check_profile,
+                decoded_cache,
+                args.resume,
+                args.metrics,
+                args.summary,
+                args.low_memory,
+                args.max_images,
+                (
+                    None
+                    if args.memory_limit is None
+                    else args.memory_limit * 1024 * 1024
+                ),
+                args.density,
+            )
+
+    elif args.command == "calibrate":
+        if args.img == None or args.name == None:
+            subparsers["cal"].print_help()
+        else:
+            import cv2
+
+            from functions.lengths.calibration import PaperCalibration
+
+            img = cv2.imread(args.img)
+            if img is None:
+                print(f'"{args.img}" is not an image')
+            else:
+                calibration = PaperCalibration.detect(img)
+                path = calibration.store_profile(args.name, args.img)
+                print(f"Paper ROI (l, r, t, b): {calibration.roi_boundaries}")
+                print(
+                    f"Pixel size: {calibration.px_width_in_mm:.5f} x "
+                    f"{calibration.px_height_in_mm:.5f} mm"
+                )
+                print(f'Profile "{args.name}" saved to {path}')
 
     elif args.command == "rmfeature":
         if args.feature == None and args.internal == None:
             subparsers["rm"].print_help()
         else:
+            from clear_dataset_feature import clear_dataset_feature
+
             clear_dataset_feature(args.feature, "features")
             clear_dataset_feature(args.internal, "internal")
 
     elif args.command == "classify":
         if args.img == None and args.dir == None:
             subparsers["c"].print_help()
+        else:
+            from functions.features import extractor_version
+            from functions.classifiers.bayes.classifier import (
+                BAYES_analysis_density,
+                BAYES_load_model,
+                BAYES_model_version,
+            )
+            from functions.classifiers.cache import ClassificationCache
+            from functions.classifiers.result import print_classification_result
+            from functions.lengths.calibration import PaperCalibration
+
+            model = BAYES_load_model(binary=args.cascade is None)
+            model_version = BAYES_model_version()
+            # The leaves are analysed at the density of the training images
+            args.density = BAYES_analysis_density(model, args.density)
+            if args.cascade is not None:
+                # Cascade results depend on the margin too
+                model_version += f"/cascade {args.cascade}"
+
+            # The features depend on the profile used instead of detecting
+            # the sheet
+            calibration = None
+            version = extractor_version(args.tip, args.density)
+            if args.profile != None:
+                calibration = PaperCalibration.load_profile(args.profile)
+                version += f"/profile {calibration.to_JSON()} {args.check_profile}"
+
+            cache = None
+            if not args.no_cache and not args.multi:
+                cache = ClassificationCache(
+                    version,
+                    model_version,
+                    args.cache,
+                    args.cache_size * 1024 * 1024,
+                )
+
+        if args.multi and (args.img != None or args.dir != None):
+            from functions.classifiers.result import print_sheet_classification_result
+
+            if args.img != None:
+                paths = [args.img]
+            else:
+                paths = [f"{args.dir}/{name}" for name in os.listdir(args.dir)]
+
+            for path in paths:
+                print(f'Starting analizing picture "{os.path.basename(path)}"...')
+                results = None
+                if os.path.isfile(path):
+                    results = classify_sheet(
+                        path,
+                        args.tip,
+                        model,
+                        calibration,
+                        args.check_profile,
+                        args.density,
+                    )
+
+                if results is None:
+                    print(f'"{os.path.basename(path)}" is not an image')
+                else:
+                    print_sheet_classification_result(results, args.verbose)
+                print("============================================================")
+
         elif args.img != None:
             print("Starting analizing picture...")
-            img = ImageFeatures(args.img)
-            print_classification_result(BAYES_classify(img.get_features()), args.verbose)
-        else:
-            for img_name in os.listdir(args.dir):
+            posterior, used = classify_image(
+                args.img,
+                args.tip,
+                model,
+                cache,
+                args.cascade,
+                calibration,
+                args.check_profile,
+                None,
+                args.low_memory,
+                args.density,
+            )
+            print_classification_result(
+                posterior, args.verbose, None if args.cascade is None else used
+            )
+        elif args.dir != None and args.jobs != 1:
+            from functions.utils.shared_frames import SharedFramePool
+            from functions.utils.telemetry import BatchTelemetry, StageTimings
+
+            names = os.listdir(args.dir)
+            telemetry = BatchTelemetry(
+                "classify", len(names), args.jobs or os.cpu_count() or 1, args.metrics
+            )
+
+            # Images in the cache are reported at once, the others are
+            # decoded here and analysed by the workers
+            to_analyse = []
+            for img_name in names:
+                path = f"{args.dir}/{img_name}"
+                cached = None
+                timings = StageTimings(path)
+                if cache is not None and os.path.isfile(path):
+                    with timings.stage("cache"):
+                        cached = cache.get(path)
+                if cached is None:
+                    to_analyse.append(
+                        (
+                            path,
+                            (
+                                path,
+                                args.tip,
+                                args.cascade,
+                                calibration,
+                                args.check_profile,
+                                args.low_memory,
+                                args.density,
+                            ),
+                        )
+                    )
+                else:
+                    telemetry.image_started()
+                    print(f'Starting analizing picture "{img_name}"...')
+                    print_classification_result(
+                        cached.posterior,
+                        args.verbose,
+                        None if args.cascade is None else cached.features,
+                    )
+                    print("============================================================")
+                    telemetry.image_finished(timings)
+
+            with SharedFramePool(classify_frame, args.jobs or None) as pool:
+                for path, result in pool.map(telemetry.track(to_analyse)):
+                    print(f'Starting analizing picture "{os.path.basename(path)}"...')
+                    if result is None:
+                        print(f'"{os.path.basename(path)}" is not an image')
+                        telemetry.image_finished(None, "skipped")
+                    else:
+                        posterior, used, values, timings = result
+                        if cache is not None:
+                            with timings.stage("cache"):
+                                cache.put(path, used, values, posterior)
+                        print_classification_result(
+                            posterior, args.verbose, None if args.cascade is None else used
+                        )
+                        telemetry.image_finished(timings)
+                    print("============================================================")
+
+            telemetry.finish(args.summary)
+
+        elif args.dir != None:
+            from functions.utils.telemetry import BatchTelemetry, StageTimings
+
+            names = os.listdir(args.dir)
+            telemetry = BatchTelemetry("classify", len(names), 1, args.metrics)
+
+            for img_name in names:
                 print(f'Starting analizing picture "{img_name}"...')
+                telemetry.image_started()
+                timings = StageTimings(f"{args.dir}/{img_name}")
                 try:
-                    img = ImageFeatures(f"{args.dir}/{img_name}")
-                    print_classification_result(BAYES_classify(img.get_features()), args.verbose)
-                except AttributeError:
+                    posterior, used = classify_image(
+                        f"{args.dir}/{img_name}",
+                        args.tip,
+                        model,
+                        cache,
+                        args.cascade,
+                        calibration,
+                        args.check_profile,
+                        timings,
+                        args.low_memory,
+                        args.density,
+                    )
+                    print_classification_result(
+                        posterior, args.verbose, None if args.cascade is None else used
+                    )
+                    telemetry.image_finished(timings)
+                except (AttributeError, IsADirectoryError):
                     print(f'"{img_name}" is not an image')
+                    telemetry.image_finished(None, "skipped")
                 print("============================================================")
 
+            telemetry.finish(args.summary)
+
+    elif args.command == "stream":
+        if args.video == None:
+            subparsers["s"].print_help()
+        else:
+            from classify_stream import classify_stream
+
+            calibration = None
+            if args.profile != None:
+                from functions.lengths.calibration import PaperCalibration
+
+                calibration = PaperCalibration.load_profile(args.profile)
+
+            classify_stream(
+                args.video,
+                args.tip,
+                args.cascade,
+                calibration,
+                args.verbose,
+                args.density,
+            )
+
     elif args.command == "correlation":
+        from functions.classifiers.bayes.check_correlation import (
+            BAYES_check_correlation,
+            BAYES_check_ABS_correlation,
+        )
+
+        method = "spearman" if args.spearman else "pearson"
         if args.abs:
-            BAYES_check_ABS_correlation()
+            BAYES_check_ABS_correlation(method, args.output, args.png)
         else:
-            BAYES_check_correlation()
+            BAYES_check_correlation(False, method, args.output, args.png)
 
     else:
         args_parser.print_help()
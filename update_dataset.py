@@ -2,20 +2,168 @@ import os
 import cv2
 
 from functions.features import ImageFeatures
-from functions.classifiers.bayes.summarize_dataset import BAYES_summarize_dataset
+from functions.lengths.calibration import PaperCalibration
+from functions.classifiers.bayes.summarize_dataset import (
+    BAYES_summarize_dataset,
+    load_plant_recap,
+)
+from functions.classifiers.bayes.check_correlation import CorrelationStats
 
 import threading
 import json
+import random
+import time
 
+from typing import Any, Optional
 
-def update_dataset() -> None:
+from functions.utils.lease import FileLease, worker_id
+from functions.utils.decoded_cache import DecodedImageCache
+from functions.utils.checkpoint import UpdateCheckpoint
+from functions.utils.telemetry import BatchTelemetry, StageTimings
+from functions.utils.memory import MemoryBudget, memory_profiling_enabled
+
+# Folder of the lock files of the images claimed by the workers of a
+# distributed update
+LOCKS_PATH = "./dataset/locks"
+
+# Seconds a worker waits before looking again for images to process, when
+# all the remaining ones are claimed by other workers
+WORKER_POLL_INTERVAL = 10
+
+
+def update_dataset(
+    num_bins_options: Optional[list[int]] = None,
+    strategies: Optional[list[str]] = None,
+    workers: Optional[int] = None,
+    tip_estimator: str = "hough",
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    decoded_cache: Optional[DecodedImageCache] = None,
+    resume: bool = False,
+    metrics_path: Optional[str] = None,
+    summary_path: Optional[str] = None,
+    low_memory: bool = False,
+    max_images: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+    density: Optional[float] = None,
+) -> None:
+    """
+    Updates the cached features of all the images in the dataset, then
+    retrains the bayes model.
+    The plants are processed at the same time, one thread each: the
+    number of images analysed at once can be limited with max_images and
+    memory_limit.
+    The progress is recorded in an UpdateCheckpoint: the images that raise
+    an error are put in quarantine and excluded from the model, and an
+    update that stopped can be resumed, skipping the plants it completed
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - num_bins_options: the numbers of bins to be tried when discretizing
+        the features (None for the default ones)
+    - strategies: the discretization strategies to be tried (None for
+        quantile only)
+    - workers: the number of processes used to discretize the features
+        (None for one per CPU)
+    - tip_estimator: the algorithm that computes the tip angle (see
+        TIP_ANGLE_ESTIMATORS)
+    - calibration: the calibration of the rig used for all the images, if
+        known (the paper sheet and the pixel size are not detected then)
+    - check_calibration: whether the calibration must be checked against
+        each image before being used
+    - decoded_cache: if given, the images to be analysed are taken from
+        this cache of decoded images. If it reduces the images, only the
+        descriptions are updated: the model is not retrained with them
+    - resume: whether the last update, that stopped, should be continued
+        (it must have been started with the same options)
+    - metrics_path: if given, the file where the progress of the analysis
+        of the images is written, in the Prometheus text format (see
+        BatchTelemetry)
+    - summary_path: if given, the json file where the summary of the
+        analysis of the images is written
+    - low_memory: whether the images are analysed in low memory mode (see
+        ImageFeatures)
+    - max_images: the maximum number of images analysed at the same time
+        (None for one per plant, or one if the memory profile is enabled)
+    - memory_limit: if given, the images analysed at the same time must
+        fit in this memory, in bytes (see MemoryBudget)
+    - density: the pixel density the leaves are analysed at, if any (see
+        ImageFeatures)
+    """
     print(f"Updating dataset...")
 
+    if memory_profiling_enabled():
+        # tracemalloc measures the whole process: the images analysed at the
+        # same time by the threads would reset and add up to each other's
+        # peaks
+        if max_images is not None and max_images > 1:
+            raise Exception(
+                "The memory profile measures one image at a time: use it with "
+                "--max-images 1"
+            )
+        max_images = 1
+
+    # The options that change the features: an update cannot be resumed
+    # with different ones
+    options = {
+        "tip_estimator": tip_estimator,
+        "calibration": None if calibration is None else calibration.to_JSON(),
+        "check_calibration": check_calibration,
+        "density": density,
+        "max_side": None if decoded_cache is None else decoded_cache.max_side,
+    }
+    # The features of reduced images must not reach the plant recaps, the
+    # correlations nor the model
+    reduced = options["max_side"] is not None
+    if resume:
+        checkpoint = UpdateCheckpoint.resume(options)
+    else:
+        checkpoint = UpdateCheckpoint.start(options)
+
     leaves = os.listdir("./dataset/images")
     threads = []
 
-    for leaf in leaves:
-        threads.append(threading.Thread(target=process_plant, args=(leaf,)))
+    # Each thread keeps the correlation statistics of its own plant
+    correlations = [CorrelationStats() for _ in leaves]
+
+    to_update = [leaf for leaf in leaves if leaf not in checkpoint.done_plants]
+    budget = MemoryBudget(max_images, memory_limit)
+    telemetry = BatchTelemetry(
+        "update",
+        sum(len(os.listdir(f"./dataset/images/{leaf}")) for leaf in to_update),
+        len(to_update) if max_images is None else min(max_images, len(to_update)),
+        metrics_path,
+    )
+
+    for leaf, correlation in zip(leaves, correlations):
+        if leaf in checkpoint.done_plants:
+            # Completed before the update stopped
+            if not reduced:
+                recap = load_plant_recap(leaf)
+                for values in zip(*recap.values()):
+                    correlation.add(dict(zip(recap.keys(), values)))
+            print(f'Dataset for plant "{leaf}" was already updated.')
+            continue
+
+        threads.append(
+            threading.Thread(
+                target=process_plant,
+                args=(
+                    leaf,
+                    correlation,
+                    tip_estimator,
+                    calibration,
+                    check_calibration,
+                    decoded_cache,
+                    checkpoint,
+                    telemetry,
+                    budget,
+                    low_memory,
+                    density,
+                ),
+            )
+        )
 
     for thread in threads:
         thread.start()
@@ -23,13 +171,66 @@ def update_dataset() -> None:
     for thread in threads:
         thread.join()
 
+    telemetry.finish(summary_path)
+
+    incomplete = [leaf for leaf in leaves if leaf not in checkpoint.done_plants]
+    if len(incomplete) > 0:
+        # A plant whose images are all in quarantine cannot complete, even
+        # when resumed: the images must be fixed or released first
+        quarantined = [
+            image
+            for leaf in incomplete
+            for image in checkpoint.quarantined_images(leaf)
+        ]
+        message = (
+            f"The update of {', '.join(incomplete)} did not complete: fix the "
+            "errors above and run update --resume"
+        )
+        if len(quarantined) > 0:
+            message += (
+                f". These images are in quarantine, and are skipped until "
+                f"they are modified or removed from {checkpoint.quarantine_path}: "
+                f"{', '.join(quarantined)}"
+            )
+        raise Exception(message)
+
+    if reduced:
+        print(
+            "\nDescriptions of the reduced images updated: the plant recaps, "
+            "the correlations and the bayes model are not"
+        )
+        checkpoint.complete()
+        return
+
+    all_correlations = CorrelationStats()
+    for correlation in correlations:
+        all_correlations.merge(correlation)
+    all_correlations.store_to_file()
+
     print("\nDataset update complete!")
     print("Updating bayes model...")
-    BAYES_summarize_dataset()
+    BAYES_summarize_dataset(
+        num_bins_options, strategies, workers=workers, density=density
+    )
     print("Bayes model update complete!")
 
+    checkpoint.complete()
+
 
-def process_plant(leaf: str) -> None:
+def process_plant(
+    leaf: str,
+    correlation: CorrelationStats,
+    tip_estimator: str = "hough",
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    decoded_cache: Optional[DecodedImageCache] = None,
+    checkpoint: Optional[UpdateCheckpoint] = None,
+    telemetry: Optional[BatchTelemetry] = None,
+    budget: Optional[MemoryBudget] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> None:
+    budget = MemoryBudget() if budget is None else budget
     files_list = os.listdir(f"./dataset/images/{leaf}")
 
     # If the descriptions folder does not exist, create it
@@ -43,8 +244,407 @@ def process_plant(leaf: str) -> None:
         json_path = (
             f"./dataset/descriptions/{leaf}/{os.path.splitext(img_file_name)[0]}.json"
         )
+        image = f"{leaf}/{img_file_name}"
+
+        if telemetry is not None:
+            telemetry.image_started()
+
+        if checkpoint is not None:
+            if checkpoint.is_quarantined(image, img_path):
+                print(f'"{image}" is in quarantine: skipped')
+                if telemetry is not None:
+                    telemetry.image_finished(None, "skipped")
+                continue
+            checkpoint.started(image)
+
+        timings = StageTimings(img_path)
+        try:
+            with budget.admit(img_path):
+                features = __update_description(
+                    img_path,
+                    json_path,
+                    tip_estimator,
+                    calibration,
+                    check_calibration,
+                    decoded_cache,
+                    timings,
+                    low_memory,
+                    density,
+                )
+        except Exception as e:
+            if telemetry is not None:
+                telemetry.image_finished(timings, "failed")
+            if checkpoint is None:
+                raise
+            # A single bad image must not stop the whole plant
+            checkpoint.failed(image, img_path, f"{type(e).__name__}: {e}")
+            print(f'"{image}" failed ({type(e).__name__}: {e}): put in quarantine')
+            continue
+
+        if telemetry is not None:
+            telemetry.image_finished(timings)
+        if checkpoint is not None:
+            checkpoint.done(image)
+        all_leaves_list.append(features)
+        correlation.add(features)
+
+    if len(all_leaves_list) == 0:
+        print(f'No image of plant "{leaf}" could be analysed')
+        return
+
+    all_leaves_data = {}
+    for feature in all_leaves_list[0].keys():
+        all_leaves_data[feature] = [leaf[feature] for leaf in all_leaves_list]
+
+    if decoded_cache is None or decoded_cache.max_side is None:
+        # The recaps are the training data of the model: the features of
+        # reduced images must not replace them
+        with open(f"./dataset/plant_recaps/{leaf}.json", "w") as f:
+            json.dump(all_leaves_data, f)
+
+    if checkpoint is not None:
+        checkpoint.plant_done(leaf)
+    print(f'Dataset for plant "{leaf}" is now updated.')
+
+
+def update_worker(
+    tip_estimator: str = "hough",
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    lease_duration: Optional[float] = None,
+    decoded_cache: Optional[DecodedImageCache] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> None:
+    """
+    Updates the descriptions of the images of the dataset together with
+    other workers, possibly on other machines sharing the dataset folder.
+    Each image is claimed with a lease (see FileLease) before being
+    processed, so that no two workers process it at the same time. The
+    leases of crashed workers expire, and their images are then processed
+    by the others.
+    The worker stops when all the descriptions are up to date; then
+    reduce_dataset builds the plant recaps and retrains the model
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - tip_estimator: the algorithm that computes the tip angle (see
+        TIP_ANGLE_ESTIMATORS)
+    - calibration: the calibration of the rig used for all the images, if
+        known
+    - check_calibration: whether the calibration must be checked against
+        each image before being used
+    - lease_duration: the duration of the leases, in seconds (None for
+        DEFAULT_LEASE_DURATION). It should be longer than the time needed
+        to process an image, or other workers take the image over
+    - decoded_cache: if given, the images to be analysed are taken from
+        this cache of decoded images
+    - low_memory: whether the images are analysed in low memory mode (see
+        ImageFeatures)
+    - density: the pixel density the leaves are analysed at, if any (see
+        ImageFeatures)
+    """
+
+    print(f"Worker {worker_id()} started")
+    processed = 0
+
+    while True:
+        pending = pending_images(tip_estimator, density, decoded_cache)
+        if len(pending) == 0:
+            break
+
+        # Workers that start together would otherwise contend for the
+        # same images
+        random.shuffle(pending)
+
+        claimed = False
+        for leaf, img_file_name in pending:
+            lease = FileLease.try_acquire(
+                f"{LOCKS_PATH}/{leaf}/{img_file_name}.lock", lease_duration
+            )
+            if lease is None:
+                continue
+
+            claimed = True
+            try:
+                if process_image(
+                    leaf,
+                    img_file_name,
+                    tip_estimator,
+                    calibration,
+                    check_calibration,
+                    lease,
+                    decoded_cache,
+                    low_memory,
+                    density,
+                ):
+                    processed += 1
+            finally:
+                lease.release()
+
+        if not claimed:
+            # The remaining images are claimed by other workers: wait for
+            # them to finish, or for their leases to expire
+            time.sleep(WORKER_POLL_INTERVAL)
+
+    print(f"Worker {worker_id()} done: {processed} images processed")
+
 
-        img_features = ImageFeatures(img_path)
+def reduce_dataset(
+    num_bins_options: Optional[list[int]] = None,
+    strategies: Optional[list[str]] = None,
+    workers: Optional[int] = None,
+    tip_estimator: str = "hough",
+    density: Optional[float] = None,
+) -> None:
+    """
+    Completes a distributed update: once the workers have updated all the
+    descriptions, builds the plant recaps and the correlation statistics,
+    and retrains the bayes model
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - num_bins_options: the numbers of bins to be tried when discretizing
+        the features (None for the default ones)
+    - strategies: the discretization strategies to be tried (None for
+        quantile only)
+    - workers: the number of processes used to discretize the features
+        (None for one per CPU)
+    - tip_estimator: the algorithm that computes the tip angle (see
+        TIP_ANGLE_ESTIMATORS)
+    - density: the pixel density the workers analysed the leaves at, if
+        any
+    """
+
+    pending = pending_images(tip_estimator, density)
+    if len(pending) > 0:
+        raise Exception(
+            f"{len(pending)} images are not described yet, or only reduced "
+            f'(for example, "{pending[0][0]}/{pending[0][1]}"): run more workers '
+            "(without --decoded-max-side) first"
+        )
+
+    # All the descriptions are loaded, nothing is computed
+    update_dataset(
+        num_bins_options, strategies, workers, tip_estimator, density=density
+    )
+
+
+def pending_images(
+    tip_estimator: str = "hough",
+    density: Optional[float] = None,
+    decoded_cache: Optional[DecodedImageCache] = None,
+) -> list[tuple[str, str]]:
+    """
+    Lists the images of the dataset whose description is missing, older
+    than the image, or incomplete
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - tip_estimator: the algorithm that computes the tip angle
+    - density: the pixel density the leaves are analysed at, if any
+    - decoded_cache: the cache the images are taken from, if any (the
+        descriptions of images it reduces are not those of the full ones)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The plant and the file name of each image
+    """
+
+    res = []
+    for leaf in os.listdir("./dataset/images"):
+        for img_file_name in os.listdir(f"./dataset/images/{leaf}"):
+            img_path = f"./dataset/images/{leaf}/{img_file_name}"
+            json_path = f"./dataset/descriptions/{leaf}/{os.path.splitext(img_file_name)[0]}.json"
+
+            if not __is_description_current(
+                img_path, json_path, tip_estimator, density, decoded_cache
+            ):
+                res.append((leaf, img_file_name))
+
+    return res
+
+
+def process_image(
+    leaf: str,
+    img_file_name: str,
+    tip_estimator: str = "hough",
+    calibration: Optional[PaperCalibration] = None,
+    check_calibration: bool = False,
+    lease: Optional[FileLease] = None,
+    decoded_cache: Optional[DecodedImageCache] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> bool:
+    """
+    Updates the description of an image of the dataset, if it is not up
+    to date. The description is written atomically, so that other
+    processes never read it half-written
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - leaf: the plant
+    - img_file_name: the file name of the image
+    - tip_estimator: the algorithm that computes the tip angle
+    - calibration: the calibration of the rig, if known
+    - check_calibration: whether the calibration must be checked against
+        the image before being used
+    - lease: the lease on the image, if it was claimed: the description is
+        not written if the lease was lost in the meantime
+    - decoded_cache: if given, the image is taken from this cache of
+        decoded images
+    - low_memory: whether the image is analysed in low memory mode (see
+        ImageFeatures)
+    - density: the pixel density the leaf is analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Whether the description was written
+    """
+
+    img_path = f"./dataset/images/{leaf}/{img_file_name}"
+    json_path = (
+        f"./dataset/descriptions/{leaf}/{os.path.splitext(img_file_name)[0]}.json"
+    )
+
+    # Another worker may have completed it after the list was made
+    if __is_description_current(
+        img_path, json_path, tip_estimator, density, decoded_cache
+    ):
+        return False
+
+    os.makedirs(f"./dataset/descriptions/{leaf}", exist_ok=True)
+
+    img_features = ImageFeatures(
+        img_path,
+        tip_estimator,
+        None,
+        calibration,
+        check_calibration,
+        decoded_cache,
+        low_memory,
+        density,
+    )
+    if os.path.exists(json_path) and os.path.getmtime(img_path) < os.path.getmtime(
+        json_path
+    ):
+        img_features.load_details_from_file(json_path)
+
+    tmp_path = f"{json_path}.{worker_id()}.tmp"
+    img_features.store_to_file(tmp_path, force=True)
+
+    if lease is not None and not lease.held():
+        os.remove(tmp_path)
+        print(f'Lease on "{leaf}/{img_file_name}" lost: its description is discarded')
+        return False
+
+    os.replace(tmp_path, json_path)
+    print(f'Description of "{leaf}/{img_file_name}" updated')
+    return True
+
+
+def __is_description_current(
+    img_path: str,
+    json_path: str,
+    tip_estimator: str,
+    density: Optional[float] = None,
+    decoded_cache: Optional[DecodedImageCache] = None,
+) -> bool:
+    """
+    Tells if the description of an image is up to date: it exists, it is
+    newer than the image, and it contains all the values
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img_path: the path of the image
+    - json_path: the path of its description
+    - tip_estimator: the algorithm that computes the tip angle
+    - density: the pixel density the leaf is analysed at, if any
+    - decoded_cache: the cache the image is taken from, if any
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    Whether the description is up to date
+    """
+
+    try:
+        if os.path.getmtime(img_path) >= os.path.getmtime(json_path):
+            return False
+        return (
+            ImageFeatures(
+                img_path, tip_estimator, decoded_cache=decoded_cache, density=density
+            )
+            .load_details_from_file(json_path)
+            .is_complete()
+        )
+    except (OSError, ValueError, KeyError):
+        # Missing, or being replaced
+        return False
+
+
+def __update_description(
+    img_path: str,
+    json_path: str,
+    tip_estimator: str,
+    calibration: Optional[PaperCalibration],
+    check_calibration: bool,
+    decoded_cache: Optional[DecodedImageCache],
+    timings: Optional[StageTimings] = None,
+    low_memory: bool = False,
+    density: Optional[float] = None,
+) -> dict[str, Any]:
+    """
+    Computes the features of an image, reusing its description if it is
+    up to date, and stores the description if anything was computed. The
+    description is written atomically, so that an update that is killed
+    never leaves it half-written
+
+    ---------------------------------------------------------------------
+    PARAMETERS
+    ----------
+    - img_path: the path of the image
+    - json_path: the path of its description
+    - tip_estimator: the algorithm that computes the tip angle
+    - calibration: the calibration of the rig, if known
+    - check_calibration: whether the calibration must be checked against
+        the image before being used
+    - decoded_cache: if given, the image is taken from this cache of
+        decoded images
+    - timings: if given, where the time spent loading the description,
+        extracting the values and storing them is recorded
+    - low_memory: whether the image is analysed in low memory mode (see
+        ImageFeatures)
+    - density: the pixel density the leaf is analysed at, if any (see
+        ImageFeatures)
+
+    ---------------------------------------------------------------------
+    OUTPUT
+    ------
+    The features of the image
+    """
+
+    timings = StageTimings(img_path) if timings is None else timings
+
+    with timings.stage("load"):
+        img_features = ImageFeatures(
+            img_path,
+            tip_estimator,
+            None,
+            calibration,
+            check_calibration,
+            decoded_cache,
+            low_memory,
+            density,
+        )
 
         if os.path.exists(json_path):
             json_last_modify = os.path.getmtime(json_path)
@@ -54,18 +654,21 @@ def process_plant(leaf: str) -> None:
                 # Load json data only if the json exists and the image has not changed since its computation
                 img_features.load_details_from_file(json_path)
 
-        # If there were updates, update the file
-        img_features.store_to_file(json_path)
-        all_leaves_list.append(img_features.get_features())
+    with timings.stage("extract"):
+        # Computes all the values that are not known yet
+        img_features.to_JSON()
 
-    all_leaves_data = {}
-    for feature in all_leaves_list[0].keys():
-        all_leaves_data[feature] = [leaf[feature] for leaf in all_leaves_list]
+    # If there were updates, update the file
+    with timings.stage("store"):
+        tmp_path = f"{json_path}.tmp"
+        if os.path.exists(tmp_path):
+            # Left by an update that was killed
+            os.remove(tmp_path)
+        img_features.store_to_file(tmp_path)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, json_path)
 
-    with open(f"./dataset/plant_recaps/{leaf}.json", "w") as f:
-        json.dump(all_leaves_data, f)
-
-    print(f'Dataset for plant "{leaf}" is now updated.')
+    return img_features.get_features()
 
 
 if __name__ == "__main__":